@@ -8,16 +8,23 @@ report on a specified Nutanix Prism Central instance
 import os
 import os.path
 import sys
+import json
 import socket
 import getpass
 import argparse
+from threading import Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from time import localtime, strftime
 from string import Template
 
 try:
     import urllib3
     import requests
+    from requests.adapters import HTTPAdapter
     from requests.auth import HTTPBasicAuth
+    from urllib3.util.retry import Retry
 except ModuleNotFoundError as error:
     # Output expected ImportErrors.
     print(f'''
@@ -55,7 +62,11 @@ class EnvironmentOptions():
         self.password = ""
         self.debug = False
         self.read_timeout = 10
-        self.entity_response_length = 20
+        # entities requested per page, and the number of pages of each
+        # entity type requested at the same time
+        # every entity is included in the report, no matter the page size
+        self.entity_response_length = 500
+        self.page_concurrency = 4
         # these are the supported entities for this environment
         # self.supported_entities = ['vm', 'subnet', 'cluster', 'project',
         #                            'network_security_rule', 'image',
@@ -72,6 +83,7 @@ class EnvironmentOptions():
         return (f'{self.__class__.__name__}(cluster_ip={self.cluster_ip},'
                 f'username={self.username},password=<hidden>,'
                 f'entity_response_length={self.entity_response_length},'
+                f'page_concurrency={self.page_concurrency},'
                 f'read_timeout={self.read_timeout},debug={self.debug})')
 
     def get_options(self):
@@ -106,6 +118,20 @@ class EnvironmentOptions():
             '--debug',
             help='Enable/disable debug mode'
         )
+        parser.add_argument(
+            '-s',
+            '--page-size',
+            type=int,
+            default=self.entity_response_length,
+            help='Entities requested per page (maximum 500)'
+        )
+        parser.add_argument(
+            '-c',
+            '--concurrency',
+            type=int,
+            default=self.page_concurrency,
+            help='Pages of each entity type requested at the same time'
+        )
 
         args = parser.parse_args()
 
@@ -126,6 +152,54 @@ class EnvironmentOptions():
 
         self.debug = True if args.debug == 'enable' else False
 
+        self.entity_response_length = min(max(args.page_size, 1), 500)
+        self.page_concurrency = max(args.concurrency, 1)
+
+
+SESSIONS = {}
+SESSIONS_LOCK = Lock()
+
+
+def get_session(username, password, pool_size=10, retries=3,
+                backoff_factor=0.5, retry_post=False):
+    '''
+    return the requests.Session shared by every ApiClient that uses
+    these credentials, creating it the first time it is needed
+    the session keeps connections to Prism Central open between
+    requests, so only the first request pays for the TCP connection
+    and TLS handshake
+    retry rule: requests that fail with a connection error or a
+    429/502/503/504 response are retried with exponential backoff;
+    GET requests are always retried, POST requests only when
+    retry_post is True
+    this script passes retry_post=True: it only sends v3 list POST
+    requests, which are read-only, so retrying them is safe
+    the session is created by the first call, so its settings come
+    from that call
+    '''
+    with SESSIONS_LOCK:
+        session = SESSIONS.get((username, password))
+        if session is None:
+            session = requests.Session()
+            session.auth = HTTPBasicAuth(username, password)
+            session.headers.update({
+                'Content-Type': 'application/json; charset=utf-8',
+                'Accept-Encoding': 'gzip, deflate',
+                'Connection': 'keep-alive',
+            })
+            retry = Retry(total=retries,
+                          backoff_factor=backoff_factor,
+                          status_forcelist=(429, 502, 503, 504),
+                          allowed_methods=frozenset(
+                              ['GET', 'POST'] if retry_post else ['GET']),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=pool_size,
+                                  max_retries=retry)
+            session.mount('https://', adapter)
+            SESSIONS[(username, password)] = session
+        return session
+
 
 class ApiClient():
     '''
@@ -157,20 +231,21 @@ class ApiClient():
                 f'request_url={self.request_url},'
                 f'body (payload)={self.body})')
 
-    def send_request(self):
+    def send_request(self, body=None):
         '''
         send the API request based on the parameters we
         have already collected
+        body overrides the client's own body for this request only, so
+        several pages can be requested through one client at once
         '''
 
-        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        session = get_session(self.username, self.password,
+                              retry_post=True)
         try:
-            api_request = requests.post(
+            api_request = session.post(
                 self.request_url,
-                data=self.body,
+                data=self.body if body is None else body,
                 verify=False,
-                headers=headers,
-                auth=HTTPBasicAuth(self.username, self.password),
                 timeout=self.timeout,
             )
         except requests.ConnectTimeout:
@@ -217,307 +292,365 @@ class ApiClient():
                 print("Connected and authenticated successfully.")
         return api_request.json()
 
+    def iter_entities(self, kind, page_size=20, concurrency=1):
+        '''
+        generator that yields one entity at a time from this client's
+        list endpoint e.g. 'vms/list', requesting page_size entities
+        per request and moving the offset forward until all matching
+        entities have been returned
+        the first page is requested on its own to find total_matches,
+        which is then available as self.total_matches; with concurrency
+        above 1 the remaining pages are requested that many at a time,
+        but entities are still yielded in order
+        each page is discarded as soon as its entities have been
+        handed out, so only a few pages are held in memory at a time,
+        no matter how many entities exist
+        '''
+        def get_page(offset):
+            return self.send_request(json.dumps({'kind': kind,
+                                                 'length': page_size,
+                                                 'offset': offset}))
+
+        page = get_page(0)
+        entities = page.get('entities', [])
+        self.total_matches = page.get('metadata', {}).get('total_matches', 0)
+        del page
+        yield from entities
+        if not entities:
+            return
+
+        offsets = iter(range(len(entities), self.total_matches, page_size))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = deque(executor.submit(get_page, offset)
+                              for offset in islice(offsets, concurrency))
+            while in_flight:
+                page = in_flight.popleft().result()
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    in_flight.append(executor.submit(get_page, next_offset))
+                entities = page.get('entities', [])
+                del page
+                yield from entities
+
 
 HTML_ROWS = {}
 ENTITY_TOTALS = {}
+# resources allocated across all VMs, added up while the VM pages stream in
+VM_RESOURCE_TOTALS = {}
 
 
-def generate_template(json_results):
+def data_error_row(entity_label):
     '''
-    generate the HTML
+    table row shown in place of an entity section when the JSON
+    response doesn't contain the expected data
     '''
-    day = strftime('%d-%b-%Y', localtime())
-    time = strftime('%H%M%S', localtime())
-    now = f'{day}_{time}'
-    html_filename = f'{now}_prism_central.html'
+    return ('<tr><td colspan="2">'
+            f'Expected {entity_label} data is missing or malformed.  '
+            'Please check the JSON response.</td></tr>')
+
+
+'''
+the next section has one render function per entity type
+each function takes that entity type's list of entities and returns the
+HTML table rows for it; the sections don't depend on each other, so each
+one builds a list of row strings and joins them once at the end instead
+of repeatedly concatenating onto one long string
+
+note that these functions seem a little repetitive, but the string
+formatting for each entity is different enough to do it this way
+if each entity's info 'block' was the same, we could setup an iterator
+or use common formatting, but then the generated HTML wouldn't be very
+useful
+'''
+
+
+def render_vms(entities):
+    '''
+    render the VM rows
+    '''
+    print("Processing VMs ...")
+    rows = []
+    vcpus = memory_mib = disk_mib = 0
+    for vm in entities:
+        try:
+            resources = vm['spec'].get('resources', {})
+            vcpus += (resources.get('num_sockets', 0)
+                      * resources.get('num_vcpus_per_socket', 1))
+            memory_mib += resources.get('memory_size_mib', 0)
+            disk_mib += sum(
+                disk.get('disk_size_mib', 0)
+                for disk in resources.get('disk_list', [])
+                if disk.get('device_properties', {}).get(
+                    'device_type', 'DISK') == 'DISK')
+
+            entity_name = vm["spec"]["cluster_reference"]["name"]
+            description = (vm['spec']['description']
+                           if 'description' in vm['spec']
+                           else 'None provided')
+            rows.append('<tr><td>'
+                        f'{entity_name}'
+                        f':{vm["spec"]["name"]}</td><td>'
+                        f'{description}'
+                        '</td></tr>')
+        except KeyError:
+            rows.append(data_error_row('VM'))
+    VM_RESOURCE_TOTALS['vcpu'] = vcpus
+    VM_RESOURCE_TOTALS['memory'] = round(memory_mib / 1024, 1)
+    VM_RESOURCE_TOTALS['disk'] = round(disk_mib / 1024, 1)
+    return ''.join(rows)
+
+
+def render_subnets(entities):
+    '''
+    render the subnet rows
+    '''
+    print("Processing subnets ...")
+    rows = []
+    try:
+        for subnet in entities:
+            entity_name = subnet["spec"]["cluster_reference"]["name"]
+            rows.append('<tr><td>'
+                        f'{subnet["spec"]["name"]}</td>'
+                        f'<td>{entity_name}'
+                        '</td></tr>')
+    except KeyError:
+        rows.append(data_error_row('subnet'))
+    return ''.join(rows)
+
+
+def render_projects(entities):
+    '''
+    render the project rows
+    '''
+    print("Processing projects ...")
+    rows = []
+    try:
+        for project in entities:
+            vm_total = 0
+            cpu_total = 0
+            storage_total = 0
+            memory_total = 0
+            entity_name = project['spec']['name']
+            rows.append(f'<tr><td>{entity_name}</td>')
+
+            '''
+            check to see if the project is consuming any resources
+            an empty project will show 0 for CPU/RAM/storage/VM count
+            '''
+            resource_domain = project['status']['resources']['resource_domain']
+            if 'resources' in resource_domain and resource_domain['resources']:
+                for resource in resource_domain['resources']:
+                    if resource['resource_type'] == 'VMS':
+                        vm_total = resource['value']
+                    elif resource['resource_type'] == 'VPUS':
+                        cpu_total = resource['value']
+                    elif resource['resource_type'] == 'STORAGE':
+                        storage_total = resource['value'] / 1024 / 1024 / 1024
+                    elif resource['resource_type'] == 'MEMORY':
+                        memory_total = resource['value'] / 1024 / 1024 / 1024
+                rows.append(f'<td>{vm_total}</td><td>'
+                            f'{cpu_total}</td><td>'
+                            f'{storage_total}</td>'
+                            f'<td>{memory_total}'
+                            '</td>')
+            else:
+                rows.append('<td>0</td><td>0</td><td>0</td><td>0</td>')
 
+            rows.append('</tr>')
+    except KeyError:
+        rows.append(data_error_row('project'))
+    return ''.join(rows)
+
+
+#########################
+# NETWORK_SECURITY_RULE #
+# NO LONGER SUPPORTED   #
+#########################
+# def render_network_security_rules(entities):
+#     print("Processing network security rules ...")
+#     return ''.join(f'<tr><td>{rule["spec"]["name"]}</td></tr>'
+#                    for rule in entities)
+
+
+def render_images(entities):
+    '''
+    render the image rows
     '''
-    the next block parses some of the Prism Central info that
-    currently exists as individual lists
+    print("Processing images ...")
+    rows = []
+    try:
+        for image in entities:
+            entity_name = image["status"]["name"]
+            image_type = image["status"]["resources"]["image_type"]
+            rows.append(f'<tr><td>{entity_name}</td><td>'
+                        f'{image_type}'
+                        '</td></tr>')
+    except KeyError:
+        rows.append(data_error_row('image'))
+    return ''.join(rows)
+
+
+def render_hosts(entities):
     '''
+    render the host rows
+    '''
+    print("Processing hosts ...")
+    rows = []
+    try:
+        for host in entities:
+            resources = host["status"]["resources"]
+            host_serial = resources["serial_number"]
+            cvm_ip = resources["controller_vm"]["ip"]
+            if 'name' in host['status']:
+                host_ip = resources["hypervisor"]["ip"]
+                num_vms = resources["hypervisor"]["num_vms"]
+                rows.append('<tr><td>'
+                            f'{host["status"]["name"]}'
+                            '</td><td>'
+                            f'{host_serial}'
+                            '</td><td>'
+                            f'{host_ip}'
+                            '</td><td>'
+                            f'{cvm_ip}'
+                            '</td><td>'
+                            f'{num_vms}'
+                            '</td></tr>')
+            else:
+                rows.append('<tr><td>N/A</td><td>'
+                            f'{host_serial}'
+                            '</td><td>N/A</td>'
+                            f'<td>{cvm_ip}</td>'
+                            '<td>N/A</td></tr>')
+    except KeyError:
+        rows.append(data_error_row('host'))
+    return ''.join(rows)
+
 
+def render_clusters(entities):
+    '''
+    render the cluster rows
+    '''
+    print("Processing clusters ...")
+    rows = []
+    for cluster in entities:
+        try:
+            cluster_ip = ((cluster['spec']['resources']['network']
+                           ['external_ip'])
+                          if ('external_ip' in
+                              cluster['spec']['resources']['network'])
+                          else 'N/A')
+
+            html_prefix = ('AOS' if (cluster["status"]["resources"]
+                                     ["config"]["service_list"][0]
+                                     == 'AOS')
+                           else 'Prism Central')
+
+            cluster_version = (cluster['status']['resources']
+                               ['config']['build']['version'])
+
+            is_ce = ('Yes' if ('-ce-' in (cluster['status']
+                                          ['resources']['config']
+                                          ['build']['full_version']))
+                     else 'No')
+
+            rows.append(f'<tr><td>{html_prefix}</td><td>'
+                        f'{cluster["spec"]["name"]}</td>'
+                        f'<td>{cluster_ip}</td><td>'
+                        f'{cluster_version}'
+                        f'</td><td>{is_ce}</td></tr>')
+        except KeyError:
+            rows.append(data_error_row('cluster'))
+    return ''.join(rows)
+
+
+def render_blueprints(entities):
+    '''
+    render the blueprint rows
+    '''
+    print("Processing blueprints ...")
+    rows = []
+    try:
+        for blueprint in entities:
+            entity_name = blueprint["status"]["name"]
+            if not bool(blueprint['status']['deleted']):
+                status = blueprint["status"]["state"]
+
+                bp_project = ((blueprint["metadata"]
+                               ["project_reference"]["name"])
+                              if 'project_reference' in (
+                                blueprint['metadata']
+                              ) else 'N/A')
+
+                rows.append(f'<tr><td>{entity_name}'
+                            f'</td><td>{bp_project}'
+                            f'</td><td>{status}</td>'
+                            '</tr>')
+    except KeyError:
+        rows.append(data_error_row('blueprint'))
+    return ''.join(rows)
+
+
+def render_apps(entities):
     '''
-    these are entity types the script currently supports
-    if new features or entity types become available in future,
-    it should be a relatively simple task to update this list
-    to support those entities
+    render the app rows
     '''
-    # supported_entities = [
-    #     'vm', 'subnet', 'cluster', 'project', 'network_security_rule',
-    #     'image', 'host', 'blueprint', 'app']
-    supported_entities = [
-        'vm', 'subnet', 'cluster', 'project',
-        'image', 'host', 'blueprint', 'app']
-    for row_label in supported_entities:
-        HTML_ROWS[row_label] = ''
-        ENTITY_TOTALS[row_label] = 0
+    print("Processing apps ...")
+    rows = []
+    for app in entities:
+        try:
+            entity_name = app['status']['name']
+            app_project = app['metadata']['project_reference']['name']
+            app_state = app['status']['state'].upper()
+            if app_state != 'DELETED':
+                rows.append(f'<tr><td>{entity_name}</td><td>'
+                            f'{app_project}</td><td>'
+                            f'{app_state}'
+                            '</td></tr>')
+        except KeyError:
+            rows.append(data_error_row('app'))
+    return ''.join(rows)
 
-    print('\n')
 
-    for json_result in json_results:
-        # collect info that is common to all entity types
-        for entity in json_result:
-            if entity in supported_entities:
-                ENTITY_TOTALS[f'{entity}'] = (json_result[1]["metadata"]
-                                              ["total_matches"])
-                print(f'Count of entity type {entity}: '
-                      f'{json_result[1]["metadata"]["total_matches"]}')
+'''
+these are entity types the script currently supports, along with the
+function that renders each one
+if new features or entity types become available in future,
+it should be a relatively simple task to add a render function and
+update this list to support those entities
+'''
+RENDERERS = {
+    'vm': render_vms,
+    'subnet': render_subnets,
+    'cluster': render_clusters,
+    'project': render_projects,
+    # 'network_security_rule': render_network_security_rules,
+    'image': render_images,
+    'host': render_hosts,
+    'blueprint': render_blueprints,
+    'app': render_apps,
+}
+
+
+def generate_template(sections):
+    '''
+    generate the HTML
+    sections is a list of [entity name, total matches, rendered rows]
+    '''
+    day = strftime('%d-%b-%Y', localtime())
+    time = strftime('%H%M%S', localtime())
+    now = f'{day}_{time}'
+    html_filename = f'{now}_prism_central.html'
+
+    for row_label in RENDERERS:
+        HTML_ROWS.setdefault(row_label, '')
+        ENTITY_TOTALS.setdefault(row_label, 0)
 
-        '''
-        note that the next long section seems a little repetitive, but the
-        string formatting for each entity is different enough to do it this way
-        if each entity's info 'block' was the same, we could setup an iterator
-        or use common formatting, but then the generated HTML wouldn't be very
-        useful
-        '''
+    print('\n')
 
-        ##########
-        #   VM   #
-        ##########
-        if json_result[0] == 'vm':
-            print("Processing VMs ...")
-            try:
-                for vm in json_result[1]['entities']:
-                    entity_name = vm["spec"]["cluster_reference"]["name"]
-                    description = (vm['spec']['description']
-                                   if 'description' in vm['spec']
-                                   else 'None provided')
-                    HTML_ROWS['vm'] += ('<tr><td>'
-                                        f'{entity_name}'
-                                        f':{vm["spec"]["name"]}</td><td>'
-                                        f'{description}'
-                                        '</td></tr>')
-            except KeyError:
-                HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                    'Expected VM data is missing or malformed.'
-                                    'Please check the JSON response.'
-                                    '</td></tr>')
-
-        ##########
-        # SUBNET #
-        ##########
-        elif json_result[0] == 'subnet':
-            print("Processing subnets ...")
-            try:
-                for subnet in json_result[1]['entities']:
-                    entity_name = subnet["spec"]["cluster_reference"]["name"]
-                    HTML_ROWS["subnet"] += ('<tr><td>'
-                                            f'{subnet["spec"]["name"]}</td>'
-                                            f'<td>{entity_name}'
-                                            '</td></tr>')
-            except KeyError:
-                HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                    'Expected subnet data is missing or'
-                                    'malformed.  Please check the JSON '
-                                    'response.</td></tr>')
-        ###########
-        # PROJECT #
-        ###########
-        elif json_result[0] == 'project':
-            print("Processing projects ...")
-            vm_total = 0
-            cpu_total = 0
-            storage_total = 0
-            memory_total = 0
-            HTML_ROWS['project'] = ''
-            try:
-                for project in json_result[1]['entities']:
-                    entity_name = project['spec']['name']
-                    HTML_ROWS['project'] += ('<tr><td>'
-                                             f'{entity_name}</td>')
-
-                    '''
-                    check to see if the project is consuming any resources
-                    an empty project will show 0 for CPU/RAM/storage/VM count
-                    '''
-                    if ('resources' in
-                            project['status']['resources']['resource_domain']):
-                        if (project['status']['resources']['resource_domain']
-                                ['resources']):
-                            for resource in project['status']['resources'][
-                                    'resource_domain']['resources']:
-                                if resource['resource_type'] == 'VMS':
-                                    vm_total = resource['value']
-                                elif resource['resource_type'] == 'VPUS':
-                                    cpu_total = resource['value']
-                                elif resource['resource_type'] == 'STORAGE':
-                                    storage_total = (resource['value']
-                                                     / 1024 / 1024 / 1024)
-                                elif resource['resource_type'] == 'MEMORY':
-                                    memory_total = (resource['value']
-                                                    / 1024 / 1024 / 1024)
-                            HTML_ROWS['project'] += (f'<td>{vm_total}</td><td>'
-                                                     f'{cpu_total}</td><td>'
-                                                     f'{storage_total}</td>'
-                                                     f'<td>{memory_total}'
-                                                     '</td>')
-                        else:
-                            HTML_ROWS['project'] += ('<td>0</td><td>0</td><td>'
-                                                     '0</td><td>0</td>')
-                    else:
-                        HTML_ROWS['project'] += ('<td>0</td><td>0</td>'
-                                                 '<td>0</td><td>0</td>')
-
-                    HTML_ROWS['project'] += '</tr>'
-            except KeyError:
-                HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                    'Expected project data is missing or'
-                                    'malformed.  Please check the JSON '
-                                    'response.</td></tr>')
-
-        #########################
-        # NETWORK_SECURITY_RULE #
-        # NO LONGER SUPPORTED   #
-        #########################
-        # elif json_result[0] == 'network_security_rule':
-        #     print("Processing network security rules ...")
-        #     for network_security_rule in json_result[1]['entities']:
-        #         entity_name = network_security_rule['spec']['name']
-        #         HTML_ROWS['network_security_rule'] += (f'<tr><td>{entity_name}'
-        #                                                '</td></tr>')
-
-        #########
-        # IMAGE #
-        #########
-        elif json_result[0] == 'image':
-            print("Processing images ...")
-            try:
-                for image in json_result[1]['entities']:
-                    entity_name = image["status"]["name"]
-                    image_type = image["status"]["resources"]["image_type"]
-                    HTML_ROWS['image'] += (f'<tr><td>{entity_name}</td><td>'
-                                           f'{image_type}'
-                                           '</td></tr>')
-            except KeyError:
-                HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                    'Expected subnet data is missing or'
-                                    'malformed.  Please check the JSON '
-                                    'response.</td></tr>')
-        ########
-        # HOST #
-        ########
-        elif json_result[0] == 'host':
-            print("Processing hosts ...")
-            try:
-                for host in json_result[1]['entities']:
-                    if 'name' in host['status']:
-                        host_serial = (host["status"]["resources"]
-                                       ["serial_number"])
-                        host_ip = (host["status"]["resources"]
-                                   ["hypervisor"]["ip"])
-                        cvm_ip = (host["status"]["resources"]
-                                  ["controller_vm"]["ip"])
-                        num_vms = (host["status"]["resources"]
-                                   ["hypervisor"]["num_vms"])
-                        HTML_ROWS['host'] += ('<tr><td>'
-                                              f'{host["status"]["name"]}'
-                                              '</td><td>'
-                                              f'{host_serial}'
-                                              '</td><td>'
-                                              f'{host_ip}'
-                                              '</td><td>'
-                                              f'{cvm_ip}'
-                                              '</td><td>'
-                                              f'{num_vms}'
-                                              '</td></tr>')
-                    else:
-                        host_serial = (host["status"]
-                                       ["resources"]["serial_number"])
-                        cvm_ip = (host["status"]["resources"]
-                                  ["controller_vm"]["ip"])
-                        HTML_ROWS['host'] += ('<tr><td>N/A</td><td>'
-                                              f'{host_serial}'
-                                              '</td><td>N/A</td>'
-                                              f'<td>{cvm_ip}</td>'
-                                              '<td>N/A</td></tr>')
-            except KeyError:
-                HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                    'Expected host data is missing or'
-                                    'malformed.  Please check the JSON '
-                                    'response.</td></tr>')
-        ###########
-        # CLUSTER #
-        ###########
-        elif json_result[0] == 'cluster':
-            print("Processing clusters ...")
-            for cluster in json_result[1]['entities']:
-                try:
-                    cluster_ip = ((cluster['spec']['resources']['network']
-                                   ['external_ip'])
-                                  if ('external_ip' in
-                                      cluster['spec']['resources']['network'])
-                                  else 'N/A')
-
-                    html_prefix = ('AOS' if (cluster["status"]["resources"]
-                                             ["config"]["service_list"][0]
-                                             == 'AOS')
-                                   else 'Prism Central')
-
-                    cluster_version = (cluster['status']['resources']
-                                       ['config']['build']['version'])
-
-                    is_ce = ('Yes' if ('-ce-' in (cluster['status']
-                                                  ['resources']['config']
-                                                  ['build']['full_version']))
-                             else 'No')
-
-                    HTML_ROWS["cluster"] += (f'<tr><td>{html_prefix}</td><td>'
-                                             f'{cluster["spec"]["name"]}</td>'
-                                             f'<td>{cluster_ip}</td><td>'
-                                             f'{cluster_version}'
-                                             f'</td><td>{is_ce}</td>')
-                except KeyError:
-                    HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                        'Expected cluster data is missing or'
-                                        'malformed.  Please check the JSON '
-                                        'response.</td></tr>')
-
-        #############
-        # BLUEPRINT #
-        #############
-        elif json_result[0] == 'blueprint':
-            print("Processing blueprints ...")
-            try:
-                for blueprint in json_result[1]['entities']:
-                    entity_name = blueprint["status"]["name"]
-                    if not bool(blueprint['status']['deleted']):
-                        status = blueprint["status"]["state"]
-
-                        bp_project = ((blueprint["metadata"]
-                                       ["project_reference"]["name"])
-                                      if 'project_reference' in (
-                                        blueprint['metadata']
-                                      ) else 'N/A')
-
-                        HTML_ROWS["blueprint"] += (f'<tr><td>{entity_name}'
-                                                   f'</td><td>{bp_project}'
-                                                   f'</td><td>{status}</td>'
-                                                   '</tr>')
-            except KeyError:
-                HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                    'Expected blueprint data is missing or'
-                                    'malformed.  Please check the JSON '
-                                    'response.</td></tr>')
-        #######
-        # APP #
-        #######
-        elif json_result[0] == 'app':
-            print("Processing apps ...")
-            for app in json_result[1]['entities']:
-                try:
-                    entity_name = app['status']['name']
-                    app_project = app['metadata']['project_reference']['name']
-                    app_state = app['status']['state'].upper()
-                    if app["status"]["state"].upper() != 'DELETED':
-                        HTML_ROWS["app"] += (f'<tr><td>{entity_name}</td><td>'
-                                             f'{app_project}</td><td>'
-                                             f'{app_state}'
-                                             '</td></tr>')
-                except KeyError:
-                    HTML_ROWS['vm'] += ('<tr><td colspan="2">'
-                                        'Expected subnet data is missing or'
-                                        'malformed.  Please check the JSON '
-                                        'response.</td></tr>')
+    for entity, total_matches, rows in sections:
+        ENTITY_TOTALS[entity] = total_matches
+        HTML_ROWS[entity] = rows
+        print(f'Count of entity type {entity}: {total_matches}')
 
     print('\n')
 
@@ -562,6 +695,9 @@ def generate_template(json_results):
         host_total=str(ENTITY_TOTALS['host']),
         blueprint_total=str(ENTITY_TOTALS['blueprint']),
         app_total=str(ENTITY_TOTALS['app']),
+        vm_vcpu_total=str(VM_RESOURCE_TOTALS.get('vcpu', 0)),
+        vm_memory_total=str(VM_RESOURCE_TOTALS.get('memory', 0)),
+        vm_disk_total=str(VM_RESOURCE_TOTALS.get('disk', 0)),
         computer_name=socket.gethostname(),
     )
 
@@ -584,6 +720,31 @@ def export_html_report(source_html, output_filename):
         f.write(source_html)
 
 
+def collect_section(endpoint, environment_options):
+    '''
+    page through every entity for one endpoint and render its section
+    of the report as the pages arrive
+    returns [entity name, total matches, rendered rows]
+    '''
+    print(f"Processing {endpoint['name_plural']} ...")
+    client = ApiClient(
+        environment_options.cluster_ip,
+        f'{endpoint["name_plural"]}/list',
+        '',
+        environment_options.username,
+        environment_options.password,
+        environment_options.read_timeout
+    )
+    if environment_options.debug:
+        print(f'Client info: {client}\n')
+        print(f'Requesting "{client.entity_type}" ...\n')
+    rows = RENDERERS[endpoint['name']](
+        client.iter_entities(endpoint['name'],
+                             page_size=endpoint['length'],
+                             concurrency=environment_options.page_concurrency))
+    return [endpoint['name'], client.total_matches, rows]
+
+
 def show_intro():
     '''
     function to simply show an extended help intro when the script
@@ -655,12 +816,13 @@ def main():
             '''
             'length' in Nutanix v3 API requests dictates how many entities
             will be returned in each request
+            every page is requested, so this only changes the number of
+            requests, not the number of entities in the report
             '''
             length = environment_options.entity_response_length
             if environment_options.debug:
                 print(f'{length} entities will be returned for each request.')
 
-            json_results = []
             endpoints = []
 
             for entity in environment_options.supported_entities:
@@ -670,28 +832,33 @@ def main():
                                   'length': length})
 
             if environment_options.debug:
-                print('Iterating over all supported endpoints ...\n')
-
-            for endpoint in endpoints:
-                print(f"Processing {endpoint['name_plural']} ...")
-                client = ApiClient(
-                    environment_options.cluster_ip,
-                    f'{endpoint["name_plural"]}/list',
-                    (f'{{ "kind": "{endpoint["""name"""]}",'
-                     f'"length": {endpoint["""length"""]}}}'),
-                    environment_options.username,
-                    environment_options.password,
-                    environment_options.read_timeout
-                )
-                if environment_options.debug:
-                    print(f'Client info: {client}\n')
-                    print(f'Requesting "{client.entity_type}" ...\n')
-                results = client.send_request()
-                json_results.append([endpoint['name'], results])
+                print('Requesting all supported endpoints at the same time ...\n')
+
+            '''
+            the endpoint requests don't depend on each other, so they are
+            sent concurrently; collecting everything takes about as long
+            as the slowest endpoint instead of the sum of all of them
+            each endpoint is rendered as its pages arrive, so the raw JSON
+            for large entity lists is never held in memory all at once
+            executor.map returns the results in the same order as the
+            endpoints, so the report layout doesn't change
+            the shared session's connection pool is sized so every page
+            request in flight can have its own connection
+            '''
+            get_session(environment_options.username,
+                        environment_options.password,
+                        pool_size=(len(endpoints)
+                                   * environment_options.page_concurrency),
+                        retry_post=True)
+            with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+                sections = list(executor.map(
+                    lambda endpoint: collect_section(endpoint,
+                                                     environment_options),
+                    endpoints))
 
             if environment_options.debug:
                 print('Generating HTML template ...\n')
-            generate_template(json_results)
+            generate_template(sections)
 
     else:
         print('\nNo HTML templates were found in the "templates" directory.'
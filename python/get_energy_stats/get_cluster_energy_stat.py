@@ -3,7 +3,9 @@ Usage Help
 
 
 usage: get_cluster_energy_stats.py [-h] --pc_ip PC_IP --username USERNAME --password PASSWORD [--cluster_uuid CLUSTER_UUID | --host_uuid HOST_UUID | --hc-granularity HC_GRANULARITY] [--start_time START_TIME]
-                                  [--end_time END_TIME] [--time_frame TIME_FRAME] [--down_sample_interval DOWN_SAMPLE_INTERVAL]
+                                  [--end_time END_TIME] [--time_frame TIME_FRAME] [--down_sample_interval DOWN_SAMPLE_INTERVAL] [--workers WORKERS] [--daily] [--store STORE]
+                                  [--window_hours WINDOW_HOURS] [--window_workers WINDOW_WORKERS]
+                                  [--serve PORT] [--listen_address LISTEN_ADDRESS] [--poll_interval POLL_INTERVAL] [--inventory_refresh INVENTORY_REFRESH]
 
 
 Get power stats(in Watts) from the Prism REST API v2.0.
@@ -22,6 +24,20 @@ options:
                        Granularity for the power stats. Possible values : CLUSTER|HOST
  --down_sample_interval DOWN_SAMPLE_INTERVAL
                        Down sample interval in seconds.
+ --workers WORKERS     Number of clusters or hosts whose stats are requested at the same time.
+ --daily               Also show the energy consumed per day (UTC).
+ --window_hours WINDOW_HOURS
+                       Longer time frames are requested as concurrent windows of this many hours (default 24).
+ --window_workers WINDOW_WORKERS
+                       Number of windows requested at the same time for each cluster or host (default 4).
+ --store STORE         Path to a local SQLite file used to keep power samples between runs.
+ --serve PORT          Run continuously and serve the latest power readings and energy counters on /metrics.
+ --listen_address LISTEN_ADDRESS
+                       Address the /metrics endpoint listens on (default 127.0.0.1).
+ --poll_interval POLL_INTERVAL
+                       Seconds between polls when using --serve (default 60).
+ --inventory_refresh INVENTORY_REFRESH
+                       Seconds between cluster/host list refreshes when using --serve (default 3600).
 
 
  --start_time START_TIME
@@ -35,6 +51,11 @@ Optional Args and Expected Results
 
 
 None                                    : Gives Energy consumption stats for all the clusters registered to the Prism Central for the last hour.
+--hc-granularity HOST                   : Gives Energy consumption stats for every host registered to the Prism Central for the last hour.
+--daily                                 : Also gives the Energy consumption per day (UTC) for each cluster or host.
+--store                                 : Keeps power samples in a local SQLite file, so later runs only request new samples.
+--serve PORT                            : Runs continuously, serving power readings and KWh counters for every cluster (or host, with --hc-granularity HOST) on /metrics.
+--workers                               : Number of clusters or hosts whose stats are requested at the same time (default 8).
 --start_time --end_time                 : Gives Energy consumption stats for all the clusters registered to the Prism Central between given start and end time.
 --time_frame                            : Gives Energy consumption stats for all the clusters registered to the Prism Central for the given time frame.
 --cluster_uuid                          : Gives Energy consumption stats for the cluster with the given UUID for the last hour.
@@ -137,10 +158,17 @@ import argparse
 from datetime import datetime
 import time
 import json
-from statistics import mean
+import sqlite3
+from datetime import timezone
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from prettytable import PrettyTable
+import numpy as np
 
 
 # ensure best practices are followed regarding certificate management
@@ -148,7 +176,75 @@ from prettytable import PrettyTable
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 
-def make_request(api_url, auth, headers=None, method="GET", data=None):
+SESSIONS = {}
+SESSIONS_LOCK = Lock()
+
+# number of clusters or hosts whose stats are requested at the same time
+DEFAULT_WORKERS = 8
+
+# maximum number of entities returned by one v4 list request
+V4_PAGE_LIMIT = 100
+
+# serialises access to the local power stats store from the worker threads
+STORE_LOCK = Lock()
+
+# long time frames are requested as several windows of this many seconds, fetched
+# DEFAULT_WINDOW_WORKERS at a time for each cluster or host
+DEFAULT_WINDOW_SECS = 24 * 3600
+DEFAULT_WINDOW_WORKERS = 4
+
+# number of extra attempts for a window that fails, and the timeout for each attempt
+WINDOW_RETRIES = 2
+WINDOW_TIMEOUT = 60
+
+
+def get_session(username, password, pool_size=10, retries=3, backoff_factor=0.5, retry_post=False):
+   """
+   Returns the pooled requests.Session for the given credentials, creating it on first use.
+
+   Keep-alive connections in the pool are re-used by every request made with the same
+   credentials, so only the first request to Prism Central pays for the TLS handshake.
+
+   Retry rule: requests failing with a connection error or a 429/502/503/504 response are
+   retried with exponential backoff.  GET requests are always retried, POST requests only
+   when retry_post is True.  This script leaves retry_post False: it only sends GET requests.
+   The session is created by the first call, so its settings come from that call.
+
+
+   Parameters:
+   username (str): The username for authentication.
+   password (str): The password for authentication.
+   pool_size (int): The maximum number of connections kept open to Prism Central.
+   retries (int): The number of times a failed request is retried.
+   backoff_factor (float): The backoff factor applied between retries.
+   retry_post (bool): Whether POST requests are retried too.
+
+
+   Returns:
+   requests.Session: The shared session.
+   """
+   with SESSIONS_LOCK:
+       session = SESSIONS.get((username, password))
+       if session is None:
+           session = requests.Session()
+           session.auth = HTTPBasicAuth(username, password)
+           session.headers.update({
+               "Content-Type": "application/json",
+               "Accept-Encoding": "gzip, deflate",
+               "Connection": "keep-alive"
+           })
+           retry = Retry(total=retries,
+                         backoff_factor=backoff_factor,
+                         status_forcelist=(429, 502, 503, 504),
+                         allowed_methods=frozenset(["GET", "POST"] if retry_post else ["GET"]),
+                         raise_on_status=False)
+           adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+           session.mount("https://", adapter)
+           SESSIONS[(username, password)] = session
+       return session
+
+
+def make_request(api_url, auth, headers=None, method="GET", data=None, timeout=None):
    """
    Makes a request to the given API URL using the specified method.
 
@@ -159,16 +255,16 @@ def make_request(api_url, auth, headers=None, method="GET", data=None):
    headers (dict): Optional headers to include in the request.
    method (str): The HTTP method to use (GET, POST, PUT, DELETE).
    data (dict): The data to send in the request body.
+   timeout (float): Optional number of seconds to wait for the response.
 
 
    Returns:
    dict: The JSON response
    """
-   headers = {
-       "Content-Type": "application/json"
-   }
+   username, password = (auth.username, auth.password) if isinstance(auth, HTTPBasicAuth) else auth
+   session = get_session(username, password)
    try:
-       response = requests.request(method, api_url, auth=auth, headers=headers, json=data, verify=False)
+       response = session.request(method, api_url, headers=headers, json=data, verify=False, timeout=timeout)
        response.raise_for_status()  # Raise an HTTPError for bad responses
        return response.json()
    except requests.exceptions.RequestException as e:
@@ -176,7 +272,7 @@ def make_request(api_url, auth, headers=None, method="GET", data=None):
        return None
 
 
-def get_power_stats(api_url, auth):
+def get_power_stats(api_url, auth, timeout=None):
    """
    Makes a GET request to the given API URL to retrieve power stats.
 
@@ -184,7 +280,7 @@ def get_power_stats(api_url, auth):
    Parameters:
    api_url (str): The URL of the API endpoint.
    auth (tuple): A tuple containing the username and password for authentication.
-   headers (dict): Optional headers to include in the request.
+   timeout (float): Optional number of seconds to wait for the response.
 
 
    Returns:
@@ -192,7 +288,7 @@ def get_power_stats(api_url, auth):
    None: If the request fails.
    """
    try:
-       return make_request(api_url, auth)
+       return make_request(api_url, auth, timeout=timeout)
    except requests.exceptions.RequestException as e:
        print(f"An error occurred: {e}")
        return None
@@ -234,12 +330,264 @@ def get_cluster_uuid_list(pc_ip, auth):
    return cluster_info
 
 
-def convert_timeframe_to_hours(start_time_epoch=0, end_time_epoch=0):
+def get_host_uuid_list(pc_ip, auth):
+   """
+   Gets every host registered to the Prism Central, following the v4 API pagination.
+
+
+   Parameters:
+   pc_ip (str): Prism Central IP address.
+   auth (HTTPBasicAuth): The username and password for authentication.
+
+
+   Returns:
+   list: (host uuid, host name, cluster name) for each host.
+   """
+   host_list_url = "https://{pc_ip}:9440/api/clustermgmt/v4.0/config/hosts?$page={page}&$limit={limit}"
+
+
+   host_info = []
+   page = 0
+   while True:
+       response = make_request(host_list_url.format(pc_ip=pc_ip, page=page, limit=V4_PAGE_LIMIT), auth)
+       hosts = (response or {}).get('data') or []
+       for host in hosts:
+           cluster_name = (host.get('cluster') or {}).get('name', 'N/A')
+           host_info.append((host['extId'], host.get('hostName', host['extId']), cluster_name))
+       total = (response or {}).get('metadata', {}).get('totalAvailableResults', 0)
+       page += 1
+       if len(hosts) < V4_PAGE_LIMIT or page * V4_PAGE_LIMIT >= total:
+           break
+
+
+   return host_info
+
+
+def power_stats_to_arrays(power_stats):
+   """
+   Converts a power stats response to NumPy arrays of sample times and power readings.
+
+   Missing samples (null or negative values) become NaN so they can be treated as gaps.
+
+
+   Parameters:
+   power_stats (dict): The JSON response from a v2.0 stats request.
+
+
+   Returns:
+   tuple: (timestamps in seconds, power in Watts) as float64 arrays, or None if the stats could not be retrieved.
+   """
+   if not power_stats:
+       return None
+   stats = power_stats["stats_specific_responses"][0]
+   watts = np.array(stats["values"] or [], dtype=np.float64)
+   watts[watts < 0] = np.nan
+   timestamps = stats["start_time_in_usecs"] / 1e6 + np.arange(watts.size) * float(stats["interval_in_secs"])
+   return timestamps, watts
+
+
+def open_store(path):
+   """
+   Opens (creating if required) the local SQLite store of power samples.
+
+   Samples are keyed by entity type (cluster or host), entity UUID, sample interval and
+   sample time, so reports for different intervals don't mix.
+
+
+   Parameters:
+   path (str): Path to the SQLite database file.
+
+
+   Returns:
+   sqlite3.Connection: The open store, shareable between the worker threads.
+   """
+   store = sqlite3.connect(path, check_same_thread=False)
+   with store:
+       store.execute("""
+           CREATE TABLE IF NOT EXISTS power_samples (
+               kind TEXT NOT NULL,
+               uuid TEXT NOT NULL,
+               interval_in_secs INTEGER NOT NULL,
+               time_in_usecs INTEGER NOT NULL,
+               watts REAL NOT NULL,
+               PRIMARY KEY (kind, uuid, interval_in_secs, time_in_usecs)
+           ) WITHOUT ROWID
+       """)
+   return store
+
+
+def save_samples(store, kind, uuid, interval, timestamps, watts):
+   """
+   Saves the valid samples from a power series to the store.  Missing samples aren't saved.
+   Later runs only request samples newer than the last stored sample, so a gap inside the
+   stored range stays a gap and is left out of the energy totals (see calculate_energy_rollups).
+   """
+   valid = ~np.isnan(watts)
+   rows = [(kind, uuid, interval, int(round(t * 1e6)), float(w))
+           for t, w in zip(timestamps[valid], watts[valid])]
+   with STORE_LOCK, store:
+       store.executemany("INSERT OR REPLACE INTO power_samples VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def load_samples(store, kind, uuid, interval, start_time_epoch, end_time_epoch):
+   """
+   Loads the stored samples for one entity between two times.
+
+
+   Returns:
+   tuple: (timestamps in seconds, power in Watts) as float64 arrays.
+   """
+   with STORE_LOCK:
+       rows = store.execute(
+           "SELECT time_in_usecs, watts FROM power_samples "
+           "WHERE kind = ? AND uuid = ? AND interval_in_secs = ? AND time_in_usecs BETWEEN ? AND ? "
+           "ORDER BY time_in_usecs",
+           (kind, uuid, interval, start_time_epoch, end_time_epoch)).fetchall()
+   samples = np.array(rows, dtype=np.float64).reshape(-1, 2)
+   return samples[:, 0] / 1e6, samples[:, 1]
+
+
+def get_power_series(pc_ip, auth, kind, uuid, start_time_epoch, end_time_epoch, down_sample_interval=300, store=None,
+                     window_secs=DEFAULT_WINDOW_SECS, window_workers=DEFAULT_WINDOW_WORKERS):
+   """
+   Gets the power series for one cluster or host.
+
+   Without a store, the whole time frame is requested.  With a store, only the samples newer
+   than the last stored sample are requested, then the series is read back from the store.
+   The whole time frame is requested if the store doesn't already reach back to its start.
+
+
+   Parameters:
+   kind (str): cluster or host.
+   uuid (str): The cluster or host UUID.
+   store (sqlite3.Connection): The store from open_store, or None.
+
+
+   Returns:
+   tuple: (timestamps in seconds, power in Watts) as float64 arrays, or None if the stats could not be retrieved.
+   """
+   get_stats = get_power_stats_for_individual_cluster if kind == 'cluster' else get_power_stats_for_individual_host
+   if store is None:
+       return power_stats_to_arrays(get_stats(pc_ip, auth, uuid, start_time_epoch, end_time_epoch, down_sample_interval,
+                                              window_secs, window_workers))
+
+   with STORE_LOCK:
+       first, last = store.execute(
+           "SELECT MIN(time_in_usecs), MAX(time_in_usecs) FROM power_samples "
+           "WHERE kind = ? AND uuid = ? AND interval_in_secs = ?",
+           (kind, uuid, down_sample_interval)).fetchone()
+   interval_usecs = down_sample_interval * 1000000
+   fetch_from = start_time_epoch
+   if first is not None and first <= start_time_epoch + interval_usecs and last >= start_time_epoch:
+       fetch_from = last + 1
+   if fetch_from < end_time_epoch - interval_usecs:
+       arrays = power_stats_to_arrays(get_stats(pc_ip, auth, uuid, fetch_from, end_time_epoch, down_sample_interval,
+                                                window_secs, window_workers))
+       if arrays is None and first is None:
+           return None
+       if arrays is not None:
+           save_samples(store, kind, uuid, down_sample_interval, *arrays)
+   return load_samples(store, kind, uuid, down_sample_interval, start_time_epoch, end_time_epoch)
+
+
+def calculate_energy_rollups(series, start_time_epoch, end_time_epoch, max_gap):
+   """
+   Calculates the energy consumed by each cluster or host, in total and per day (UTC).
+
+   Each series is integrated with the trapezoidal rule over its real sample times.  Missing
+   samples are dropped, and any interval between two readings longer than max_gap seconds is
+   treated as a gap and not integrated, rather than being filled in with an average.  The
+   first and last readings are held to the start and end of the time frame when they are
+   within max_gap of it.
+
+   Every series is integrated in one vectorised pass: the intervals from all series are
+   concatenated and summed per series and per day with np.bincount.
+
+
+   Parameters:
+   series (list): (timestamps, watts) array pairs from power_stats_to_arrays, or None for failed requests.
+   start_time_epoch (int): Start time in microseconds.
+   end_time_epoch (int): End time in microseconds.
+   max_gap (float): Longest interval between two readings, in seconds, that is integrated.
+
+
+   Returns:
+   tuple: (energy in KWh per series, fraction of the time frame covered per series,
+           list of day start dates, KWh per series per day as a 2D array).
+           Series whose stats could not be retrieved have NaN energy.
+   """
+   start = start_time_epoch / 1e6
+   end = end_time_epoch / 1e6
+   count = len(series)
+   t0, t1, w0, w1, owner = [], [], [], [], []
+   for index, arrays in enumerate(series):
+       if arrays is None:
+           continue
+       timestamps, watts = arrays
+       valid = ~np.isnan(watts) & (timestamps >= start) & (timestamps <= end)
+       timestamps, watts = timestamps[valid], watts[valid]
+       if timestamps.size == 0:
+           continue
+       # hold the first/last reading to the edges of the time frame
+       if timestamps[0] - start <= max_gap:
+           timestamps = np.concatenate(([start], timestamps))
+           watts = np.concatenate(([watts[0]], watts))
+       if end - timestamps[-1] <= max_gap:
+           timestamps = np.concatenate((timestamps, [end]))
+           watts = np.concatenate((watts, [watts[-1]]))
+       t0.append(timestamps[:-1])
+       t1.append(timestamps[1:])
+       w0.append(watts[:-1])
+       w1.append(watts[1:])
+       owner.append(np.full(timestamps.size - 1, index))
+
+   energy = np.full(count, np.nan)
+   energy[[index for index, arrays in enumerate(series) if arrays is not None]] = 0.0
+   coverage = np.zeros(count)
+   if not owner:
+       return energy, coverage, [], np.zeros((count, 0))
+
+   t0, t1, w0, w1, owner = (np.concatenate(a) for a in (t0, t1, w0, w1, owner))
+   dt = t1 - t0
+   integrated = (dt > 0) & (dt <= max_gap)
+   kwh = np.where(integrated, (w0 + w1) / 2 * dt / 3600 / 1000, 0.0)
+
+   # assign each interval to the UTC day containing its midpoint
+   day = np.floor((t0 + t1) / 2 / 86400).astype(np.int64)
+   first_day = day.min()
+   days = int(day.max() - first_day) + 1
+   per_day = np.bincount(owner * days + (day - first_day), weights=kwh, minlength=count * days).reshape(count, days)
+
+   energy += np.bincount(owner, weights=kwh, minlength=count)
+   coverage = np.bincount(owner, weights=np.where(integrated, dt, 0.0), minlength=count) / max(end - start, 1)
+   day_labels = [datetime.fromtimestamp(int(first_day + d) * 86400, tz=timezone.utc).date() for d in range(days)]
+   return energy, coverage, day_labels, per_day
+
+
+def print_daily_table(names, day_labels, per_day, label='Cluster Name'):
+   """
+   Prints the per-day energy rollup, one row per cluster or host and one column per day.
+   """
+   t = PrettyTable([label] + [str(day) for day in day_labels] + ['Total(KWh)'])
+   t.align[label] = 'l'
+   for name, row in zip(names, per_day):
+       t.add_row([name] + ["%.2f" % value for value in row] + ["%.2f" % row.sum()])
+   print(t)
+
+
+def escape_label_value(value):
    """
-   Converts the time frame string to total hours.
+   Escapes a Prometheus label value: backslash, double quote and newline would otherwise end
+   the value early and break the whole /metrics response.
    """
-   diff = end_time_epoch - start_time_epoch
-   return diff / 1e6 / 3600
+   return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_energy(energy, fmt="%.2f"):
+   """
+   Formats an energy value for output, showing N/A when the stats could not be retrieved.
+   """
+   return "N/A" if energy is None or np.isnan(energy) else fmt % energy
 
 
 def get_time_frame(time_frame):
@@ -262,85 +610,384 @@ def get_time_frame(time_frame):
    return (start_time_epoch, end_time_epoch)
 
 
-def get_power_stats_for_individual_cluster(pc_ip, auth, cluster_uuid, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300):
+def split_time_frame(start_time_epoch, end_time_epoch, window_secs, down_sample_interval):
    """
-   Get power stats for a specific cluster registered to the Prism Central.
+   Splits a time frame into consecutive windows of at most window_secs seconds.
 
+   Window boundaries fall on multiples of the sample interval so samples from adjacent
+   windows line up when they are merged.
 
-   Returns:
-   """   
-   base_url = "https://{pc_ip}:9440/PrismGateway/services/rest/v2.0/clusters/{uuid}/stats?"
 
+   Returns:
+   list: (start, end) pairs in microseconds.
+   """
+   interval_usecs = int(down_sample_interval * 1e6)
+   window_usecs = max(interval_usecs, int(window_secs * 1e6) // interval_usecs * interval_usecs)
+   edges = list(range(start_time_epoch, end_time_epoch, window_usecs)) + [end_time_epoch]
+   return list(zip(edges[:-1], edges[1:]))
 
-   v2_stats_url = base_url + ("metrics=power_consumption_instant_watt&" +
-                              "start_time_in_usecs={start}&" +
-                              "end_time_in_usecs={end_time}&" +
-                              "interval_in_secs={interval}")
 
+def merge_power_stats(responses, down_sample_interval):
+   """
+   Merges the power stats responses for consecutive windows into one response, in timestamp order.
 
-   v2_stats_url = v2_stats_url.format(pc_ip=pc_ip,
-                                      uuid=str(cluster_uuid),
-                                      start=start_time_epoch,
-                                      end_time=end_time_epoch,
-                                      interval=down_sample_interval)
+   Samples are placed by their timestamp, so overlapping window edges aren't counted twice
+   and windows that failed are left as missing (None) samples.
 
 
-   return get_power_stats(v2_stats_url, auth)
+   Returns:
+   dict: A response in the same format as a single v2.0 stats request, or None if no window succeeded.
+   """
+   interval_usecs = int(down_sample_interval * 1e6)
+   samples = {}
+   metric = None
+   for response in responses:
+       if not response:
+           continue
+       stats = response["stats_specific_responses"][0]
+       metric = stats.get("metric")
+       for index, value in enumerate(stats["values"] or []):
+           samples[stats["start_time_in_usecs"] + index * interval_usecs] = value
+   if metric is None:
+       return None
+   if not samples:
+       first = min(r["stats_specific_responses"][0]["start_time_in_usecs"] for r in responses if r)
+       values = []
+   else:
+       first, last = min(samples), max(samples)
+       values = [samples.get(first + index * interval_usecs) for index in range((last - first) // interval_usecs + 1)]
+   return {"stats_specific_responses": [{"successful": True, "message": None,
+                                         "start_time_in_usecs": first,
+                                         "interval_in_secs": down_sample_interval,
+                                         "metric": metric,
+                                         "values": values}]}
 
 
-def get_power_stats_for_individual_host(pc_ip, auth, host_uuid, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300):
+def get_windowed_power_stats(pc_ip, auth, kind, uuid, start_time_epoch, end_time_epoch, down_sample_interval=300,
+                             window_secs=DEFAULT_WINDOW_SECS, window_workers=DEFAULT_WINDOW_WORKERS):
    """
-   Get power stats for a specific host registered to the Prism Central.
+   Get power stats for a cluster or host, splitting long time frames into windows.
+
+   The windows are requested concurrently, each with its own timeout, and merged in timestamp
+   order.  A window that fails is retried on its own, up to WINDOW_RETRIES more times, instead
+   of repeating the whole time frame.
+
+
+   Parameters:
+   kind (str): clusters or hosts.
+   uuid (str): The cluster or host UUID.
+   window_secs (int): Longest time frame requested at once, in seconds.
+   window_workers (int): Number of windows requested at the same time.
 
 
    Returns:
-   """  
-   base_url = "https://{pc_ip}:9440/PrismGateway/services/rest/v2.0/hosts/{uuid}/stats?"
+   dict: The merged power stats, or None if they could not be retrieved.
+   """
+   v2_stats_url = ("https://{pc_ip}:9440/PrismGateway/services/rest/v2.0/{kind}/{uuid}/stats?" +
+                   "metrics=power_consumption_instant_watt&" +
+                   "start_time_in_usecs={start}&" +
+                   "end_time_in_usecs={end_time}&" +
+                   "interval_in_secs={interval}")
+
+   def get_window(window):
+       url = v2_stats_url.format(pc_ip=pc_ip, kind=kind, uuid=str(uuid),
+                                 start=window[0], end_time=window[1], interval=down_sample_interval)
+       for attempt in range(WINDOW_RETRIES + 1):
+           power_stats = get_power_stats(url, auth, timeout=WINDOW_TIMEOUT)
+           if power_stats:
+               return power_stats
+           if attempt < WINDOW_RETRIES:
+               print(f"Retrying {kind}/{uuid} stats from {window[0]} to {window[1]} ...")
+               time.sleep(2 ** attempt)
+       return None
 
+   windows = split_time_frame(start_time_epoch, end_time_epoch, window_secs, down_sample_interval)
+   if len(windows) == 1:
+       return get_window(windows[0])
+   with ThreadPoolExecutor(max_workers=window_workers) as executor:
+       responses = list(executor.map(get_window, windows))
+   failed = sum(1 for response in responses if not response)
+   if failed:
+       print(f"{failed} of {len(windows)} windows failed for {kind}/{uuid}; their samples are treated as gaps.")
+   return merge_power_stats(responses, down_sample_interval)
 
-   v2_stats_url = base_url + ("metrics=power_consumption_instant_watt&" +
-                              "start_time_in_usecs={start}&" +
-                              "end_time_in_usecs={end_time}&" +
-                              "interval_in_secs={interval}")
 
+def get_power_stats_for_individual_cluster(pc_ip, auth, cluster_uuid, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300,
+                                           window_secs=DEFAULT_WINDOW_SECS, window_workers=DEFAULT_WINDOW_WORKERS):
+   """
+   Get power stats for a specific cluster registered to the Prism Central.
 
-   v2_stats_url = v2_stats_url.format(pc_ip=pc_ip,
-                                      uuid=str(host_uuid),
-                                      start=start_time_epoch,
-                                      end_time=end_time_epoch,
-                                      interval=down_sample_interval)
+   Time frames longer than window_secs are requested as concurrent windows, see get_windowed_power_stats.
 
 
-   return get_power_stats(v2_stats_url, auth)
+   Returns:
+   dict: The power stats response, or None if the stats could not be retrieved.
+   """
+   return get_windowed_power_stats(pc_ip, auth, 'clusters', cluster_uuid, start_time_epoch, end_time_epoch,
+                                   down_sample_interval, window_secs, window_workers)
 
 
-def get_power_stats_for_all_clusters(pc_ip, auth, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300, output_format='json'):
+def get_power_stats_for_individual_host(pc_ip, auth, host_uuid, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300,
+                                        window_secs=DEFAULT_WINDOW_SECS, window_workers=DEFAULT_WINDOW_WORKERS):
+   """
+   Get power stats for a specific host registered to the Prism Central.
+
+   Time frames longer than window_secs are requested as concurrent windows, see get_windowed_power_stats.
+
+
+   Returns:
+   dict: The power stats response, or None if the stats could not be retrieved.
+   """
+   return get_windowed_power_stats(pc_ip, auth, 'hosts', host_uuid, start_time_epoch, end_time_epoch,
+                                   down_sample_interval, window_secs, window_workers)
+
+
+def get_power_stats_for_all_clusters(pc_ip, auth, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300, output_format='json', workers=DEFAULT_WORKERS, daily=False, store=None,
+                                     window_secs=DEFAULT_WINDOW_SECS, window_workers=DEFAULT_WINDOW_WORKERS):
    """
    Get power stats for all clusters registered to the Prism Central.
 
+   The clusters' stats are requested concurrently, up to workers at a time, through the
+   shared session, then integrated together with calculate_energy_rollups.  With a store,
+   only samples newer than those already stored are requested.
+
 
    Returns:
        Returns the power stats for all the clusters registered to the Prism Central.
    """
    cluster_info = get_cluster_uuid_list(pc_ip, auth)
-   t = PrettyTable(['Cluster Name', 'Number of Nodes', 'Energy Consumed(KWh)'])
+   t = PrettyTable(['Cluster Name', 'Number of Nodes', 'Energy Consumed(KWh)', 'Coverage'])
    t.align['Cluster Name'] = 'l'
    t.align['Number of Nodes'] = 'c'
    t.align['Energy Consumed(KWh)'] = 'r'
+   t.align['Coverage'] = 'r'
    t.padding_width = 1
+
+   def cluster_series(cluster):
+       return get_power_series(pc_ip, auth, 'cluster', cluster[0], start_time_epoch, end_time_epoch, down_sample_interval, store,
+                               window_secs, window_workers)
+
+   # executor.map returns the results in the same order as cluster_info
+   with ThreadPoolExecutor(max_workers=workers) as executor:
+       series = list(executor.map(cluster_series, cluster_info))
+   energy, coverage, day_labels, per_day = calculate_energy_rollups(series, start_time_epoch, end_time_epoch, 2 * down_sample_interval)
+
+   names = [name for (cluster_uuid, name, count) in cluster_info]
    consumption_list = {}
-   for (cluster_uuid, name, count) in cluster_info:
-       power_stats = get_power_stats_for_individual_cluster(pc_ip, auth, cluster_uuid, start_time_epoch, end_time_epoch, down_sample_interval)
-       power_stats_list = power_stats["stats_specific_responses"][0]["values"] or [0]
-       total_hours = convert_timeframe_to_hours(start_time_epoch, end_time_epoch)
-       total_energy_consumed = total_hours * mean(power_stats_list) / 1000
-       t.add_row([name, count, "%.2f" % total_energy_consumed])
-       consumption_list[name] = "%0.2f KWh" % total_energy_consumed
+   for index, (cluster_uuid, name, count) in enumerate(cluster_info):
+       t.add_row([name, count, format_energy(energy[index]), "%.0f%%" % (coverage[index] * 100)])
+       consumption_list[name] = format_energy(energy[index], "%0.2f KWh")
+       if daily:
+           consumption_list[name] = {
+               "total": consumption_list[name],
+               "daily": {str(day): "%0.2f KWh" % value for day, value in zip(day_labels, per_day[index])}
+           }
    if output_format == 'table':
        print(t)
+       if daily:
+           print_daily_table(names, day_labels, per_day)
    return consumption_list
 
 
+def get_power_stats_for_all_hosts(pc_ip, auth, start_time_epoch=None, end_time_epoch=None, down_sample_interval=300, output_format='json', workers=DEFAULT_WORKERS, daily=False, store=None,
+                                  window_secs=DEFAULT_WINDOW_SECS, window_workers=DEFAULT_WINDOW_WORKERS):
+   """
+   Get power stats for every host registered to the Prism Central.
+
+   The hosts' stats are requested concurrently, up to workers at a time, through the
+   shared session, then integrated together with calculate_energy_rollups.  With a store,
+   only samples newer than those already stored are requested.
+
+
+   Returns:
+       Returns the power stats for all the hosts registered to the Prism Central, grouped by cluster name.
+   """
+   host_info = sorted(get_host_uuid_list(pc_ip, auth), key=lambda host: host[2])
+   t = PrettyTable(['Cluster Name', 'Host Name', 'Energy Consumed(KWh)', 'Coverage'])
+   t.align['Cluster Name'] = 'l'
+   t.align['Host Name'] = 'l'
+   t.align['Energy Consumed(KWh)'] = 'r'
+   t.align['Coverage'] = 'r'
+   t.padding_width = 1
+
+   def host_series(host):
+       return get_power_series(pc_ip, auth, 'host', host[0], start_time_epoch, end_time_epoch, down_sample_interval, store,
+                               window_secs, window_workers)
+
+   with ThreadPoolExecutor(max_workers=workers) as executor:
+       series = list(executor.map(host_series, host_info))
+   energy, coverage, day_labels, per_day = calculate_energy_rollups(series, start_time_epoch, end_time_epoch, 2 * down_sample_interval)
+
+   names = [f"{cluster_name}/{host_name}" for (host_uuid, host_name, cluster_name) in host_info]
+   consumption_list = {}
+   for index, (host_uuid, host_name, cluster_name) in enumerate(host_info):
+       t.add_row([cluster_name, host_name, format_energy(energy[index]), "%.0f%%" % (coverage[index] * 100)])
+       host_energy = format_energy(energy[index], "%0.2f KWh")
+       if daily:
+           host_energy = {
+               "total": host_energy,
+               "daily": {str(day): "%0.2f KWh" % value for day, value in zip(day_labels, per_day[index])}
+           }
+       consumption_list.setdefault(cluster_name, {})[host_name] = host_energy
+   if output_format == 'table':
+       print(t)
+       if daily:
+           print_daily_table(names, day_labels, per_day, label='Cluster/Host Name')
+   return consumption_list
+
+
+class EnergyExporter:
+   """
+   Long-running exporter that serves the latest power readings and energy counters on /metrics.
+
+   The cluster or host inventory is listed once and refreshed every inventory_refresh seconds.
+   Every poll_interval seconds, each entity's samples newer than its last seen sample are
+   requested through the shared session and integrated into a running KWh counter, using the
+   same trapezoidal rule as the one-shot report.
+   """
+
+   def __init__(self, pc_ip, auth, granularity='CLUSTER', down_sample_interval=60, workers=DEFAULT_WORKERS,
+                inventory_refresh=3600):
+       self.pc_ip = pc_ip
+       self.auth = auth
+       self.kind = 'host' if granularity.upper() == 'HOST' else 'cluster'
+       self.down_sample_interval = down_sample_interval
+       self.inventory_refresh = inventory_refresh
+       self.executor = ThreadPoolExecutor(max_workers=workers)
+       self.lock = Lock()
+       self.inventory = []
+       self.inventory_time = 0
+       # uuid -> {"name", "cluster", "time", "watts", "kwh"}
+       self.state = {}
+       self.poll_duration = 0.0
+       self.poll_errors = 0
+
+   def refresh_inventory(self):
+       """
+       Lists the clusters or hosts if the cached inventory is older than inventory_refresh seconds.
+       """
+       if self.inventory and time.time() - self.inventory_time < self.inventory_refresh:
+           return
+       if self.kind == 'cluster':
+           self.inventory = [(uuid, name, name) for (uuid, name, count) in get_cluster_uuid_list(self.pc_ip, self.auth)]
+       else:
+           self.inventory = get_host_uuid_list(self.pc_ip, self.auth)
+       self.inventory_time = time.time()
+
+   def poll_entity(self, entity):
+       """
+       Requests one entity's new samples and returns (uuid, timestamps, watts), or None on failure.
+       """
+       uuid = entity[0]
+       now = int(time.time() * 1e6)
+       with self.lock:
+           last = self.state.get(uuid, {}).get("time")
+       start = int(last * 1e6) + 1 if last else now - 2 * self.down_sample_interval * 1000000
+       get_stats = get_power_stats_for_individual_cluster if self.kind == 'cluster' else get_power_stats_for_individual_host
+       arrays = power_stats_to_arrays(get_stats(self.pc_ip, self.auth, uuid, start, now, self.down_sample_interval))
+       return None if arrays is None else (uuid, arrays)
+
+   def poll(self):
+       """
+       Polls every entity concurrently and updates the readings and counters.
+       """
+       started = time.perf_counter()
+       self.refresh_inventory()
+       results = list(self.executor.map(self.poll_entity, self.inventory))
+       with self.lock:
+           self.poll_errors += sum(1 for result in results if result is None)
+           for entity, result in zip(self.inventory, results):
+               uuid, name, cluster = entity
+               entry = self.state.setdefault(uuid, {"name": name, "cluster": cluster, "time": None, "watts": None, "kwh": 0.0})
+               if result is None:
+                   continue
+               timestamps, watts = result[1]
+               valid = ~np.isnan(watts)
+               timestamps, watts = timestamps[valid], watts[valid]
+               if entry["time"] is not None:
+                   timestamps = np.concatenate(([entry["time"]], timestamps))
+                   watts = np.concatenate(([entry["watts"]], watts))
+               if timestamps.size == 0:
+                   continue
+               if timestamps.size > 1:
+                   energy = calculate_energy_rollups([(timestamps, watts)], int(timestamps[0] * 1e6), int(timestamps[-1] * 1e6),
+                                                     2 * self.down_sample_interval)[0]
+                   entry["kwh"] += float(energy[0])
+               entry["time"], entry["watts"] = float(timestamps[-1]), float(watts[-1])
+           self.poll_duration = time.perf_counter() - started
+
+   def metrics(self):
+       """
+       Returns the current readings in the Prometheus text exposition format.
+       """
+       def labels(entry, uuid):
+           values = {"kind": self.kind, "uuid": uuid, "name": entry["name"], "cluster": entry["cluster"]}
+           return ",".join(f'{key}="{escape_label_value(value)}"' for key, value in values.items())
+
+       lines = ["# HELP nutanix_power_watts Latest power consumption reading, in Watts.",
+                "# TYPE nutanix_power_watts gauge"]
+       with self.lock:
+           entries = sorted(self.state.items(), key=lambda item: (item[1]["cluster"], item[1]["name"]))
+           for uuid, entry in entries:
+               if entry["watts"] is not None:
+                   lines.append(f'nutanix_power_watts{{{labels(entry, uuid)}}} {entry["watts"]}')
+           lines += ["# HELP nutanix_power_sample_timestamp_seconds Time of the latest power reading.",
+                     "# TYPE nutanix_power_sample_timestamp_seconds gauge"]
+           for uuid, entry in entries:
+               if entry["time"] is not None:
+                   lines.append(f'nutanix_power_sample_timestamp_seconds{{{labels(entry, uuid)}}} {entry["time"]}')
+           lines += ["# HELP nutanix_energy_kwh_total Energy consumed since the exporter started, in KWh.",
+                     "# TYPE nutanix_energy_kwh_total counter"]
+           for uuid, entry in entries:
+               lines.append(f'nutanix_energy_kwh_total{{{labels(entry, uuid)}}} {entry["kwh"]:.6f}')
+           lines += ["# HELP nutanix_energy_exporter_poll_duration_seconds Duration of the latest poll.",
+                     "# TYPE nutanix_energy_exporter_poll_duration_seconds gauge",
+                     f"nutanix_energy_exporter_poll_duration_seconds {self.poll_duration:.3f}",
+                     "# HELP nutanix_energy_exporter_poll_errors_total Stats requests that failed.",
+                     "# TYPE nutanix_energy_exporter_poll_errors_total counter",
+                     f"nutanix_energy_exporter_poll_errors_total {self.poll_errors}"]
+       return "\n".join(lines) + "\n"
+
+   def serve(self, port, address='127.0.0.1', poll_interval=60):
+       """
+       Serves /metrics on address:port and polls every poll_interval seconds until interrupted.
+       """
+       exporter = self
+
+       class MetricsHandler(BaseHTTPRequestHandler):
+           def do_GET(self):
+               if self.path.split("?")[0] != "/metrics":
+                   self.send_error(404)
+                   return
+               body = exporter.metrics().encode()
+               self.send_response(200)
+               self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+               self.send_header("Content-Length", str(len(body)))
+               self.end_headers()
+               self.wfile.write(body)
+
+           def log_message(self, *args):
+               pass
+
+       server = ThreadingHTTPServer((address, port), MetricsHandler)
+       Thread(target=server.serve_forever, daemon=True).start()
+       print(f"Serving power metrics on http://{address}:{port}/metrics, polling every {poll_interval} seconds ...")
+       try:
+           while True:
+               started = time.monotonic()
+               try:
+                   self.poll()
+               except Exception as e:
+                   # keep serving the last known values if Prism Central can't be reached
+                   print(f"Poll failed: {e}")
+               time.sleep(max(0, poll_interval - (time.monotonic() - started)))
+       except KeyboardInterrupt:
+           print("Stopping ...")
+       finally:
+           server.shutdown()
+           self.executor.shutdown(wait=False)
+
+
 def parse_arguments():
    """
    Parse the command-line arguments and return the Namespace object.
@@ -373,6 +1020,15 @@ def parse_arguments():
 
    parser.add_argument('--down_sample_interval', type=int, required=False, default=300, help='Down sample interval in seconds.')
    parser.add_argument('--output-format', type=str, required=False, default='table', help='Output format for the power stats. Possible values : table, json')
+   parser.add_argument('--window_hours', type=float, required=False, default=DEFAULT_WINDOW_SECS / 3600, help='Longer time frames are requested as concurrent windows of this many hours.')
+   parser.add_argument('--window_workers', type=int, required=False, default=DEFAULT_WINDOW_WORKERS, help='Number of windows requested at the same time for each cluster or host.')
+   parser.add_argument('--store', type=str, required=False, help='Path to a local SQLite file used to keep power samples between runs, so only new samples are requested.')
+   parser.add_argument('--daily', action='store_true', help='Also show the energy consumed per day (UTC).')
+   parser.add_argument('--workers', type=int, required=False, default=DEFAULT_WORKERS, help='Number of clusters or hosts whose stats are requested at the same time.')
+   parser.add_argument('--serve', type=int, required=False, metavar='PORT', help='Run continuously and serve the latest power readings and energy counters on http://<listen_address>:PORT/metrics.')
+   parser.add_argument('--listen_address', type=str, required=False, default='127.0.0.1', help='Address the /metrics endpoint listens on.')
+   parser.add_argument('--poll_interval', type=int, required=False, default=60, help='Seconds between polls when using --serve.')
+   parser.add_argument('--inventory_refresh', type=int, required=False, default=3600, help='Seconds between cluster/host list refreshes when using --serve.')
    return parser.parse_args()
 
 
@@ -382,6 +1038,12 @@ if __name__ == "__main__":
 
    auth = HTTPBasicAuth(args.username, args.password)
 
+   # create the shared session up front, with enough pooled connections for every worker
+   get_session(args.username, args.password, pool_size=max(10, args.workers * args.window_workers))
+   window_secs = int(args.window_hours * 3600)
+
+   store = open_store(args.store) if args.store else None
+
 
    if args.start_time is not None and args.end_time is not None:
        start_time_epoch = convert_to_epoch(args.start_time)
@@ -390,14 +1052,25 @@ if __name__ == "__main__":
        start_time_epoch, end_time_epoch = get_time_frame(args.time_frame)
 
 
-   if args.cluster_uuid is not None:
-       power_stats = get_power_stats_for_individual_cluster(args.pc_ip, auth, args.cluster_uuid, start_time_epoch, end_time_epoch, args.down_sample_interval)
+   if args.serve is not None:
+       exporter = EnergyExporter(args.pc_ip, auth, args.hc_granularity, args.down_sample_interval, args.workers, args.inventory_refresh)
+       exporter.serve(args.serve, args.listen_address, args.poll_interval)
+   elif args.cluster_uuid is not None:
+       power_stats = get_power_stats_for_individual_cluster(args.pc_ip, auth, args.cluster_uuid, start_time_epoch, end_time_epoch, args.down_sample_interval,
+                                                            window_secs, args.window_workers)
        print(f"Power Stats: {power_stats}")
    elif args.host_uuid is not None:
-       power_stats = get_power_stats_for_individual_host(args.pc_ip, auth, args.host_uuid, start_time_epoch, end_time_epoch, args.down_sample_interval)
+       power_stats = get_power_stats_for_individual_host(args.pc_ip, auth, args.host_uuid, start_time_epoch, end_time_epoch, args.down_sample_interval,
+                                                         window_secs, args.window_workers)
        print(f"Power Stats: {power_stats}")
    elif args.hc_granularity.upper() == 'CLUSTER':
-       power_stats = get_power_stats_for_all_clusters(args.pc_ip, auth, start_time_epoch, end_time_epoch, args.down_sample_interval, args.output_format)
+       power_stats = get_power_stats_for_all_clusters(args.pc_ip, auth, start_time_epoch, end_time_epoch, args.down_sample_interval, args.output_format, args.workers, args.daily, store,
+                                                    window_secs, args.window_workers)
+       if args.output_format == 'json':
+           print(json.dumps(power_stats, indent=2))
+   elif args.hc_granularity.upper() == 'HOST':
+       power_stats = get_power_stats_for_all_hosts(args.pc_ip, auth, start_time_epoch, end_time_epoch, args.down_sample_interval, args.output_format, args.workers, args.daily, store,
+                                                 window_secs, args.window_workers)
        if args.output_format == 'json':
            print(json.dumps(power_stats, indent=2))
    else:
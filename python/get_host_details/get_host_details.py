@@ -5,17 +5,30 @@ Script to fetch details regarding CPUs, Memory configuration,
 Bios and BMC versions on a host.
 This script generates an excel sheet in the current directory of name
 host_script_timestamp
+CSV or Parquet output can be selected with outputFormat
 """
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from datetime import datetime
 from pprint import pprint
 import requests
+import csv
 import sys
 import json
 import time
 import xlsxwriter
 import urllib3
 
+# pyarrow is only required for Parquet output
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 '''
 disable insecure connection warnings
 please be advised and aware of the implications of doing this
@@ -29,11 +42,61 @@ headers = {'ContentType':'application/json'}
 user = "admin"
 passw = "<password>"
 hostObj = "hosts" # endpoint for hosts
+poolSize = 10 # maximum number of connections kept open to the cluster
+maxWorkers = poolSize # number of host detail requests sent at the same time
+useListFields = True # take host fields from the host list response where present
+
+# host fields included in the report, in column order
+hostFields = ["serial", "num_cpu_threads", "num_vms", "bios_version",
+              "bmc_version", "memory_capacity_in_bytes",
+              "hypervisor_full_name", "metadata_store_status"]
+
+# report column headers, hostname followed by hostFields
+hostHeaders = ["Hostname", "Node Serial", "CPUs per core", "No of VMs",
+               "BIOS Version", "BMC Version", "Memory Capacity (bytes)",
+               "Hypervisor OS", "Metadata Store"]
+
+outputFormat = "xlsx" # report format - xlsx, csv or parquet
+parquetBatchSize = 1000 # rows buffered before each Parquet row group is written
+
+sessions = {}
+sessionsLock = Lock()
+
+# return the pooled HTTP session for these credentials, creating it on first use
+# connections are kept alive and re-used by every request below instead of
+# opening a new TLS connection to port 9440 each time
+# retry rule: requests that fail with a connection error or a 429/502/503/504
+# response are retried with exponential backoff; GET requests are always
+# retried, POST requests only when retry_post is True
+# this script leaves retry_post False: postRequest clones entities, and a
+# clone must not be sent twice
+# the session is created by the first call, so its settings come from that call
+def get_session(username, password, pool_size=10, retries=3,
+                backoff_factor=0.5, retry_post=False):
+    with sessionsLock:
+        s = sessions.get((username, password))
+        if s is None:
+            s = requests.Session()
+            s.auth = HTTPBasicAuth(username, password)
+            s.headers.update({'Accept-Encoding': 'gzip, deflate',
+                              'Connection': 'keep-alive'})
+            retry = Retry(total=retries, backoff_factor=backoff_factor,
+                          status_forcelist=(429, 502, 503, 504),
+                          allowed_methods=frozenset(
+                              ['GET', 'POST'] if retry_post else ['GET']),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                  max_retries=retry)
+            s.mount("https://", adapter)
+            sessions[(username, password)] = s
+        return s
+
+session = get_session(user, passw, pool_size=poolSize)
 
 # standard get Request
 def getRequest(baseUrl, user, passw, obj):
     comUrl = baseUrl + obj + "/"
-    r = requests.get(comUrl, auth=(user, passw), verify=False)
+    r = session.get(comUrl, auth=(user, passw), verify=False)
     return r.json()
 
 # standard post Request
@@ -43,7 +106,7 @@ def postRequest(baseUrl, user, passw, obj, data):
     dumpData = json.dumps(cloneData, separators=(',', ':'))
     print("type", type(dumpData))
     print(dumpData)
-    r = requests.post(comUrl, auth=(user, passw), data=dumpData, verify=False)
+    r = session.post(comUrl, auth=(user, passw), data=dumpData, verify=False)
     return r.status_code
 
 
@@ -51,71 +114,125 @@ def postRequest(baseUrl, user, passw, obj, data):
 def deleteRequest(baseUrl, user, passw, obj, uuid):
     comUrl = baseUrl + obj + "/" + uuid
     print("URL: ", comUrl)
-    r = requests.delete(comUrl, auth=(user, passw), verify=False)
+    r = session.delete(comUrl, auth=(user, passw), verify=False)
     return r.status_code
 
 
-# get a list of host Names and UUIDs
-# Return dictionary with name to host Mapping
-def getHostNames(hostObj):
+# get the full host list
+# the list response already includes most host fields, so it is kept
+# rather than reduced to names and UUIDs
+def getHostList(hostObj):
     hostData = getRequest(baseUrl, user, passw, hostObj)
-    nameUuidDict = {}
-    for field in hostData["entities"]:
-        nameUuidDict[field["name"]] = field["uuid"]
-    return nameUuidDict
+    return hostData["entities"]
+
+# get the report values for a single host
+# fields are taken from the host list entry where present; the host's own
+# endpoint is only requested if any fields are missing from the list entry
+# (or if useListFields is False)
+def getHostValues(hostEntry, hostObj):
+    if not useListFields or any(field not in hostEntry for field in hostFields):
+        hostKeyObj = hostObj + "/" + hostEntry["uuid"]
+        hostJson = getRequest(baseUrl, user, passw, hostKeyObj)
+        hostEntry = {**hostEntry, **hostJson} if useListFields else hostJson
+    return [hostEntry.get(field) for field in hostFields]
+
+# get individual statistics from each host, in host list order
+# yields (hostname, metrics as a list of values) as each host is ready;
+# hosts needing a detail request are fetched concurrently through the
+# pooled session, up to maxWorkers at a time
+def iterHostStats(hostList, hostObj, workers=maxWorkers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hostValues = executor.map(lambda hostEntry: getHostValues(hostEntry, hostObj), hostList)
+        for hostEntry, values in zip(hostList, hostValues):
+            yield hostEntry["name"], values
 
 # get individual statistics from each host
-# hostJson return json data structure for individual host
-# required parameters can be extracted from the host Json structure
 # returns a dictionary with hostname as the key and metrics as a list of values
-def getHostStats(nameUuidDict, hostObj):
-    hostStatsDict = {}
-    for name, uuid in nameUuidDict.items():
-        hostKeyObj = hostObj + "/" + uuid
-        hostJson = getRequest(baseUrl, user, passw, hostKeyObj)
-        hostStatsDict[name]= [ hostJson["serial"], hostJson["num_cpu_threads"],
-        hostJson["num_vms"], hostJson["bios_version"],
-        hostJson["bmc_version"], hostJson["memory_capacity_in_bytes"],
-        hostJson["hypervisor_full_name"],hostJson["metadata_store_status"]]
-    return hostStatsDict
+def getHostStats(hostList, hostObj):
+    return dict(iterHostStats(hostList, hostObj))
 
 
-# create an excel sheet of host details in current directory
-def printHostStats(hostStatsDict):
-    # Create a filename based on current timestamp and initialise worksheet
+# create a report filename based on current timestamp
+def reportFileName(extension):
     now = datetime.now()
     dt_string = now.strftime("%d-%m-%y_%H-%M-%S")
-    fileName = "host_report_" + dt_string + ".xlsx"
-    print(fileName)
-    workbook = xlsxwriter.Workbook(fileName)
+    return "host_report_" + dt_string + "." + extension
+
+# write host rows to an excel sheet as they arrive
+# constant_memory mode flushes each row to disk once the next row is started,
+# so memory use doesn't grow with the number of hosts
+def writeXlsx(fileName, hostStats):
+    workbook = xlsxwriter.Workbook(fileName, {'constant_memory': True})
     worksheet = workbook.add_worksheet()
     bold = workbook.add_format({'bold': True})
 
     # Add data headers or titles for the metrics
-    worksheet.write('A1', 'Hostname', bold)
-    worksheet.write('B1', 'Node Serial', bold)
-    worksheet.write('C1', 'CPUs per core', bold)
-    worksheet.write('D1', 'No of VMs', bold)
-    worksheet.write('E1', 'BIOS Version', bold)
-    worksheet.write('F1', 'BMC Version', bold)
-    worksheet.write('G1', 'Memory Capacity (bytes)', bold)
-    worksheet.write('H1', 'Hypervisor OS', bold)
-    worksheet.write('I1', 'Metadata Store', bold)
-
-    # Set starting row and column on worksheet
-    row = 1
-    col = 0
-
-    # Write data from Host dictionary to the excel sheet
-    for name, values in hostStatsDict.items():
-        worksheet.write(row, col, name)
-        for i, val in enumerate(values):
-            worksheet.write(row, col + 1 + i, val)
-        row += 1
+    worksheet.write_row(0, 0, hostHeaders, bold)
+
+    # Write each host as a single row, starting below the headers
+    for row, (name, values) in enumerate(hostStats, start=1):
+        worksheet.write_row(row, 0, [name] + values)
 
     workbook.close()
 
+# write host rows to a CSV file as they arrive
+def writeCsv(fileName, hostStats):
+    with open(fileName, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(hostHeaders)
+        for name, values in hostStats:
+            writer.writerow([name] + values)
+
+# write host rows to a Parquet file, parquetBatchSize rows at a time
+# requires pyarrow
+def writeParquet(fileName, hostStats):
+    if pyarrow is None:
+        sys.exit("Parquet output requires pyarrow - pip3 install pyarrow")
+    schema = pyarrow.schema([
+        ("Hostname", pyarrow.string()),
+        ("Node Serial", pyarrow.string()),
+        ("CPUs per core", pyarrow.int64()),
+        ("No of VMs", pyarrow.int64()),
+        ("BIOS Version", pyarrow.string()),
+        ("BMC Version", pyarrow.string()),
+        ("Memory Capacity (bytes)", pyarrow.int64()),
+        ("Hypervisor OS", pyarrow.string()),
+        ("Metadata Store", pyarrow.string())])
+
+    def writeBatch(writer, rows):
+        columns = [list(column) for column in zip(*rows)]
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema))
+
+    with pyarrow.parquet.ParquetWriter(fileName, schema) as writer:
+        rows = []
+        for name, values in hostStats:
+            rows.append([name] + values)
+            if len(rows) == parquetBatchSize:
+                writeBatch(writer, rows)
+                rows = []
+        if rows:
+            writeBatch(writer, rows)
+
+reportWriters = {"xlsx": writeXlsx, "csv": writeCsv, "parquet": writeParquet}
+
+# write host details to a report in current directory
+# hostStats is any iterable of (hostname, list of values), e.g. iterHostStats(),
+# so rows are written as each host is fetched
+def writeHostStats(hostStats, outputFormat=outputFormat):
+    if outputFormat not in reportWriters:
+        sys.exit("Unsupported output format " + outputFormat +
+                 " - use one of " + ", ".join(reportWriters))
+    fileName = reportFileName(outputFormat)
+    print(fileName)
+    reportWriters[outputFormat](fileName, hostStats)
+    return fileName
+
+# create an excel sheet of host details in current directory
+def printHostStats(hostStatsDict):
+    return writeHostStats(hostStatsDict.items(), "xlsx")
+
 if __name__ == '__main__':
-    nameUuidDict = getHostNames(hostObj)
-    hostStatsDict = getHostStats(nameUuidDict, hostObj)
-    printHostStats(hostStatsDict)
\ No newline at end of file
+    hostList = getHostList(hostObj)
+    writeHostStats(iterHostStats(hostList, hostObj))
\ No newline at end of file
@@ -15,6 +15,9 @@ setup(
         'urllib3',
         'XlsxWriter'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     packages=find_packages('.'),
     package_dir={'': '.'}
 )
@@ -6,11 +6,14 @@ Specifically for use with the Nutanix v3 REST APIs
 '''
 
 import sys
+from threading import Lock
 
 try:
     import urllib3
     import requests
+    from requests.adapters import HTTPAdapter
     from requests.auth import HTTPBasicAuth
+    from urllib3.util.retry import Retry
 except ModuleNotFoundError as error:
     # Output expected ImportErrors.
     print(f'''
@@ -25,6 +28,51 @@ except ModuleNotFoundError as error:
     sys.exit()
 
 
+SESSIONS = {}
+SESSIONS_LOCK = Lock()
+
+
+def get_session(username, password, pool_size=10, retries=3,
+                backoff_factor=0.5, retry_post=False):
+    '''
+    return the pooled requests.Session for these credentials, creating
+    it on first use
+    all ApiClient instances share the session, so the blueprint lookup
+    and the launch request go over the same keep-alive connection
+    instead of each opening a new TLS connection to Prism Central
+    retry rule: requests that fail with a connection error or a
+    429/502/503/504 response are retried with exponential backoff;
+    GET requests are always retried, POST requests only when
+    retry_post is True
+    this script leaves retry_post False: a POST may launch a
+    blueprint and must not be sent twice
+    the session is created by the first call, so its settings come
+    from that call
+    '''
+    with SESSIONS_LOCK:
+        session = SESSIONS.get((username, password))
+        if session is None:
+            session = requests.Session()
+            session.auth = HTTPBasicAuth(username, password)
+            session.headers.update({
+                'Content-Type': 'application/json; charset=utf-8',
+                'Accept-Encoding': 'gzip, deflate',
+                'Connection': 'keep-alive',
+            })
+            retry = Retry(total=retries,
+                          backoff_factor=backoff_factor,
+                          status_forcelist=(429, 502, 503, 504),
+                          allowed_methods=frozenset(
+                              ['GET', 'POST'] if retry_post else ['GET']),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=pool_size,
+                                  max_retries=retry)
+            session.mount('https://', adapter)
+            SESSIONS[(username, password)] = session
+        return session
+
+
 class ApiClient():
     '''
     the most important class in our script
@@ -69,23 +117,19 @@ class ApiClient():
         have already collected
         '''
 
-        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        session = get_session(self.username, self.password)
         try:
             if self.method == 'post':
-                api_request = requests.post(
+                api_request = session.post(
                     self.request_url,
                     data=self.body,
                     verify=False,
-                    headers=headers,
-                    auth=HTTPBasicAuth(self.username, self.password),
                     timeout=self.timeout,
                 )
             else:
-                api_request = requests.get(
+                api_request = session.get(
                     self.request_url,
                     verify=False,
-                    headers=headers,
-                    auth=HTTPBasicAuth(self.username, self.password),
                     timeout=self.timeout,
                 )
         except requests.ConnectTimeout:
@@ -7,15 +7,101 @@ the definition of large will vary from location to location
 """
 
 from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib3
 import argparse
 import getpass
 import json
+import time
 from base64 import b64encode
 import sys
 import os
 
+"""
+the nutanix 'vms' API will only ever return 500 VMs in a single response
+this will apply even if the 'length' parameter is set to a value >500
+"""
+MAX_VMS_IN_RESPONSE = 500
+
+"""
+connection pool settings for the shared HTTP session
+these can be tuned to suit the environment; the pool size should be
+at least as large as the number of pages requested at the same time
+"""
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+
+_sessions = {}
+_sessions_lock = Lock()
+
+
+def get_session(
+    username: str,
+    password: str,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+    retry_post: bool = False,
+):
+    """
+    return the shared requests.Session for the supplied credentials,
+    creating it on first use
+
+    every request made with the session re-uses an already-open
+    keep-alive connection from the pool, where one is available,
+    instead of paying for a new TCP connection and TLS handshake
+    the Basic Authorization header is encoded once, here, rather than
+    for every request
+
+    retry rule: requests that fail with a connection error or a
+    429/502/503/504 response are retried with exponential backoff;
+    GET requests are always retried, POST requests only when
+    retry_post is True
+    this script passes retry_post=True: it only sends v3 list POST
+    requests, which are read-only, so retrying them is safe
+    the session is created by the first call, so its settings come
+    from that call
+    """
+    with _sessions_lock:
+        session = _sessions.get((username, password))
+        if session is None:
+            encoded_credentials = b64encode(
+                bytes(f"{username}:{password}", encoding="ascii")
+            ).decode("ascii")
+
+            session = requests.Session()
+            session.headers.update(
+                {
+                    "Accept": "application/json",
+                    "Accept-Encoding": "gzip, deflate",
+                    "Content-Type": "application/json",
+                    "Authorization": f"Basic {encoded_credentials}",
+                    "Connection": "keep-alive",
+                    "cache-control": "no-cache",
+                }
+            )
+            retry = Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(429, 502, 503, 504),
+                allowed_methods=frozenset(["GET", "POST"] if retry_post else ["GET"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[(username, password)] = session
+        return session
+
 
 @dataclass
 class RequestParameters:
@@ -28,7 +114,7 @@ class RequestParameters:
     uri: str
     username: str
     password: str
-    payload: str
+    payload: str = ""
 
 
 class RequestResponse:
@@ -73,35 +159,20 @@ class RESTClient:
         response = RequestResponse()
 
         """
-        setup the HTTP Basic Authorization header based on the
+        the shared session already carries the request headers,
+        including the HTTP Basic Authorization header built from the
         supplied username and password
         done this way so that passwords are not supplied on the command line
         """
-        username = self.params.username
-        password = self.params.password
-        encoded_credentials = b64encode(
-            bytes(f"{username}:{password}", encoding="ascii")
-        ).decode("ascii")
-        auth_header = f"Basic {encoded_credentials}"
-
-        """
-        setup the request headers
-        note the use of {auth_header} i.e. the Basic Authorization
-        credentials we setup earlier
-        """
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"{auth_header}",
-            "cache-control": "no-cache",
-        }
+        session = get_session(
+            self.params.username, self.params.password, retry_post=True
+        )
 
         try:
             # submit the request
-            api_request = requests.post(
+            api_request = session.post(
                 self.params.uri,
                 data=self.params.payload,
-                headers=headers,
                 verify=False,
                 timeout=10,
             )
@@ -137,210 +208,306 @@ class RESTClient:
         return response
 
 
-"""
-suppress warnings about insecure connections
-you probably shouldn't do this in production
-"""
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+class RequestFailedError(Exception):
+    """
+    raised by iter_entities when a page request does not succeed
+    the failed RequestResponse is kept so the caller can show the
+    code, message and details in the same way as the main script
+    """
 
-"""
-setup our command line parameters
-for this example we only require the a single parameter
-- the name of the JSON file that contains our request parameters
-this is a very clean way of passing parameters to this sort of
-script, without the need for excessive parameters on the command line
-"""
-parser = argparse.ArgumentParser()
-parser.add_argument("json", help="JSON file containing query parameters")
-args = parser.parse_args()
+    def __init__(self, response: RequestResponse):
+        super().__init__(response.message)
+        self.response = response
 
-"""
-try and read the JSON parameters from the supplied file
-"""
-json_data = ""
-try:
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    with open(f"{script_dir}/{args.json}", "r") as params:
-        json_data = json.load(params)
-except FileNotFoundError:
-    print(f"{args.json} parameters file not found.")
-    sys.exit()
-except json.decoder.JSONDecodeError:
-    print("\nThe provided JSON file cannot be parsed.")
-    print("Please check the file contains valid JSON, then try again.\n")
-    sys.exit()
-
-try:
-    cluster_ip = json_data["cluster_ip"]
-    user = json_data["username"]
-
-    # get the cluster password
-    print(f"\nConnecting to {cluster_ip} ...")
-    cluster_password = getpass.getpass(
-        prompt="Please enter your cluster password: ", stream=None
-    )
 
-    # setup the parameters for the initial request
-    parameters = RequestParameters(
-        uri=f"https://{cluster_ip}:9440/api/nutanix/v3/vms/list",
-        username=user,
-        password=cluster_password,
-        payload='{"kind":"vm","length":500,"offset":0}',
+def fetch_page(
+    parameters: RequestParameters,
+    kind: str,
+    offset: int,
+    length: int = MAX_VMS_IN_RESPONSE,
+):
+    """
+    request a single page of entities, starting at the specified offset
+    a dedicated RESTClient is created for each page so that pages
+    can be requested from multiple threads without sharing state
+    the time taken to receive the page is returned along with the
+    response, allowing page timings to be compared when tuning
+    the concurrency against Prism Central API rate limits
+
+    parameters.payload, if set, is a JSON request body with any other
+    list options e.g. '{"filter": "vm_name==web.*"}'; kind, length
+    and offset are always set here for each page
+    """
+    body = json.loads(parameters.payload) if parameters.payload else {}
+    body.update({"kind": kind, "length": length, "offset": offset})
+    page_parameters = RequestParameters(
+        uri=parameters.uri,
+        username=parameters.username,
+        password=parameters.password,
+        payload=json.dumps(body),
     )
-
+    start = time.perf_counter()
+    page_response = RESTClient(page_parameters).send_request()
+    return page_response, time.perf_counter() - start
+
+
+def iter_pages(
+    parameters: RequestParameters,
+    kind: str,
+    total_matches: int,
+    page_size: int = MAX_VMS_IN_RESPONSE,
+    concurrency: int = 1,
+):
     """
-    this instance of our RESTClient class will be used for this and
-    all subsequent requests, if they are required
-    i.e. if the cluster has >500 VMs
+    generator that requests every page after the first one
+    the first page has already been received at this point, so
+    offsets start at page_size
+
+    the remaining offsets are fanned out over a bounded pool of
+    worker threads; with a concurrency of 1 the pages are requested
+    one after another, exactly as before
+
+    pages are yielded in offset order as soon as each page (and every
+    page before it) has arrived, so the caller can start processing
+    entities while the later pages are still in flight
+    no more than 'concurrency' pages are requested ahead of the
+    caller, so a slow consumer doesn't cause every page to be held
+    in memory at once
     """
-    rest_client = RESTClient(parameters)
+    offsets = iter(range(page_size, total_matches, page_size))
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = deque()
+        for offset in islice(offsets, concurrency):
+            in_flight.append(
+                executor.submit(fetch_page, parameters, kind, offset, page_size)
+            )
+        iterator = 1
+        while in_flight:
+            page_response, elapsed = in_flight.popleft().result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                in_flight.append(
+                    executor.submit(fetch_page, parameters, kind, next_offset, page_size)
+                )
+            yield iterator, page_response, elapsed
+            iterator += 1
 
-    # send the initial request
-    response = rest_client.send_request()
 
+def iter_entities(
+    parameters: RequestParameters,
+    kind: str,
+    page_size: int = MAX_VMS_IN_RESPONSE,
+    concurrency: int = 1,
+    on_page=None,
+):
     """
-    see if the request was valid
-    for this code sample, a return code of -99 indicates something
-    went wrong
-    all other codes are standard HTTP codes
+    generator that yields one entity at a time from a v3 list endpoint
+    e.g. iter_entities(parameters, "vm") with parameters.uri set to
+    https://<cluster_ip>:9440/api/nutanix/v3/vms/list
+
+    each page is released as soon as its entities have been handed
+    to the caller, so memory usage depends on the page size and
+    concurrency, not on the number of entities in the environment
+    on_page(iterator, page_response, elapsed), if supplied, is called
+    as each successful page arrives, starting with iteration 0
+    RequestFailedError is raised if any page request fails
     """
-    if (response.code == 200) or (response.code == 201):
-        """
-        the initial request was successful
-        now we need to check for the number of VMs, since this
-        script is specifically written to be compatible with
-        'large' clusters
-        """
-
+    first_page, elapsed = fetch_page(parameters, kind, 0, page_size)
+    if first_page.code not in (200, 201):
+        raise RequestFailedError(first_page)
+    if on_page:
+        on_page(0, first_page, elapsed)
+    total_matches = first_page.json["metadata"]["total_matches"]
+    yield from first_page.json["entities"]
+    del first_page
+
+    for iterator, page, elapsed in iter_pages(
+        parameters, kind, total_matches, page_size, concurrency
+    ):
+        if page.code not in (200, 201):
+            raise RequestFailedError(page)
+        if on_page:
+            on_page(iterator, page, elapsed)
+        yield from page.json["entities"]
+        del page
+
+
+def show_page(iterator: int, response: RequestResponse, elapsed: float):
+    """
+    print the details of each page as iter_entities receives it
+    the first page also tells us how many VMs there are in total,
+    and so how many requests are required
+    """
+    if iterator == 0:
         """
         first, grab the number of VMs from this initial request
         we'll use this number to calculate how many interations
-        to make in upcoming requests
+        are required
         """
-
         vm_count = response.json["metadata"]["total_matches"]
-        vms_in_request = response.json["metadata"]["length"]
-
         print(f"Total VMs in this cluster: {vm_count}")
-        print(f"Total VMs in this request (iteration #0): {vms_in_request}")
-
-        """
-        the nutanix 'vms' API will only ever return 500 VMs
-        this will apply even if the 'length' parameter is set to a value >500
-        """
-        if vm_count > 500:
+        if vm_count > MAX_VMS_IN_RESPONSE:
             """
             at this point you would "do something" based on knowing there are
             >500 VMs in the cluster
 
-            for example, you could iterate over the VMs, collecting
-            the necessary information, etc
+            iter_entities requests the remaining pages, starting from the
+            VM at index 501; we've already got the response for the
+            first 500 VMs, so they're not requested again
 
-            for our demo, we've already got a response containing
-            information about the first 500 VMs so there's no need
-            to submit a request for the first 500 again
-            (expensive and unnecessary)
+            note 500 is the MAXIMUM number of VMs returned in a
+            single request
             """
             print("There are more than 500 VMs in this cluster.")
             print(
                 "Multiple iterations/requests are required "
                 + "to collect all VM information."
             )
-
-            """
-            by immediately setting the offset to 500, subsequent requests
-            will start from VM at index 501 and go forward from there
-            again, we've already got the response above for the first 500 VMs
-
-            we're using chunks of 500 VMs here, but in a real app there's no
-            reason why this chunk needs to be 500
-            note, however, the 500 is the MAXIMUM number of VMs returned in a
-            single request
-            """
-
-            max_vms_in_response = 500
-            offset = max_vms_in_response
-
-            """
-            work out how many interations are required
-            simple math based on the number of times
-            a 500 VM response will be received
-            """
-            iterations = vm_count // max_vms_in_response
+            iterations = (vm_count - 1) // MAX_VMS_IN_RESPONSE
             print(
                 "Total iterations required, including the "
                 + f"initial request: {iterations + 1}"
             )
-
-            """
-            starting at 1 here because we've already completed iteration '0'
-            """
-            iterator = 1
-            while iterator <= iterations:
-                iterator_parameters = RequestParameters(
-                    uri=f"https://{cluster_ip}:9440/api/nutanix/v3/vms/list",
-                    username=user,
-                    password=cluster_password,
-                    payload=f'{{"kind":"vm","length":500,"offset":{offset}}}',
-                )
-
-                # set the parameters for the next request, then submit it
-                rest_client.params = iterator_parameters
-                iterator_response = rest_client.send_request()
-
-                # check to see what response we got back
-                if (iterator_response.code == 200) or (iterator_response.code == 201):
-                    iterator_vm_count = iterator_response.json["metadata"]["length"]
-                    print(
-                        "Total VMs in this request "
-                        + f"(iteration #{iterator}): {iterator_vm_count}"
-                    )
-                else:
-                    '''
-                    an error of some sort occurred during the request
-                    show the code and related messages for troubleshooting purposes
-                    '''
-                    print(f'Response code: {iterator_response.code}')
-                    print(f'Message: {response.message}')
-                    print(f'Details: {response.details}')
-
-                '''
-                increment our variables so we aren't hitting infinite loops
-                and getting the same batch of VMs again
-                '''
-                iterator += 1
-                offset += max_vms_in_response
         else:
             print("There are fewer than 500 VMs in this cluster")
             print(
                 "Only a single iteration/request is required to collect "
                 + "all VM information"
             )
+    print(
+        "Total VMs in this request "
+        + f"(iteration #{iterator}): {response.json['metadata']['length']} "
+        + f"({elapsed:.2f}s)"
+    )
 
-    elif response.code == -99:
-        # indicate that we've caught an exception and
-        print("\nScript threw custom error code -99.")
-        print(f"{response.message}\n")
-        print(f"Details: {response.details}\n")
-    else:
-        print(f"HTTP code: {response.code}\n")
-        print(f"Message: {response.message}\n")
-        print(f"JSON: {response.json}\n")
-        print(f"Details: {response.details}")
 
+def main():
+    """
+    suppress warnings about insecure connections
+    you probably shouldn't do this in production
+    """
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-except KeyError:
     """
-    in this instance, a KeyError most likely indicates a malformed
-    or incomplete JSON parameters file
+    setup our command line parameters
+    for this example we only require the a single parameter
+    - the name of the JSON file that contains our request parameters
+    this is a very clean way of passing parameters to this sort of
+    script, without the need for excessive parameters on the command line
     """
-    print("\nThe provided JSON file either cannot be parsed")
-    print("or does not contain the required parameters.")
-    print("Please check the file contains cluster_ip and")
-    print("username parameters, then try again.\n")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json", help="JSON file containing query parameters")
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of VM pages to request at the same time (default: 1)",
+    )
+    args = parser.parse_args()
 
-"""
-wait for the enter key before continuing
-this is to prevent terminal flashing if being run inside VS Code, for example
-"""
-input("\nPress ENTER to exit.")
+    """
+    try and read the JSON parameters from the supplied file
+    """
+    json_data = ""
+    try:
+        script_dir = os.path.dirname(os.path.realpath(__file__))
+        with open(f"{script_dir}/{args.json}", "r") as params:
+            json_data = json.load(params)
+    except FileNotFoundError:
+        print(f"{args.json} parameters file not found.")
+        sys.exit()
+    except json.decoder.JSONDecodeError:
+        print("\nThe provided JSON file cannot be parsed.")
+        print("Please check the file contains valid JSON, then try again.\n")
+        sys.exit()
+
+    try:
+        cluster_ip = json_data["cluster_ip"]
+        user = json_data["username"]
+
+        # get the cluster password
+        print(f"\nConnecting to {cluster_ip} ...")
+        cluster_password = getpass.getpass(
+            prompt="Please enter your cluster password: ", stream=None
+        )
+
+        """
+        create the shared, pooled HTTP session before the first request
+        so that the pool is large enough for the requested concurrency
+        """
+        get_session(
+            user,
+            cluster_password,
+            pool_size=max(DEFAULT_POOL_SIZE, args.concurrency),
+            retry_post=True,
+        )
+
+        # setup the parameters used for every page request
+        # iter_entities sets the kind, length and offset of each page
+        parameters = RequestParameters(
+            uri=f"https://{cluster_ip}:9440/api/nutanix/v3/vms/list",
+            username=user,
+            password=cluster_password,
+        )
+
+        if args.concurrency > 1:
+            print(f"Requesting up to {args.concurrency} pages at a time.")
+
+        """
+        iter_entities hands the VMs back one at a time, in order, as
+        their pages arrive
+        for our demo we only count them; in a real app this is where
+        each VM would be processed
+        """
+        start = time.perf_counter()
+        vms_listed = 0
+        try:
+            for _ in iter_entities(
+                parameters, "vm", concurrency=args.concurrency, on_page=show_page
+            ):
+                vms_listed += 1
+        except RequestFailedError as error:
+            """
+            see why the request failed
+            for this code sample, a return code of -99 indicates something
+            went wrong
+            all other codes are standard HTTP codes
+            """
+            response = error.response
+            if response.code == -99:
+                # indicate that we've caught an exception and
+                print("\nScript threw custom error code -99.")
+                print(f"{response.message}\n")
+                print(f"Details: {response.details}\n")
+            else:
+                print(f"HTTP code: {response.code}\n")
+                print(f"Message: {response.message}\n")
+                print(f"JSON: {response.json}\n")
+                print(f"Details: {response.details}")
+        else:
+            print(
+                f"{vms_listed} VMs listed in "
+                + f"{time.perf_counter() - start:.2f}s."
+            )
+
+    except KeyError:
+        """
+        in this instance, a KeyError most likely indicates a malformed
+        or incomplete JSON parameters file
+        """
+        print("\nThe provided JSON file either cannot be parsed")
+        print("or does not contain the required parameters.")
+        print("Please check the file contains cluster_ip and")
+        print("username parameters, then try again.\n")
+
+    """
+    wait for the enter key before continuing
+    this is to prevent terminal flashing if being run inside VS Code, for example
+    """
+    input("\nPress ENTER to exit.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from botocore.exceptions import ParamValidationError
-import sys
-
-session = boto3.session.Session()
 
 # configuration for this connection
 # in a "real" script, these values would probably not be hard-coded
@@ -14,19 +17,11 @@ configuration = {
     "buckets": {
         "web-assets",
         "form-submissions"
-    }
+    },
+    # number of buckets provisioned at the same time
+    "workers": 16,
 }
 
-# create our s3c session using the variables above
-# note "use_ssl=False", as outlined in the accompanying article
-s3c = session.client(
-    aws_access_key_id=configuration["access_key"],
-    aws_secret_access_key=configuration["secret_key"],
-    endpoint_url=configuration["endpoint_url"],
-    service_name="s3",
-    use_ssl=False,
-)
-
 # setup our bucket lifecycle policy
 # please use this carefully as these settings will need to be
 # altered before use outside this demo environment
@@ -47,37 +42,133 @@ lifecycle_policy = {
     ]
 }
 
-# iterate over the bucket list, verify that each one does
-# not already exist and, if not, attempt to create it
-for bucket in configuration["buckets"]:
-    pass
 
-    # check if bucket exists
+def get_arguments():
+    """
+    read command line arguments, using the configuration above as defaults
+    """
+    parser = argparse.ArgumentParser(
+        description="Create Nutanix Objects buckets and apply a lifecycle policy"
+    )
+    parser.add_argument("--endpoint_url", default=configuration["endpoint_url"],
+                        help="Objects endpoint URL, e.g. http://10.0.0.10")
+    parser.add_argument("--access_key", default=configuration["access_key"])
+    parser.add_argument("--secret_key", default=configuration["secret_key"])
+    parser.add_argument("--buckets", nargs="+",
+                        default=sorted(configuration["buckets"]),
+                        help="Names of the buckets to provision")
+    parser.add_argument("--workers", type=int, default=configuration["workers"],
+                        help="Number of buckets provisioned at the same time")
+    return parser.parse_args()
+
+
+def create_client(endpoint_url, access_key, secret_key, workers):
+    """
+    create our s3c session using the variables above
+    note "use_ssl=False", as outlined in the accompanying article
+    the connection pool is sized so every worker has its own connection
+    """
+    session = boto3.session.Session()
+    return session.client(
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        endpoint_url=endpoint_url,
+        service_name="s3",
+        use_ssl=False,
+        config=Config(max_pool_connections=max(workers, 10),
+                      retries={"max_attempts": 5, "mode": "standard"}),
+    )
+
+
+def lifecycle_matches(s3c, bucket, policy):
+    """
+    return True if the bucket already has the lifecycle policy
+    rules are matched by ID; each rule must have the same values for every
+    key in the policy (Objects may return extra default keys)
+    """
     try:
-        s3c.head_bucket(Bucket=bucket)
-        print(f"Bucket exists : {bucket}")
-    except ClientError:
-        print(f"Bucket {bucket} does not exist.  "
-              + "Attempting to create bucket ...")
+        response = s3c.get_bucket_lifecycle_configuration(Bucket=bucket)
+    except ClientError as err:
+        if err.response["Error"]["Code"] == "NoSuchLifecycleConfiguration":
+            return False
+        raise
+    current = {rule.get("ID"): rule for rule in response.get("Rules", [])}
+    if set(current) != {rule["ID"] for rule in policy["Rules"]}:
+        return False
+    return all(
+        current[rule["ID"]].get(name) == value
+        for rule in policy["Rules"]
+        for name, value in rule.items()
+    )
+
+
+def provision_bucket(s3c, bucket, policy):
+    """
+    create a bucket if it doesn't already exist, then apply the lifecycle
+    policy unless the bucket already has it
+    returns a dictionary describing what was done; errors are recorded in
+    the "error" key instead of being raised, so one bad bucket doesn't stop
+    the others
+    """
+    result = {"bucket": bucket, "created": False, "lifecycle": None,
+              "error": None}
+    try:
+        # check if bucket exists
         try:
+            s3c.head_bucket(Bucket=bucket)
+        except ClientError:
             s3c.create_bucket(Bucket=bucket)
-        except Exception as err:
-            print("An exception occurred while creating the "
-                  + f"{bucket} bucket.  "
-                  + f"Details: {err}")
-            sys.exit()
-
-    # bucket either already exists or we were able to create it
-    # now apply the lifecycle policy
-    try:
-        print(f"Applying lifecycle policy to {bucket} bucket ...")
-        s3c.put_bucket_lifecycle_configuration(Bucket=bucket,
-                                               LifecycleConfiguration=lifecycle_policy)
-    except s3c.exceptions.NoSuchBucket:
-        print("Bucket does not exist.")
+            result["created"] = True
+
+        # bucket either already exists or we were able to create it
+        # now apply the lifecycle policy, if it isn't already applied
+        if not result["created"] and lifecycle_matches(s3c, bucket, policy):
+            result["lifecycle"] = "unchanged"
+        else:
+            s3c.put_bucket_lifecycle_configuration(Bucket=bucket,
+                                                   LifecycleConfiguration=policy)
+            result["lifecycle"] = "applied"
     except ParamValidationError as err:
-        print("The provided lifecycle policy is invalid.  Please check "
-              + "your policy configuration.  Details:")
-        print(f"{err}")
+        result["error"] = ("The provided lifecycle policy is invalid.  Please "
+                           + f"check your policy configuration.  Details: {err}")
     except Exception as err:
-        print(err)
+        result["error"] = str(err)
+    return result
+
+
+def provision_buckets(s3c, buckets, policy, workers=16):
+    """
+    provision every bucket, with up to workers buckets in progress at the
+    same time
+    returns the results from provision_bucket, in the same order as buckets
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda bucket: provision_bucket(s3c, bucket,
+                                                                 policy),
+                                 buckets))
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    s3c = create_client(args.endpoint_url, args.access_key, args.secret_key,
+                        args.workers)
+
+    print(f"Provisioning {len(args.buckets)} buckets with {args.workers} "
+          + "workers ...")
+    start = time.monotonic()
+    results = provision_buckets(s3c, args.buckets, lifecycle_policy,
+                                workers=args.workers)
+    elapsed = time.monotonic() - start
+
+    for result in results:
+        if result["error"]:
+            print(f"{result['bucket']}: failed.  Details: {result['error']}")
+        else:
+            state = "created" if result["created"] else "exists"
+            print(f"{result['bucket']}: {state}, lifecycle policy "
+                  + f"{result['lifecycle']}")
+
+    failed = sum(1 for result in results if result["error"])
+    print(f"Finished in {elapsed:.1f} seconds: "
+          + f"{len(results) - failed} succeeded, {failed} failed")
+    sys.exit(1 if failed else 0)
@@ -1,62 +1,452 @@
-import boto3
-from botocore.exceptions import ClientError
+import argparse
+import hashlib
+import math
+import mmap
+import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-session = boto3.session.Session()
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 # configuration for this connection
 # in a "real" script, these values would probably not be hard-coded
+# every value can also be overridden on the command line, e.g. to point
+# the script at a local S3-compatible server for testing
 configuration = {
     "endpoint_url": "[endpoint_url_here]",
     "access_key": "[access_key_here]",
     "secret_key": "[secret_key_here]",
     "bucket": "ntnxdev-uploads",
     "filename": "/tmp/hello_world.txt",
-    "key": "hello_world.txt"
+    "key": "hello_world.txt",
+    # files larger than one part are uploaded in parts of this size (MiB)
+    "part_size_mb": 64,
+    # number of parts uploaded at the same time
+    "workers": 8,
 }
 
-# create our s3c session using the variables above
-# note "use_ssl=False", as outlined in the accompanying article
-s3c = session.client(
-    aws_access_key_id=configuration["access_key"],
-    aws_secret_access_key=configuration["secret_key"],
-    endpoint_url=configuration["endpoint_url"],
-    service_name="s3",
-    use_ssl=False,
-)
-
-# check if bucket exists
-try:
-    s3c.head_bucket(Bucket=configuration["bucket"])
-    print(f"Bucket exists : {configuration['bucket']}")
-except ClientError:
-    print(f"Bucket {configuration['bucket']} does not exist.  "
-          + "Attempting to create bucket ...")
+MIB = 1024 * 1024
+
+# S3 multipart limits; parts other than the last must be at least 5 MiB
+# and an upload can have at most 10,000 parts
+MIN_PART_SIZE = 5 * MIB
+MAX_PARTS = 10000
+
+
+def get_arguments():
+    """
+    read command line arguments, using the configuration above as defaults
+    """
+    parser = argparse.ArgumentParser(
+        description="Upload a file to a Nutanix Objects bucket"
+    )
+    parser.add_argument("--endpoint_url", default=configuration["endpoint_url"],
+                        help="Objects endpoint URL, e.g. http://10.0.0.10")
+    parser.add_argument("--access_key", default=configuration["access_key"])
+    parser.add_argument("--secret_key", default=configuration["secret_key"])
+    parser.add_argument("--bucket", default=configuration["bucket"])
+    parser.add_argument("--filename", default=configuration["filename"],
+                        help="Full path of the file to upload")
+    parser.add_argument("--key", default=configuration["key"],
+                        help="Object key for the uploaded file")
+    parser.add_argument("--part_size_mb", type=int,
+                        default=configuration["part_size_mb"],
+                        help="Multipart part size, in MiB (minimum 5)")
+    parser.add_argument("--workers", type=int, default=configuration["workers"],
+                        help="Number of parts uploaded at the same time")
+    parser.add_argument("--no_resume", action="store_true",
+                        help="Always start a new multipart upload instead of "
+                        + "resuming an incomplete one")
+    parser.add_argument("--sync_directory",
+                        help="Upload every new or changed file under this "
+                        + "directory instead of a single file")
+    parser.add_argument("--prefix", default="",
+                        help="Key prefix for files uploaded with "
+                        + "--sync_directory, e.g. nightly/")
+    parser.add_argument("--checksum", action="store_true",
+                        help="With --sync_directory, compare the ETag of "
+                        + "every file instead of trusting modification times")
+    return parser.parse_args()
+
+
+def create_client(endpoint_url, access_key, secret_key, workers):
+    """
+    create our s3c session using the variables above
+    note "use_ssl=False", as outlined in the accompanying article
+    the connection pool is sized so every upload worker has its own
+    connection
+    """
+    session = boto3.session.Session()
+    return session.client(
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        endpoint_url=endpoint_url,
+        service_name="s3",
+        use_ssl=False,
+        config=Config(max_pool_connections=max(workers, 10),
+                      retries={"max_attempts": 5, "mode": "standard"}),
+    )
+
+
+def ensure_bucket(s3c, bucket):
+    """
+    check if bucket exists and create it if it doesn't
+    """
     try:
-        s3c.create_bucket(Bucket=configuration['bucket'])
+        s3c.head_bucket(Bucket=bucket)
+        print(f"Bucket exists : {bucket}")
+    except ClientError:
+        print(f"Bucket {bucket} does not exist.  "
+              + "Attempting to create bucket ...")
+        try:
+            s3c.create_bucket(Bucket=bucket)
+        except Exception as err:
+            print("An exception occurred while creating the "
+                  + f"{bucket} bucket.  "
+                  + f"Details: {err}")
+            sys.exit()
+
+
+def get_part_size(file_size, part_size):
+    """
+    return the part size to use for a file, raised if necessary so the
+    file fits in the maximum number of parts
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    return max(part_size, math.ceil(file_size / MAX_PARTS))
+
+
+def find_incomplete_upload(s3c, bucket, key):
+    """
+    return the ID of the most recent incomplete multipart upload for key,
+    or None if there isn't one
+    """
+    uploads = []
+    paginator = s3c.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=bucket, Prefix=key):
+        uploads.extend(upload for upload in page.get("Uploads", [])
+                       if upload["Key"] == key)
+    if not uploads:
+        return None
+    return max(uploads, key=lambda upload: upload["Initiated"])["UploadId"]
+
+
+def list_uploaded_parts(s3c, bucket, key, upload_id):
+    """
+    return {part number: (ETag, size)} for the parts already uploaded as
+    part of a multipart upload
+    """
+    parts = {}
+    paginator = s3c.get_paginator("list_parts")
+    for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts[part["PartNumber"]] = (part["ETag"], part["Size"])
+    return parts
+
+
+def is_single_part(file_size, part_size):
+    """
+    return True if a file is uploaded with a single PUT rather than a
+    multipart upload
+    """
+    return file_size <= max(part_size, MIN_PART_SIZE)
+
+
+def local_etag(filename, part_size):
+    """
+    return the ETag Objects will report for a file uploaded by this script
+    single PUT uploads have the MD5 of the file as their ETag; multipart
+    uploads have the MD5 of the concatenated part MD5s followed by the
+    number of parts, e.g. "...-12"
+    """
+    file_size = os.path.getsize(filename)
+
+    def md5_of(f, size):
+        md5 = hashlib.md5()
+        while size:
+            chunk = f.read(min(size, 8 * MIB))
+            if not chunk:
+                break
+            md5.update(chunk)
+            size -= len(chunk)
+        return md5
+
+    with open(filename, "rb") as f:
+        if is_single_part(file_size, part_size):
+            return f'"{md5_of(f, file_size).hexdigest()}"'
+        part_size = get_part_size(file_size, part_size)
+        part_count = math.ceil(file_size / part_size)
+        digests = [
+            md5_of(f, min(part_size, file_size - part * part_size)).digest()
+            for part in range(part_count)
+        ]
+    return f'"{hashlib.md5(b"".join(digests)).hexdigest()}-{part_count}"'
+
+
+class Progress:
+    """
+    track the number of bytes uploaded and print the throughput as each
+    part finishes
+    """
+
+    def __init__(self, total_bytes, total_parts, verbose=True):
+        self.total_bytes = total_bytes
+        self.total_parts = total_parts
+        self.verbose = verbose
+        self.uploaded_bytes = 0
+        self.skipped_bytes = 0
+        self.done_parts = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, size, skipped=False):
+        with self._lock:
+            self.done_parts += 1
+            if skipped:
+                self.skipped_bytes += size
+            else:
+                self.uploaded_bytes += size
+            done = self.uploaded_bytes + self.skipped_bytes
+            if not self.verbose:
+                return
+            print(f"\r  {self.done_parts}/{self.total_parts} parts, "
+                  + f"{done / MIB:.1f}/{self.total_bytes / MIB:.1f} MiB, "
+                  + f"{self.throughput():.1f} MiB/s", end="", flush=True)
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def throughput(self):
+        """
+        MiB/s uploaded since the start, not counting resumed parts
+        """
+        return self.uploaded_bytes / MIB / max(self.elapsed(), 1e-6)
+
+
+def multipart_upload(s3c, bucket, key, filename, part_size, workers,
+                     resume=True, verbose=True):
+    """
+    upload a file in parts, with up to workers parts uploading at the same
+    time
+    the file is memory-mapped so each part is read straight from the page
+    cache; only the parts currently uploading are held in memory
+    if resume is True and an incomplete upload of the same key exists,
+    parts that were already uploaded with the same size and MD5 are not
+    sent again
+    if the upload fails, it is left incomplete so running the script again
+    resumes it
+    verbose=False hides the progress messages, e.g. when several files are
+    uploading at once
+    """
+    log = print if verbose else (lambda *args, **kwargs: None)
+    file_size = os.path.getsize(filename)
+    part_size = get_part_size(file_size, part_size)
+    part_count = math.ceil(file_size / part_size)
+
+    upload_id = find_incomplete_upload(s3c, bucket, key) if resume else None
+    if upload_id:
+        uploaded = list_uploaded_parts(s3c, bucket, key, upload_id)
+        log(f"Resuming multipart upload {upload_id} "
+              + f"({len(uploaded)} parts already uploaded) ...")
+    else:
+        upload_id = s3c.create_multipart_upload(Bucket=bucket,
+                                                Key=key)["UploadId"]
+        uploaded = {}
+        log(f"Started multipart upload {upload_id} ...")
+
+    log(f"Uploading {part_count} parts of {part_size / MIB:.0f} MiB "
+        + f"with {workers} workers ...")
+    progress = Progress(file_size, part_count, verbose=verbose)
+
+    with open(filename, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        def send_part(part_number):
+            start = (part_number - 1) * part_size
+            data = mm[start:start + part_size]
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+            if uploaded.get(part_number) == (etag, len(data)):
+                progress.add(len(data), skipped=True)
+                return {"PartNumber": part_number, "ETag": etag}
+            response = s3c.upload_part(Bucket=bucket, Key=key,
+                                       UploadId=upload_id,
+                                       PartNumber=part_number, Body=data)
+            progress.add(len(data))
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(send_part,
+                                          range(1, part_count + 1)))
+        except BaseException:
+            log("\nUpload interrupted; run the script again to resume "
+                + f"multipart upload {upload_id}.")
+            raise
+
+    log()
+    s3c.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                  MultipartUpload={"Parts": parts})
+    return progress
+
+
+def upload_file(s3c, bucket, key, filename, part_size=64 * MIB, workers=8,
+                resume=True, verbose=True):
+    """
+    upload a file, using a single streamed PUT for files that fit in one
+    part and a parallel multipart upload for anything larger
+    returns the number of seconds taken and the throughput in MiB/s
+    """
+    file_size = os.path.getsize(filename)
+    if verbose:
+        print(f"Uploading file {filename} ({file_size / MIB:.1f} MiB), as "
+              + f"object {key} in bucket {bucket} ...")
+    if is_single_part(file_size, part_size):
+        start = time.monotonic()
+        with open(filename, "rb") as f:
+            s3c.put_object(Bucket=bucket, Key=key, Body=f)
+        elapsed = time.monotonic() - start
+        return elapsed, file_size / MIB / max(elapsed, 1e-6)
+
+    progress = multipart_upload(s3c, bucket, key, filename, part_size,
+                                workers, resume=resume, verbose=verbose)
+    return progress.elapsed(), progress.throughput()
+
+
+def list_remote_objects(s3c, bucket, prefix):
+    """
+    return {key: object} for every object under prefix, using one
+    paginated listing (1,000 keys per request) instead of a request per file
+    """
+    remote = {}
+    paginator = s3c.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            remote[obj["Key"]] = obj
+    return remote
+
+
+def walk_directory(directory, prefix):
+    """
+    yield (key, filename) for every file under directory
+    keys are the file's path relative to directory, with "/" separators,
+    after the prefix
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            filename = os.path.join(root, name)
+            relative = os.path.relpath(filename, directory)
+            yield prefix + relative.replace(os.sep, "/"), filename
+
+
+def needs_upload(filename, remote, part_size, checksum=False):
+    """
+    decide whether a local file differs from its object
+    - missing objects and size changes are always uploaded
+    - files not modified since the object was uploaded are skipped without
+      reading them, unless checksum is True
+    - otherwise the file's ETag is calculated and compared
+    """
+    if remote is None:
+        return True
+    stat = os.stat(filename)
+    if stat.st_size != remote["Size"]:
+        return True
+    if not checksum and stat.st_mtime <= remote["LastModified"].timestamp():
+        return False
+    return local_etag(filename, part_size) != remote["ETag"]
+
+
+def sync_directory(s3c, bucket, directory, prefix="", part_size=64 * MIB,
+                   workers=8, checksum=False):
+    """
+    upload every new or changed file under directory to bucket
+    the bucket is listed once, then up to workers files are compared and
+    uploaded at the same time; a repeat sync of an unchanged directory
+    costs the listing and nothing else
+    returns a dictionary of "uploaded", "skipped" and "failed" keys, with
+    the failed files mapped to their errors
+    """
+    print(f"Listing objects in bucket {bucket} under prefix '{prefix}' ...")
+    remote = list_remote_objects(s3c, bucket, prefix)
+    files = list(walk_directory(directory, prefix))
+    print(f"Found {len(remote)} objects and {len(files)} local files.")
+
+    results = {"uploaded": [], "skipped": [], "failed": {}}
+    uploaded_bytes = 0
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def sync_file(key, filename):
+        nonlocal uploaded_bytes
+        try:
+            if not needs_upload(filename, remote.get(key), part_size,
+                                checksum=checksum):
+                with lock:
+                    results["skipped"].append(key)
+                return
+            # each file's parts are sent one at a time; the pool uploads
+            # several files at once instead
+            upload_file(s3c, bucket, key, filename, part_size=part_size,
+                        workers=1, verbose=False)
+            with lock:
+                results["uploaded"].append(key)
+                uploaded_bytes += os.path.getsize(filename)
+                print(f"Uploaded {filename} as {key}")
+        except Exception as err:
+            with lock:
+                results["failed"][key] = err
+                print(f"Failed to upload {filename}.  Details: {err}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for key, filename in files:
+            executor.submit(sync_file, key, filename)
+
+    elapsed = time.monotonic() - start
+    print(f"Sync finished in {elapsed:.1f} seconds: "
+          + f"{len(results['uploaded'])} uploaded "
+          + f"({uploaded_bytes / MIB / max(elapsed, 1e-6):.1f} MiB/s), "
+          + f"{len(results['skipped'])} unchanged, "
+          + f"{len(results['failed'])} failed")
+    return results
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    s3c = create_client(args.endpoint_url, args.access_key, args.secret_key,
+                        args.workers)
+
+    ensure_bucket(s3c, args.bucket)
+
+    if args.sync_directory:
+        results = sync_directory(s3c, args.bucket, args.sync_directory,
+                                 prefix=args.prefix,
+                                 part_size=args.part_size_mb * MIB,
+                                 workers=args.workers,
+                                 checksum=args.checksum)
+        sys.exit(1 if results["failed"] else 0)
+
+    try:
+        elapsed, throughput = upload_file(s3c, args.bucket, args.key,
+                                          args.filename,
+                                          part_size=args.part_size_mb * MIB,
+                                          workers=args.workers,
+                                          resume=not args.no_resume)
+        print(f"Upload finished in {elapsed:.1f} seconds "
+              + f"({throughput:.1f} MiB/s)")
+
+        # verify if file is uploaded
+        print(f"Checking if {args.key} exists ...")
+        response = s3c.head_object(Bucket=args.bucket, Key=args.key)
+        print(f"Head Object Response : {response}")
+    except s3c.exceptions.NoSuchBucket:
+        print(f"The {args.bucket} bucket does not exist.  "
+              + "Aborting ...")
     except Exception as err:
-        print("An exception occurred while creating the "
-              + f"{configuration['bucket']} bucket.  "
-              + f"Details: {err}")
-        sys.exit()
-
-try:
-    # create file handle and upload the file to Objects endpoint.
-    print(f"Uploading file {configuration['filename']}, as object "
-          + "{configuration['key']} in bucket {configuration['bucket']} ...")
-    s3c.put_object(Bucket=configuration["bucket"],
-                   Key=configuration["key"],
-                   Body=configuration["filename"])
-
-    # verify if file is uploaded
-    print(f"Checking if {configuration['key']} exists ...")
-    response = s3c.head_object(Bucket=configuration["bucket"],
-                               Key=configuration["key"])
-    print(f"Head Object Response : {response}")
-except s3c.exceptions.NoSuchBucket:
-    print(f"The {configuration['bucket']} bucket does not exist.  "
-          + "Aborting ...")
-except Exception as err:
-    print("An unexpected exception occurred while attempting "
-          + "file upload.  Details:")
-    print(f"{err}")
+        print("An unexpected exception occurred while attempting "
+              + "file upload.  Details:")
+        print(f"{err}")
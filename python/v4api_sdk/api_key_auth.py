@@ -169,10 +169,18 @@ def main():
                 vmm_client.add_default_header(
                     header_name="X-Ntnx-Api-Key", header_value=api_key_value
                 )
-                vm_list = vmm_instance.list_vms(async_req=False)
-                if vm_list:
+                # one request for a single extId is enough to prove the key
+                # works; the response metadata still reports the VM count
+                try:
+                    vm_list = vmm_instance.list_vms(
+                        async_req=False, _limit=1, _select="extId"
+                    )
+                except VMMException as vmm_exception:
+                    vm_list = None
+                    print(f"Exception details: {vmm_exception}")
+                if vm_list is not None:
                     print(
-                        f"{len(vm_list.data)} VMs found.  API key authentication successful."
+                        f"{vm_list.metadata.total_available_results} VMs found.  API key authentication successful."
                     )
                 else:
                     print("VM list operation failed.  Check vmm.log for details.")
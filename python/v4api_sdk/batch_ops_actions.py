@@ -7,51 +7,22 @@ Date: February 2026
 
 import getpass
 import argparse
+import os
 import sys
+import time
 import urllib3
 from pprint import pprint
 from rich import print
 
 import ntnx_prism_py_client
-from ntnx_prism_py_client import Configuration as PrismConfiguration
-from ntnx_prism_py_client import ApiClient as PrismClient
 from ntnx_prism_py_client.rest import ApiException as PrismException
 
-import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VmmConfiguration
-from ntnx_vmm_py_client import ApiClient as VmmClient
 from ntnx_vmm_py_client.rest import ApiException as VMMException
 
-from ntnx_vmm_py_client.models.vmm.v4.ahv.config.AssociateVmCategoriesParams import (
-    AssociateVmCategoriesParams,
-)
-from ntnx_vmm_py_client.models.vmm.v4.ahv.config.CategoryReference import (
-    CategoryReference,
-)
-
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpec import BatchSpec
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecMetadata import (
-    BatchSpecMetadata,
-)
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayload import (
-    BatchSpecPayload,
-)
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayloadMetadata import (
-    BatchSpecPayloadMetadata,
-)
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayloadMetadataHeader import (
-    BatchSpecPayloadMetadataHeader,
-)
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayloadMetadataPath import (
-    BatchSpecPayloadMetadataPath,
-)
-
-from ntnx_prism_py_client.models.prism.v4.operations.ActionType import ActionType
-
-
 # small library that manages commonly-used tasks across these code samples
-from tme.utils import Utils
+from tme.utils import Utils, paginate
 from tme.apiclient import ApiClient
+from tme.categories import CategoryAssociator, read_ext_ids
 
 
 def main():
@@ -68,46 +39,34 @@ def main():
 
     try:
 
-        # create the configuration instance
-        # this per-namespace class manages all Prism Central connection settings
-        vmm_config = VmmConfiguration()
-        prism_config = PrismConfiguration()
-
-        for config in [vmm_config, prism_config]:
-            config.host = script_config.pc_ip
-            config.port = "9440"
-            config.username = script_config.pc_username
-            config.password = script_config.pc_password
-            config.verify_ssl = False
-
-        # create the instance of the ApiClient class
-        vmm_client  = VmmClient(configuration=vmm_config)
-        prism_client = PrismClient(configuration=prism_config)
+        # get the shared API client for each namespace
+        # tme.apiclient.ApiClient configures each client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        prism_client = ApiClient.get(script_config, "ntnx_prism_py_client").api_client
 
         # create the API class instances
-        vmm_instance = ntnx_vmm_py_client.api.VmApi(api_client=vmm_client)
         prism_instance = ntnx_prism_py_client.api.CategoriesApi(api_client=prism_client)
-        batch_instance = ntnx_prism_py_client.api.BatchesApi(api_client=prism_client)
 
 
         input(
             "\nThis demo uses the Nutanix v4 API `prism` namespace's \
 batch APIs to assign matching virtual machines to a specific \
-category.\nVM matches are based on a list of VMs built using OData \
-filters to include those with a name containing the string \
-'batchdemo'.\n\nYou will now be prompted for the ext_id of the category \
+category.\nVM matches are based on an OData filter (by default, VMs \
+with a name starting with the string 'batchdemo') or a file of VM \
+ext_ids.  VMs already assigned to the category are skipped.\n\nYou will now be prompted for the ext_id of the category \
 to which these VMs will be assigned.\n\nPress ENTER to continue."
         )
 
-        category_list = prism_instance.list_categories(
-            async_req=False,
+        category_list = paginate(
+            prism_instance.list_categories,
+            select=["extId", "key", "value"],
             _filter="type eq Prism.Config.CategoryType'USER' and not contains(key, 'Calm')",
         )
 
         # do some verification and make sure the user selects
         # the correct entity
         found_categories = []
-        for category in category_list.data:
+        for category in category_list:
             found_categories.append(
                 {
                     "key": category.key,
@@ -134,79 +93,48 @@ to which these VMs will be assigned.\n\nPress ENTER to continue."
         # get the category ext_id
         category_ext_id = matches[0]["ext_id"]
 
-        print("Building filtered list of existing VMs ...")
-        print("Note: By default this will retrieve a maximum of 50 VMs.")
-        vm_list = vmm_instance.list_vms(
-            async_req=False,
-            _filter="startswith(name, 'batchdemo')"
+        # the VMs can come from an OData filter or from a file containing
+        # one VM ext_id per line
+        vm_source = input(
+            "\nEnter an OData filter for the VMs, or the path of a file of VM ext_ids (press ENTER for startswith(name, 'batchdemo')): "
+        ).strip() or "startswith(name, 'batchdemo')"
+
+        # the associator lists matching VMs with only extId and categories
+        # selected, skips VMs that already have the category, then builds
+        # payloads (fetching each VM's Etag) only as each batch is submitted
+        # the payloads are split into several batches, with a limited
+        # number running at once; chunk_size is tuned as each batch
+        # finishes, and failed VMs are retried on their own
+        associator = CategoryAssociator(
+            script_config,
+            [category_ext_id],
+            name="Associate Categories",
+            chunk_size=1,
+            results_path=f"batch_associate_categories_{int(time.time())}.jsonl",
         )
-        if vm_list.data:
-            print(f"{len(vm_list.data)} VM(s) found:")
-            for vm in vm_list.data:
-                print(f"- {vm.name}")
+
+        print("Building filtered list of existing VMs ...")
+        if os.path.isfile(vm_source):
+            vms = associator.vms_by_ext_id(read_ext_ids(vm_source))
         else:
-            print("No matching VMs found.  Exiting ...")
+            vms = associator.vms_matching(vm_source)
+        pending = list(associator.pending(vms))
+        print(
+            f"{len(pending) + associator.skipped} VM(s) found; {associator.skipped} already assigned to this category."
+        )
+        if not pending:
+            print("No VMs need to be assigned to this category.  Exiting ...")
             sys.exit()
 
-        confirm_action = utils.confirm("Submit batch operation?")
+        confirm_action = utils.confirm(f"Submit batch operations for {len(pending)} VM(s)?")
         if confirm_action:
-            # initiate the list of VMs that will be modified
-            # this is a list of BatchSpecPayload
-            batch_spec_payload_list = []
-
-            print("Building VM batch $action payload ...")
-            for vm in vm_list.data:
-                existing_vm = vmm_instance.get_vm_by_id(vm.ext_id)
-                vm_ext_id = existing_vm.data.ext_id
-                etag = vmm_client.get_etag(existing_vm)
-
-                # build the payload that will be used when assigning categories
-                batch_spec_payload_list.append(
-                    BatchSpecPayload(
-                        data=AssociateVmCategoriesParams(
-                            categories=[CategoryReference(ext_id=category_ext_id)]
-                        ),
-                        metadata=BatchSpecPayloadMetadata(
-                            headers=[
-                                BatchSpecPayloadMetadataHeader(
-                                    name="If-Match", value=etag
-                                )
-                            ],
-                            path=[
-                                BatchSpecPayloadMetadataPath(
-                                    name="extId", value=vm_ext_id
-                                )
-                            ],
-                        ),
-                    )
-                )
-
-            batch_spec = BatchSpec(
-                metadata=BatchSpecMetadata(
-                    action=ActionType.ACTION,
-                    name="Associate Categories",
-                    stop_on_error=True,
-                    chunk_size=1,
-                    uri="/api/vmm/v4.2/ahv/config/vms/{extId}/$actions/associate-categories",
-                ),
-                payload=batch_spec_payload_list,
-            )
-
-            print("Submitting batch operation to assign VM categories ...")
-            batch_response = batch_instance.submit_batch(
-                async_req=False, body=batch_spec
-            )
-
-            # grab the ext ID of the batch operation task
-            modify_ext_id = batch_response.data.ext_id
-            utils.monitor_task(
-                task_ext_id=modify_ext_id,
-                task_name="Batch VM Category Assignment",
-                pc_ip=script_config.pc_ip,
-                username=script_config.pc_username,
-                password=script_config.pc_password,
+            print("Submitting batch operations to assign VM categories ...")
+            associator.run(
+                pending,
+                on_batch=lambda result: print(result.summary()),
             )
-            print(f"{len(batch_spec_payload_list)} VMs assigned to category.")
+            print(f"{len(pending) - len(associator.scheduler.failed)} VMs assigned to category.")
+            print(f"The result for each VM has been written to {associator.scheduler.results_path}.")
         else:
             print("Batch operation cancelled.")
 
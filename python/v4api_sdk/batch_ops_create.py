@@ -7,38 +7,26 @@ Date: February 2026
 
 import getpass
 import argparse
+import os
 import sys
 import uuid
 from pprint import pprint
 import urllib3
 from rich import print
 
-import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VmmConfiguration
-from ntnx_vmm_py_client import ApiClient as VmmClient
 from ntnx_vmm_py_client.rest import ApiException as VMMException
 
 import ntnx_prism_py_client
-from ntnx_prism_py_client import Configuration as PrismConfiguration
-from ntnx_prism_py_client import ApiClient as PrismClient
 
 import ntnx_clustermgmt_py_client
-from ntnx_clustermgmt_py_client import Configuration as ClusterConfiguration
-from ntnx_clustermgmt_py_client import ApiClient as ClusterClient
-
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpec import BatchSpec
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecMetadata import (
-    BatchSpecMetadata,
-)
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayload import (
-    BatchSpecPayload,
-)
 
 from ntnx_prism_py_client.models.prism.v4.operations.ActionType import ActionType
 
 # small library that manages commonly-used tasks across these code samples
 from tme.utils import Utils
 from tme.apiclient import ApiClient
+from tme.batches import BatchScheduler
+from tme.payloads import PayloadBuilder, read_parameters
 
 
 def main():
@@ -55,31 +43,15 @@ def main():
 
     try:
         
-        # create the configuration instance
-        # this per-namespace class manages all Prism Central connection settings
-        cluster_config = ClusterConfiguration()
-        prism_config = PrismConfiguration()
-
-        for config in [cluster_config, prism_config]:
-            config.host = script_config.pc_ip
-            config.port = "9440"
-            config.username = script_config.pc_username
-            config.password = script_config.pc_password
-            config.verify_ssl = False
-
-        # create the instance of the ApiClient class
-        cluster_client  = ClusterClient(configuration=cluster_config)
-        prism_client = PrismClient(configuration=prism_config)
-
-        for client in [cluster_client, prism_client]:
-            client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+        # get the shared API client for each namespace
+        # tme.apiclient.ApiClient configures each client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        cluster_client = ApiClient.get(script_config, "ntnx_clustermgmt_py_client").api_client
+        prism_client = ApiClient.get(script_config, "ntnx_prism_py_client").api_client
 
         # create the API class instances
         cluster_instance = ntnx_clustermgmt_py_client.api.ClustersApi(api_client=cluster_client)
         prism_instance = ntnx_prism_py_client.api.CategoriesApi(api_client=prism_client)
-        batch_instance = ntnx_prism_py_client.api.BatchesApi(api_client=prism_client)
 
         # before submitting the batch we need to find out which cluster
         # the VMs will live on
@@ -123,60 +95,66 @@ def main():
         # generate unique ID to ensure image names are always different
         unique_id = uuid.uuid1()
 
-        batch_count = input(
-            "\nEnter the number of virtual machines you would like to create: "
-        ).lower()
+        # the VMs can either be numbered demo VMs or come from a CSV or
+        # JSON lines file with one VM per row; rows can set name,
+        # description and memory_size_mib
+        vm_source = input(
+            "\nEnter the number of virtual machines you would like to create, or the path of a CSV/JSON lines file with one VM per row: "
+        ).strip()
+        if os.path.isfile(vm_source):
+            vm_parameters = read_parameters(vm_source)
+            batch_count = f"the VMs in {vm_source}"
+        else:
+            vm_parameters = ({} for _ in range(int(vm_source)))
+            batch_count = vm_source
 
         confirm_create = utils.confirm("Submit batch operation?")
         if confirm_create:
-            # initialize the list of VMs that will be created
-            # this is a list of BatchSpecPayload
-            batch_spec_payload_list = []
+            # the VM payloads are built from this template one at a time,
+            # as each batch is submitted, instead of creating every Vm model
+            # up front
+            # the template uses the same JSON format as the v4 API
             prefix = "batchdemo"
-            for i in range(int(batch_count)):
-                vm_name = f"{prefix}{i}_{unique_id}"
-                description = f"{prefix}"
-                memory_size_mib = 1024
-                vm_payload = ntnx_vmm_py_client.models.vmm.v4.ahv.config.Vm.Vm(
-                    name=vm_name,
-                    description=f"{description}_{unique_id}",
-                    memory_size_bytes=memory_size_mib * 1024 * 1024,
-                    cluster=ntnx_vmm_py_client.models.vmm.v4.ahv.config.ClusterReference.ClusterReference(
-                        ext_id=cluster_ext_id
-                    ),
-                )
-                batch_spec_payload_list.append(
-                    BatchSpecPayload(
-                        data=vm_payload,
-                    )
-                )
-
-            batch_spec = BatchSpec(
-                metadata=BatchSpecMetadata(
-                    action=ActionType.CREATE,
-                    name=f"multi_{unique_id}",
-                    uri="/api/vmm/v4.2/ahv/config/vms",
-                    stop_on_error=True,
-                    chunk_size=20,
-                ),
-                payload=batch_spec_payload_list,
+            builder = PayloadBuilder(
+                {
+                    "name": "{name}",
+                    "description": "{description}",
+                    "memorySizeBytes": "{memory_size_bytes}",
+                    "cluster": {"extId": "{cluster_ext_id}"},
+                },
+                prepare=lambda row: {
+                    "name": f"{prefix}{row['index']}_{unique_id}",
+                    "description": f"{prefix}_{unique_id}",
+                    **row,
+                    "memory_size_bytes": int(row.get("memory_size_mib") or 1024) * 1024 * 1024,
+                },
+            )
+            batch_spec_payloads = builder.payloads(
+                vm_parameters, cluster_ext_id=cluster_ext_id
             )
 
-            print(f"Submitting batch operation to create {batch_count} VMs ...")
-            batch_response = batch_instance.submit_batch(
-                async_req=False, body=batch_spec
+            # the payloads are split into several batches, with a limited
+            # number running at once; chunk_size starts at 20 and is tuned
+            # as each batch finishes, and failed VMs are retried on their own
+            scheduler = BatchScheduler(
+                script_config,
+                action=ActionType.CREATE,
+                uri="/api/vmm/v4.2/ahv/config/vms",
+                name=f"multi_{unique_id}",
+                chunk_size=20,
+                results_path=f"batch_create_{unique_id}.jsonl",
             )
 
-            # grab the ext ID of the batch operation task
-            batch_ext_id = batch_response.data.ext_id
-            utils.monitor_task(
-                task_ext_id=batch_ext_id,
-                task_name="Batch VM creation",
-                pc_ip=script_config.pc_ip,
-                username=script_config.pc_username,
-                password=script_config.pc_password,
+            print(f"Submitting batch operations to create {batch_count} VMs ...")
+            scheduler.run(
+                batch_spec_payloads,
+                on_batch=lambda result: print(result.summary()),
             )
-            print("Batch operation completed.")
+            if scheduler.failed:
+                print(f"Batch operation completed; {len(scheduler.failed)} VMs could not be created.")
+            else:
+                print("Batch operation completed.")
+            print(f"The result for each VM has been written to {scheduler.results_path}.")
         else:
             print("Batch operation cancelled.")
 
@@ -13,18 +13,9 @@ import urllib3
 from rich import print
 
 import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VmmConfiguration
-from ntnx_vmm_py_client import ApiClient as VmmClient
 from ntnx_vmm_py_client.rest import ApiException as VMMException
 
-import ntnx_prism_py_client
-from ntnx_prism_py_client import Configuration as PrismConfiguration
-from ntnx_prism_py_client import ApiClient as PrismClient
 
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpec import BatchSpec
-from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecMetadata import (
-    BatchSpecMetadata,
-)
 from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayload import (
     BatchSpecPayload,
 )
@@ -42,8 +33,10 @@ from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecPayloadMetadataPat
 from ntnx_prism_py_client.models.prism.v4.operations.ActionType import ActionType
 
 # small library that manages commonly-used tasks across these code samples
-from tme.utils import Utils
+from tme.utils import Utils, paginate
 from tme.apiclient import ApiClient
+from tme.batches import BatchScheduler
+from tme.cache import EntityCache
 
 
 def main():
@@ -60,44 +53,31 @@ def main():
 
     try:
     
-        # create the configuration instance
-        # this per-namespace class manages all Prism Central connection settings
-        vmm_config = VmmConfiguration()
-        prism_config = PrismConfiguration()
-
-        for config in [vmm_config, prism_config]:
-            config.host = script_config.pc_ip
-            config.port = "9440"
-            config.username = script_config.pc_username
-            config.password = script_config.pc_password
-            config.verify_ssl = False
-
-        # create the instance of the ApiClient class
-        vmm_client  = VmmClient(configuration=vmm_config)
-        prism_client = PrismClient(configuration=prism_config)
-
-        for client in [vmm_client, prism_client]:
-            client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+        # get the shared API client for each namespace
+        # tme.apiclient.ApiClient configures each client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        vmm_client = ApiClient.get(script_config, "ntnx_vmm_py_client").api_client
 
         # create the API class instances
         vmm_instance = ntnx_vmm_py_client.api.VmApi(api_client=vmm_client)
-        prism_instance = ntnx_prism_py_client.api.BatchesApi(api_client=prism_client)
 
         # get an existing VM
         # for demo purposes we're filering specific VMs; for your environment
         # you will need to change this filter to suit your needs or specify
         # an exact VM ext_id
         print("Building filtered list of existing VMs ...")
-        print("Note: By default this will retrieve a maximum of 50 VMs.")
-        vm_list = vmm_instance.list_vms(
-            async_req=False,
-             _filter="startswith(name, 'batchdemo')"
+        # every page of matching VMs is retrieved, requesting only the
+        # fields needed to list and identify each VM
+        vm_list = list(
+            paginate(
+                vmm_instance.list_vms,
+                select=["extId", "name"],
+                _filter="startswith(name, 'batchdemo')",
+            )
         )
-        if vm_list.data:
-            print(f"{len(vm_list.data)} VM(s) found:")
-            for vm in vm_list.data:
+        if vm_list:
+            print(f"{len(vm_list)} VM(s) found:")
+            for vm in vm_list:
                 print(f"- {vm.name}")
         else:
             print("No matching VMs found.  Exiting ...")
@@ -108,59 +88,76 @@ def main():
 
         confirm_create = utils.confirm("Submit batch operation?")
         if confirm_create:
-            # initiate the list of VMs that will be created
-            # this is a list of BatchSpecPayload
-            batch_spec_payload_list = []
+            # VM details and Etags come from the local entity cache, so VMs
+            # read within the cache TTL don't need another GET request each
+            # VMs that aren't cached (or are older than the TTL) are fetched
+            # concurrently through the shared connection pool
+            # the full VM is needed for the update, so these requests can't
+            # use $select; the VM list above only selects extId and name
+            cache = EntityCache(script_config)
+
+            print("Fetching VM details and Etags ...")
+            existing_vms = cache.prefetch(
+                "vmm", [vm.ext_id for vm in vm_list], vmm_instance.get_vm_by_id, workers=16
+            )
 
-            print("Building VM batch modify payload ...")
-            for vm in vm_list.data:
-                existing_vm = vmm_instance.get_vm_by_id(vm.ext_id)
+            def build_payload(existing_vm):
                 existing_vm.data.name = f"MODIFIED_{existing_vm.data.name}"
                 etag = vmm_client.get_etag(existing_vm)
-                batch_spec_payload_list.append(
-                    BatchSpecPayload(
-                        data=existing_vm.data,
-                        metadata=BatchSpecPayloadMetadata(
-                            headers=[
-                                BatchSpecPayloadMetadataHeader(
-                                    name="If-Match", value=etag
-                                )
-                            ],
-                            path=[
-                                BatchSpecPayloadMetadataPath(
-                                    name="extId", value=existing_vm.data.ext_id
-                                )
-                            ],
-                        ),
-                    )
+                return BatchSpecPayload(
+                    data=existing_vm.data,
+                    metadata=BatchSpecPayloadMetadata(
+                        headers=[
+                            BatchSpecPayloadMetadataHeader(
+                                name="If-Match", value=etag
+                            )
+                        ],
+                        path=[
+                            BatchSpecPayloadMetadataPath(
+                                name="extId", value=existing_vm.data.ext_id
+                            )
+                        ],
+                    ),
                 )
 
-            batch_spec = BatchSpec(
-                metadata=BatchSpecMetadata(
-                    action=ActionType.MODIFY,
-                    name=f"update_{unique_id}",
-                    uri="/api/vmm/v4.2/ahv/config/vms/{extId}",
-                    stop_on_error=True,
-                    chunk_size=1,
-                ),
-                payload=batch_spec_payload_list,
-            )
+            def refresh_payload(item_result):
+                # a 412 response means the VM changed after its Etag was
+                # read, so get the current VM and Etag before retrying
+                if not item_result.stale_etag:
+                    return item_result.payload
+                cache.invalidate("vmm", [item_result.ext_id])
+                return build_payload(
+                    cache.get("vmm", item_result.ext_id, vmm_instance.get_vm_by_id)
+                )
 
-            print("Submitting batch operation to update existing VMs ...")
-            batch_response = prism_instance.submit_batch(
-                async_req=False, body=batch_spec
+            print("Building VM batch modify payload ...")
+            batch_spec_payloads = (build_payload(existing_vms[vm.ext_id]) for vm in vm_list)
+
+            # the payloads are split into several batches, with a limited
+            # number running at once; chunk_size is tuned as each batch
+            # finishes, and failed VMs are retried on their own
+            scheduler = BatchScheduler(
+                script_config,
+                action=ActionType.MODIFY,
+                uri="/api/vmm/v4.2/ahv/config/vms/{extId}",
+                name=f"update_{unique_id}",
+                chunk_size=1,
+                results_path=f"batch_modify_{unique_id}.jsonl",
+                refresh=refresh_payload,
             )
 
-            # grab the ext ID of the batch operation task
-            modify_ext_id = batch_response.data.ext_id
-            utils.monitor_task(
-                task_ext_id=modify_ext_id,
-                task_name="Batch VM Update",
-                pc_ip=script_config.pc_ip,
-                username=script_config.pc_username,
-                password=script_config.pc_password,
+            print("Submitting batch operations to update existing VMs ...")
+            scheduler.run(
+                batch_spec_payloads,
+                on_batch=lambda result: print(result.summary()),
             )
-            print(f"{len(batch_spec_payload_list)} VMs updated.")
+
+            # the batch changes every VM's name and Etag, so drop the cached
+            # copies
+            cache.invalidate("vmm", [vm.ext_id for vm in vm_list])
+
+            print(f"{len(vm_list) - len(scheduler.failed)} VMs updated.")
+            print(f"The result for each VM has been written to {scheduler.results_path}.")
         else:
             print("Batch operation cancelled.")
 
@@ -9,55 +9,39 @@ import getpass
 import argparse
 import sys
 import uuid
+from functools import partial
 from base64 import b64encode
 import pprint
 import urllib3
 from rich import print
 
 import ntnx_clustermgmt_py_client
-from ntnx_clustermgmt_py_client import Configuration as ClusterConfiguration
-from ntnx_clustermgmt_py_client import ApiClient as ClusterClient
 from ntnx_clustermgmt_py_client.rest import ApiException as ClusterException
 
 import ntnx_networking_py_client
-from ntnx_networking_py_client import Configuration as NetworkingConfiguration
-from ntnx_networking_py_client import ApiClient as NetworkingClient
 from ntnx_networking_py_client.rest import ApiException as NetworkingException
 
 import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VMMConfiguration
-from ntnx_vmm_py_client import ApiClient as VMMClient
 import ntnx_vmm_py_client.models.vmm.v4.ahv.config as AhvVmConfig
 
 import ntnx_prism_py_client
-from ntnx_prism_py_client import Configuration as PrismConfiguration
-from ntnx_prism_py_client import ApiClient as PrismClient
 
 # small library that manages commonly-used tasks across these code samples
 from tme.utils import Utils
 from tme.apiclient import ApiClient
+from tme.aio import AsyncRunner
 
-def confirm_entity(api, client, entity_name: str, exclusions: list) -> str:
+def confirm_entity(entities, entity_name: str, exclusions: list) -> str:
     """
     make sure the user is selecting the correct entity
     e.g. the cluster that will own the VM, the image to
     clone the VM's base disk from
     this is moved into a function as the same steps are completed
     multiple times for different entity types
+    the entity lists are retrieved up front, all at the same time, so
+    this function only asks the user to choose
     """
-    instance = api(api_client=client)
-    print(f"Retrieving {entity_name} list ...")
-    offset = 0
-    if entity_name == "cluster":
-        entities = instance.list_clusters(async_req=False)
-        offset = 1
-    elif entity_name == "image":
-        entities = instance.list_images(async_req=False)
-    elif entity_name == "subnet":
-        entities = instance.list_subnets(async_req=False)
-    else:
-        print(f"{entity_name} is not supported.  Exiting.")
-        sys.exit()
+    offset = 1 if entity_name == "cluster" else 0
 
     # do some verification and make sure the user selects
     # the correct entity
@@ -106,58 +90,19 @@ def main():
     utils = Utils()
     script_config = utils.get_environment()
 
-    vmm_config = VMMConfiguration()
-    prism_config = PrismConfiguration()
-    cluster_config = ClusterConfiguration()
-    networking_config = NetworkingConfiguration()
-
-    for config in [
-        vmm_config,
-        prism_config,
-        cluster_config,
-        networking_config,
-    ]:
-        config.host = script_config.pc_ip
-        config.username = script_config.pc_username
-        config.password = script_config.pc_password
-        config.verify_ssl = False
-
-    vmm_client = VMMClient(configuration=vmm_config)
-    prism_client = PrismClient(configuration=prism_config)
-    cluster_client = ClusterClient(configuration=cluster_config)
-    networking_client = NetworkingClient(configuration=networking_config)
-
-    for client in [
-        vmm_client,
-        prism_client,
-        cluster_client,
-        networking_client,
-    ]:
-        client.add_default_header(
-            header_name="Accept-Encoding", header_value="gzip, deflate, br"
-        )
-
-    """
-    ask the user to confirm the cluster that will own the VM,
-    the subnet the VM will connect to and the disk image the VM's
-    boot disk will be cloned from
-    """
-    cluster_ext_id = confirm_entity(
-        ntnx_clustermgmt_py_client.api.ClustersApi,
-        cluster_client,
-        "cluster",
-        ["Unnamed"],
-    )
-    subnet_ext_id = confirm_entity(
-        ntnx_networking_py_client.api.SubnetsApi, networking_client, "subnet", []
-    )
-    image_ext_id = confirm_entity(
-        ntnx_vmm_py_client.api.ImagesApi, vmm_client, "image", []
-    )
-
-    # get the ext_id of the required storage container
+    # get the shared API client for each namespace
+    # tme.apiclient.ApiClient configures each client once, including
+    # connection pool size and gzip, then re-uses it for the whole run
+    vmm_client = ApiClient.get(script_config, "ntnx_vmm_py_client").api_client
+    prism_client = ApiClient.get(script_config, "ntnx_prism_py_client").api_client
+    cluster_client = ApiClient.get(script_config, "ntnx_clustermgmt_py_client").api_client
+    networking_client = ApiClient.get(script_config, "ntnx_networking_py_client").api_client
+
+    # retrieve the cluster, subnet, image and storage container lists
+    # these requests don't depend on each other, so they are sent at the
+    # same time and the wait is only as long as the slowest request
     # only request containers with name containing "default-container"
-    print("Retrieving storage container list ...")
+    print("Retrieving cluster, subnet, image and storage container lists ...")
     print(
         'Note: Containers are filtered to match only those containing \
 the text "default".'
@@ -165,10 +110,36 @@ the text "default".'
     storage_instance = ntnx_clustermgmt_py_client.api.StorageContainersApi(
         api_client=cluster_client
     )
-    container_list = storage_instance.list_storage_containers(
-        async_req=False, _filter="contains(name, 'default')"
-    )
+    with AsyncRunner(timeout=60) as runner:
+        inventory = runner.run(
+            {
+                "cluster": ntnx_clustermgmt_py_client.api.ClustersApi(
+                    api_client=cluster_client
+                ).list_clusters,
+                "subnet": ntnx_networking_py_client.api.SubnetsApi(
+                    api_client=networking_client
+                ).list_subnets,
+                "image": ntnx_vmm_py_client.api.ImagesApi(
+                    api_client=vmm_client
+                ).list_images,
+                "container": partial(
+                    storage_instance.list_storage_containers,
+                    _filter="contains(name, 'default')",
+                ),
+            }
+        )
 
+    """
+    ask the user to confirm the cluster that will own the VM,
+    the subnet the VM will connect to and the disk image the VM's
+    boot disk will be cloned from
+    """
+    cluster_ext_id = confirm_entity(inventory["cluster"], "cluster", ["Unnamed"])
+    subnet_ext_id = confirm_entity(inventory["subnet"], "subnet", [])
+    image_ext_id = confirm_entity(inventory["image"], "image", [])
+
+    # get the ext_id of the required storage container
+    container_list = inventory["container"]
     container_ext_id = container_list.data[0].container_ext_id
     container_name = container_list.data[0].name
     print(
@@ -320,12 +291,10 @@ ext_id {new_vm_ext_id}.\n"
         existing_vm_etag = vmm_client.get_etag(existing_vm)
         existing_vm_ip = existing_vm.data.nics[0].network_info.ipv4_config.ip_address.value
         existing_vm_name = existing_vm.data.name
-        # add the new VM's Etag as the value of If-Match header on the API client
-        vmm_client.add_default_header(header_name="If-Match", header_value=existing_vm_etag)
-        # recreate the VmApi instance now that we've added the Etag header to the API client instance
-        vmm_instance = ntnx_vmm_py_client.api.VmApi(api_client=vmm_client)
         # power on the VM
-        power_on = vmm_instance.power_on_vm(new_vm_ext_id)
+        # the new VM's Etag is sent as the If-Match header for this request only,
+        # leaving the shared API client unchanged
+        power_on = vmm_instance.power_on_vm(new_vm_ext_id, if_match=existing_vm_etag)
         # get the power on task's details
 
         task_extid = power_on.data.ext_id
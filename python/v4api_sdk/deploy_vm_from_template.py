@@ -8,6 +8,7 @@ Date: February 2026
 import datetime
 import uuid
 import sys
+from functools import partial
 from pprint import pprint
 import urllib3
 from base64 import b64encode
@@ -16,18 +17,12 @@ from rich import print
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 import ntnx_clustermgmt_py_client
-from ntnx_clustermgmt_py_client import Configuration as ClusterConfiguration
-from ntnx_clustermgmt_py_client import ApiClient as ClusterClient
 from ntnx_clustermgmt_py_client.rest import ApiException as ClusterException
 
 import ntnx_networking_py_client
-from ntnx_networking_py_client import Configuration as NetworkingConfiguration
-from ntnx_networking_py_client import ApiClient as NetworkingClient
 from ntnx_networking_py_client.rest import ApiException as NetworkingException
 
 import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VMMConfiguration
-from ntnx_vmm_py_client import ApiClient as VMMClient
 from ntnx_vmm_py_client.rest import ApiException as VMMException
 
 from ntnx_vmm_py_client import TemplatesApi, TemplateDeployment, VmConfigOverride, GuestCustomizationParams, CloudInit, Userdata, CloudInitDataSourceType
@@ -39,6 +34,7 @@ from ntnx_vmm_py_client.models.vmm.v4.ahv.config.SubnetReference import SubnetRe
 # small library that manages commonly-used tasks across these code samples
 from tme.utils import Utils
 from tme.apiclient import ApiClient
+from tme.aio import AsyncRunner
 
 
 def main():
@@ -56,45 +52,42 @@ def main():
 
         print("Collecting environment details ...")
 
-        vmm_config = VMMConfiguration()
-        cluster_config = ClusterConfiguration()
-        networking_config = NetworkingConfiguration()
-
-        for config in [
-            vmm_config,
-            cluster_config,
-            networking_config,
-        ]:
-            config.host = script_config.pc_ip
-            config.username = script_config.pc_username
-            config.password = script_config.pc_password
-            config.verify_ssl = False
-
-        vmm_client = VMMClient(configuration=vmm_config)
-        cluster_client = ClusterClient(configuration=cluster_config)
-        networking_client = NetworkingClient(configuration=networking_config)
-
-        for client in [
-            vmm_client,
-            cluster_client,
-            networking_client,
-        ]:
-            client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+        # get the shared API client for each namespace
+        # tme.apiclient.ApiClient configures each client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        vmm_client = ApiClient.get(script_config, "ntnx_vmm_py_client").api_client
+        cluster_client = ApiClient.get(script_config, "ntnx_clustermgmt_py_client").api_client
+        networking_client = ApiClient.get(script_config, "ntnx_networking_py_client").api_client
 
         networking_instance = ntnx_networking_py_client.api.SubnetsApi(api_client=networking_client)
         cluster_instance = ntnx_clustermgmt_py_client.api.ClustersApi(api_client=cluster_client)
         vmm_instance = ntnx_vmm_py_client.api.TemplatesApi(api_client=vmm_client)
 
-        # get a list of registered Prism Element (AOS) clusters
-        clusters_list = cluster_instance.list_clusters(
-            async_req=False,
-            _filter="config/clusterFunction/any(a:a eq Clustermgmt.Config.ClusterFunctionRef'AOS')"
-        )
-
-        # get a filtered list of existing subnets
-        subnets_list = networking_instance.list_subnets(async_req=False, _limit=1, _filter="name eq 'UVM'")
+        # get a list of registered Prism Element (AOS) clusters, a filtered
+        # list of existing subnets and the template to deploy
+        # change the template name as necessary for your environment
+        # these requests don't depend on each other, so they are sent at
+        # the same time instead of one after another
+        with AsyncRunner(timeout=60) as runner:
+            inventory = runner.run(
+                {
+                    "clusters": partial(
+                        cluster_instance.list_clusters,
+                        _filter="config/clusterFunction/any(a:a eq Clustermgmt.Config.ClusterFunctionRef'AOS')",
+                    ),
+                    "subnets": partial(
+                        networking_instance.list_subnets, _limit=1, _filter="name eq 'UVM'"
+                    ),
+                    "templates": partial(
+                        vmm_instance.list_templates,
+                        _limit=1,
+                        _filter="templateName eq 'cr-template'",
+                    ),
+                }
+            )
+        clusters_list = inventory["clusters"]
+        subnets_list = inventory["subnets"]
+        templates_list = inventory["templates"]
 
         print("This script is for demo purposes only and has found the following environment details.")
         print(f"    First cluster name: {clusters_list.data[0].name}")
@@ -107,11 +100,6 @@ def main():
             print("Exiting ...")
             sys.exit()
 
-        # change the template name as necessary for your environment
-        templates_list = vmm_instance.list_templates(
-            async_req=False, _limit=1, _filter="templateName eq 'cr-template'"
-        )
-
         # make sure a matching template was found
         if not templates_list.data:
             print("No matching templates found.  Exiting ...")
@@ -8,16 +8,14 @@ Date: February 2026
 
 import getpass
 import argparse
-import time
 import sys
+import concurrent.futures
 from pprint import pprint
 import urllib3
 from timeit import default_timer as timer
 
 # only the ntnx_lifecycle_py_client namespace is required for this code sample
 import ntnx_lifecycle_py_client
-from ntnx_lifecycle_py_client import ApiClient as LCMClient
-from ntnx_lifecycle_py_client import Configuration as LCMConfiguration
 from ntnx_lifecycle_py_client.rest import ApiException as LCMException
 
 # required for building the list of LCM components that can be updated
@@ -36,21 +34,16 @@ from ntnx_lifecycle_py_client.api import UpgradesApi
 
 # required for getting cluster details
 import ntnx_clustermgmt_py_client
-from ntnx_clustermgmt_py_client import Configuration as ClusterConfiguration
-from ntnx_clustermgmt_py_client import ApiClient as ClusterClient
 from ntnx_clustermgmt_py_client.rest import ApiException as ClusterException
 from ntnx_clustermgmt_py_client.api import ClustersApi
 
-# required for getting task details
-import ntnx_prism_py_client
-from ntnx_prism_py_client import Configuration as PrismConfiguration
-from ntnx_prism_py_client import ApiClient as PrismClient
-from ntnx_prism_py_client.rest import ApiException as PrismException
-from ntnx_prism_py_client.api import TasksApi
-
 # small library that manages commonly-used tasks across these code samples
 from tme.utils import Utils
 from tme.apiclient import ApiClient
+from tme.tasks import TaskNotFoundError, TaskTracker
+
+# LCM upgrades can take much longer than TaskTracker.wait()'s default timeout
+UPGRADE_TIMEOUT = 24 * 60 * 60
 
 
 def main():
@@ -66,29 +59,18 @@ def main():
 
     try:
 
-        # build the configurations
-        lcm_config = LCMConfiguration()
-        cluster_config = ClusterConfiguration()
-        prism_config = PrismConfiguration()
-
-        for configuration in [lcm_config, cluster_config, prism_config]:
-            configuration.host = config.pc_ip
-            configuration.username = config.pc_username
-            configuration.password = config.pc_password
-            configuration.verify_ssl = False
-
         # create utils instance for re-use later
         utils = Utils(pc_ip=config.pc_ip, username=config.pc_username, password=config.pc_password)
 
-        # build the API clients
-        lcm_client = LCMClient(configuration=lcm_config)
-        cluster_client = ClusterClient(configuration=cluster_config)
-        prism_client = PrismClient(configuration=prism_config)
+        # get the shared API clients
+        # tme.apiclient.ApiClient configures each client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        lcm_client = ApiClient.get(config, "ntnx_lifecycle_py_client").api_client
+        cluster_client = ApiClient.get(config, "ntnx_clustermgmt_py_client").api_client
 
-        for client in [lcm_client, cluster_client, prism_client]:
-            client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+        # watch LCM tasks with a shared tracker instead of polling each
+        # task on a fixed schedule; checks back off while a task is idle
+        task_tracker = TaskTracker(config)
 
         # list clusters
         cluster_instance = ClustersApi(api_client=cluster_client)
@@ -156,14 +138,9 @@ environment configuration."
         )
 
         recs_task_id = recommendations.data.ext_id
-        prism_instance = TasksApi(api_client=prism_client)
-        print("Getting Recommendations task ...")
-        recs_task = prism_instance.get_task_by_id(recs_task_id)
-        while recs_task.data.status == "RUNNING":
-            print("Checking Recommendation task status every 5 seconds ...")
-            recs_task = prism_instance.get_task_by_id(recs_task_id)
-            time.sleep(5)
-        completion_value = recs_task.data.completion_details[0].value
+        print("Waiting for Recommendations task ...")
+        recs_task = task_tracker.wait([recs_task_id])[0]
+        completion_value = recs_task.completion_details[0].value
 
         # get recommendation details
         lcm_instance = RecommendationsApi(api_client=lcm_client)
@@ -189,13 +166,9 @@ environment configuration."
         notifications = lcm_instance.compute_notifications(async_req=False, X_Cluster_Id=cluster_extid, body=notifications_spec)
 
         notifications_task_id = notifications.data.ext_id
-        print("Getting Notifications task ...")
-        notifications_task = prism_instance.get_task_by_id(notifications_task_id)
-        while notifications_task.data.status == "RUNNING":
-            print("Checking Notification task status every 5 seconds ...")
-            notifications_task = prism_instance.get_task_by_id(notifications_task_id)
-            time.sleep(5)
-        completion_value = notifications_task.data.completion_details[0].value
+        print("Waiting for Notifications task ...")
+        notifications_task = task_tracker.wait([notifications_task_id])[0]
+        completion_value = notifications_task.completion_details[0].value
 
         # get notification details
         notification = lcm_instance.get_notification_by_id(completion_value)
@@ -228,15 +201,13 @@ environment configuration."
         upgrades = lcm_instance.perform_upgrade(async_req=False, X_Cluster_Id=cluster_extid, body=upgrade_spec)
 
         upgrades_task_id = upgrades.data.ext_id
-        print("Getting Upgrades task ...")
-        upgrades_task = prism_instance.get_task_by_id(upgrades_task_id)
-        while upgrades_task.data.status == "RUNNING":
-            print("Checking Upgrades task status every 5 seconds ...")
-            upgrades_task = prism_instance.get_task_by_id(upgrades_task_id)
-            time.sleep(5)
+        print("Waiting for Upgrades task ...")
+        upgrades_task = task_tracker.wait([upgrades_task_id], timeout=UPGRADE_TIMEOUT)[0]
 
-        print("Done!")
+        print(f"Done! Upgrades task status: {upgrades_task.status}")
 
+    except (concurrent.futures.TimeoutError, TaskNotFoundError) as task_exception:
+        print(f"Unable to finish waiting for an LCM task: {task_exception}")
     except (LCMException, ClusterException) as lcm_exception:
         print(
             f"Unable to complete the requested action.  See below for \
@@ -11,12 +11,10 @@ import urllib3
 from rich import print
 
 import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VmmConfiguration
-from ntnx_vmm_py_client import ApiClient as VmmClient
 from ntnx_vmm_py_client.rest import ApiException as VMMException
 
 # small library that manages commonly-used tasks across these code samples
-from tme.utils import Utils
+from tme.utils import Utils, paginate
 from tme.apiclient import ApiClient
 
 
@@ -34,29 +32,25 @@ def main():
 
     try:
 
-        # create the configuration instance
-        # this per-namespace class manages all Prism Central connection settings
-        vmm_config = VmmConfiguration()
-
-        for config in [vmm_config]:
-            config.host = script_config.pc_ip
-            config.port = "9440"
-            config.username = script_config.pc_username
-            config.password = script_config.pc_password
-            config.verify_ssl = False
-
-        # create the instance of the ApiClient class
-        vmm_client  = VmmClient(configuration=vmm_config)
+        # get the shared API client for the vmm namespace
+        # tme.apiclient.ApiClient configures the client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        vmm_client = ApiClient.get(script_config, "ntnx_vmm_py_client").api_client
 
         # create the API class instances
         vmm_instance = ntnx_vmm_py_client.api.ImagesApi(api_client=vmm_client)
 
         # without filters
+        # paginate() follows every page of results, so images beyond the
+        # first page aren't missed; only the extId field is requested
+        # since the images are only being counted
         print("Building image list without filters ...")
-        images_list_no_filters = vmm_instance.list_images(async_req=False)
-        if images_list_no_filters.metadata.total_available_results > 0:
+        images_list_no_filters = list(
+            paginate(vmm_instance.list_images, select=["extId"])
+        )
+        if images_list_no_filters:
             print(
-                f"Images found without any filters: {len(images_list_no_filters.data)}"
+                f"Images found without any filters: {len(images_list_no_filters)}"
             )
         else:
             print("No images found.")
@@ -86,26 +80,32 @@ def main():
 
         # order by name
         print("\nBuilding image list, all images ordered by name (ascending) ...")
-        images_list_orderby_name = vmm_instance.list_images(
-            async_req=False,
-            _orderby="name asc"
+        images_list_orderby_name = list(
+            paginate(
+                vmm_instance.list_images,
+                select=["extId", "name"],
+                _orderby="name asc",
+            )
         )
-        if images_list_orderby_name.metadata.total_available_results > 0:
+        if images_list_orderby_name:
             print("\nImages found in PC instance, ordered by name, ascending:")
-            for image in images_list_orderby_name.data:
+            for image in images_list_orderby_name:
                 print(f"Image name: {image.name} ({image.ext_id})")
         else:
             print("No images found while using order by name filter.")
 
         # order by size
         print("\nBuilding image list, all images ordered by size (descending) ...")
-        images_list_orderby_size = vmm_instance.list_images(
-            async_req=False,
-            _orderby="sizeBytes desc"
+        images_list_orderby_size = list(
+            paginate(
+                vmm_instance.list_images,
+                select=["name", "sizeBytes"],
+                _orderby="sizeBytes desc",
+            )
         )
-        if images_list_orderby_size.metadata.total_available_results > 0:
+        if images_list_orderby_size:
             print("\nImages found in PC instance, ordered by size, descending:")
-            for image in images_list_orderby_size.data:
+            for image in images_list_orderby_size:
                 print(f"Image name: {image.name}, size (bytes): {image.size_bytes}")
         else:
             print("No images found while using order by size filter.")
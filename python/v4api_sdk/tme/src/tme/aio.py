@@ -0,0 +1,119 @@
+"""
+Simple module to allow function re-use across Nutanix
+v4 SDK code samples
+
+Requires Prism Central 7.5 or later, AOS 7.5 or later
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# maximum number of SDK calls running at the same time
+# keep this at or below the ApiClient connection pool size
+DEFAULT_CONCURRENCY = 8
+
+
+class AsyncRunner:
+    """
+    class to run blocking v4 SDK calls as asyncio awaitables
+
+    each call runs on a worker thread, with at most concurrency calls in
+    flight at once, so independent requests (e.g. listing clusters,
+    subnets and images) overlap instead of running one after another
+
+    example:
+
+        runner = AsyncRunner(concurrency=4, timeout=30)
+        clusters, images = await asyncio.gather(
+            runner.call(cluster_instance.list_clusters),
+            runner.call(image_instance.list_images, _limit=100),
+        )
+
+    the SDK calls themselves are unchanged and still run synchronously;
+    they run on this class' own thread pool rather than the SDK's
+    async_req thread pool so they can be awaited, limited and timed out
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: Optional[float] = None,
+    ):
+        """
+        class constructor
+        timeout is the default number of seconds to wait for each call
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="tme-aio"
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def call(
+        self, func: Callable, *args, timeout: Optional[float] = None, **kwargs
+    ) -> Any:
+        """
+        run func(*args, **kwargs) on a worker thread and return its result
+        raises asyncio.TimeoutError if the call takes longer than timeout
+        seconds (or the runner's default timeout)
+        cancelling the awaiting task stops waiting for the result; a request
+        that has already been sent is allowed to finish in the background
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        timeout = self.timeout if timeout is None else timeout
+
+        async with self._semaphore:
+            future = loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+            return await asyncio.wait_for(future, timeout)
+
+    async def gather(
+        self, calls: Dict[str, Callable], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        run several SDK calls concurrently and return their results in a
+        dictionary with the same keys as calls
+        each value in calls is a callable that takes no arguments, usually a
+        functools.partial, e.g.
+            {"images": functools.partial(image_instance.list_images, _limit=100)}
+        if any call fails, the remaining calls are cancelled and the first
+        exception is raised
+        """
+        tasks = {
+            name: asyncio.ensure_future(self.call(func, timeout=timeout))
+            for name, func in calls.items()
+        }
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
+    def run(self, calls: Dict[str, Callable], timeout: Optional[float] = None):
+        """
+        synchronous version of gather(), for scripts that don't otherwise
+        use asyncio
+        """
+        return asyncio.run(self.gather(calls, timeout=timeout))
+
+    def close(self):
+        """
+        shut down the worker threads
+        """
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
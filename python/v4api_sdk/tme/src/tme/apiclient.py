@@ -5,16 +5,35 @@ v4 SDK code samples
 Requires Prism Central 7.5 or later, AOS 7.5 or later
 """
 
+import threading
+from typing import TYPE_CHECKING
+
 import urllib3
 
-from .utils import Config
+if TYPE_CHECKING:
+    from .utils import Config
+
+# number of connections each SDK client keeps open to Prism Central
+# raise this when making many concurrent requests through one namespace
+DEFAULT_POOL_SIZE = 20
+
 
 class ApiClient:
     """
     class to manage Nutanix v4 API and SDK connections
+
+    instances can be created directly, as before, or retrieved from a
+    process-wide cache with ApiClient.get(), which returns the same
+    configured client for every request to the same Prism Central
+    instance and SDK namespace
     """
 
-    def __init__(self, config: Config, sdk_module: str = ""):
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(
+        self, config: "Config", sdk_module: str = "", pool_size: int = DEFAULT_POOL_SIZE
+    ):
         """
         class constructor
         """
@@ -33,6 +52,40 @@ class ApiClient:
         self.configuration.username = config.pc_username
         self.configuration.password = config.pc_password
         self.configuration.verify_ssl = False
+        self.configuration.connection_pool_maxsize = pool_size
 
         # setup the API client instance
         self.api_client = self.imported_module.ApiClient(configuration=self.configuration)
+        self.api_client.add_default_header(
+            header_name="Accept-Encoding", header_value="gzip, deflate, br"
+        )
+
+    @classmethod
+    def get(
+        cls, config: "Config", sdk_module: str, pool_size: int = DEFAULT_POOL_SIZE
+    ) -> "ApiClient":
+        """
+        return the shared ApiClient for this Prism Central instance and
+        SDK namespace, e.g. ApiClient.get(config, "ntnx_vmm_py_client")
+        the client is created the first time it is requested; later calls
+        re-use it, along with its open connections and any completed
+        version negotiation
+        per-request headers such as If-Match should be passed to the
+        individual API call, e.g. if_match=etag, rather than added to a
+        shared client with add_default_header
+        """
+        key = (config.pc_ip, config.pc_username, sdk_module)
+        with cls._clients_lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = cls(config, sdk_module, pool_size=pool_size)
+                cls._clients[key] = client
+            return client
+
+    @classmethod
+    def clear(cls):
+        """
+        forget every cached client, e.g. after credentials have changed
+        """
+        with cls._clients_lock:
+            cls._clients.clear()
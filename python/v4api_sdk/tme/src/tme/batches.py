@@ -0,0 +1,539 @@
+"""
+Simple module to allow function re-use across Nutanix
+v4 SDK code samples
+
+Requires Prism Central 7.5 or later, AOS 7.5 or later
+"""
+
+import datetime
+import functools
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, Optional
+
+import ntnx_prism_py_client
+from ntnx_prism_py_client.models.prism.v4.operations.BatchSpec import BatchSpec
+from ntnx_prism_py_client.models.prism.v4.operations.BatchSpecMetadata import (
+    BatchSpecMetadata,
+)
+
+from .apiclient import ApiClient
+from .tasks import TaskTracker
+from .utils import paginate
+
+if TYPE_CHECKING:
+    from .utils import Config
+
+# number of payloads submitted in each BatchSpec
+DEFAULT_BATCH_SIZE = 200
+
+# number of batches running on Prism Central at the same time
+DEFAULT_MAX_IN_FLIGHT = 2
+
+# starting chunk_size, i.e. the number of payloads the batch processes
+# together, and the limits it is tuned between
+DEFAULT_CHUNK_SIZE = 20
+MIN_CHUNK_SIZE = 1
+MAX_CHUNK_SIZE = 100
+
+# chunk_size is tuned so each chunk takes roughly this many seconds
+DEFAULT_TARGET_CHUNK_SECONDS = 30
+
+# status recorded for payloads that have no job in their batch, e.g. after
+# the batch stopped on an error
+NOT_RUN = "NOT_RUN"
+
+# job error codes that show the payload's If-Match ETag was out of date
+# (HTTP 412 Precondition Failed); codes are compared exactly, never
+# searched for in the error text
+STALE_ETAG_CODES = frozenset({"412"})
+
+
+@dataclass
+class ItemResult:
+    """
+    dataclass to hold the outcome of one payload in a batch
+    item is the payload's position in the payloads passed to
+    BatchScheduler.run(), so retries of the same payload share it
+    the payload itself is only kept for payloads that didn't succeed
+    """
+
+    item: int
+    status: str
+    ext_id: Optional[str] = None
+    job_ext_id: Optional[str] = None
+    entities: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    error_codes: List[str] = field(default_factory=list)
+    payload: Any = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status == "SUCCEEDED"
+
+    @property
+    def stale_etag(self) -> bool:
+        """
+        True if the payload failed because its If-Match ETag was out of
+        date (HTTP 412), i.e. the entity changed after its ETag was read
+        only the job's error codes are checked, so an error that merely
+        mentions an ETag or contains "412" isn't treated as stale
+        """
+        return any(code in STALE_ETAG_CODES for code in self.error_codes)
+
+
+@dataclass
+class BatchResult:
+    """
+    dataclass to hold the outcome of one submitted batch
+    failed holds the payloads that failed (or were never run), so they can
+    be retried on their own
+    items holds an ItemResult for every payload in the batch
+    """
+
+    name: str
+    task_ext_id: str
+    size: int
+    chunk_size: int
+    duration: float
+    status: str
+    attempt: int = 0
+    failed: List = field(default_factory=list)
+    items: List[ItemResult] = field(default_factory=list)
+
+    def summary(self) -> str:
+        """
+        one-line description of the batch, for progress messages
+        """
+        retry = f" (retry {self.attempt})" if self.attempt else ""
+        return (
+            f"{self.name}{retry}: {self.size} payloads, chunk size "
+            f"{self.chunk_size}, {len(self.failed)} failed, "
+            f"{self.duration:.0f} seconds"
+        )
+
+
+def payload_ext_id(payload) -> Optional[str]:
+    """
+    return the extId path parameter of a batch payload, if it has one
+    e.g. the VM being modified by a MODIFY or ACTION batch
+    payloads can be SDK models or dictionaries, e.g. from a PayloadBuilder
+    """
+    if isinstance(payload, dict):
+        paths = (payload.get("metadata") or {}).get("path") or []
+        return next(
+            (path["value"] for path in paths if path["name"] == "extId"), None
+        )
+    metadata = getattr(payload, "metadata", None)
+    for path in getattr(metadata, "path", None) or []:
+        if path.name == "extId":
+            return path.value
+    return None
+
+
+def to_json(value):
+    """
+    convert an SDK model (or a dictionary or list containing models) to the
+    same JSON-compatible form the SDK sends to the API
+    """
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if hasattr(value, "swagger_types"):
+        return {
+            value.attribute_map[name]: to_json(getattr(value, name))
+            for name in value.swagger_types
+            if getattr(value, name) is not None
+        }
+    return value
+
+
+def write_results(f, batch: BatchResult):
+    """
+    write one compact JSON line per payload in a finished batch
+    failed payloads are included in full, so they can be retried from the
+    file with failed_payloads()
+    """
+    for item in batch.items:
+        line = {
+            "item": item.item,
+            "batch": batch.name,
+            "task": batch.task_ext_id,
+            "attempt": batch.attempt,
+            "status": item.status,
+        }
+        if item.ext_id:
+            line["extId"] = item.ext_id
+        if item.job_ext_id:
+            line["job"] = item.job_ext_id
+        if item.entities:
+            line["entities"] = item.entities
+        if item.errors:
+            line["errors"] = item.errors
+        if not item.succeeded:
+            line["payload"] = to_json(item.payload)
+        f.write(json.dumps(line, separators=(",", ":")) + "\n")
+    f.flush()
+
+
+def failed_payloads(path: str) -> Iterator[dict]:
+    """
+    yield the payload of every item in a results file whose last attempt
+    didn't succeed, e.g. to submit a retry batch with
+        scheduler.run(failed_payloads("results.jsonl"))
+    """
+    last = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                last[result["item"]] = result
+    for item in sorted(last):
+        if last[item]["status"] != "SUCCEEDED":
+            yield last[item]["payload"]
+
+
+class BatchScheduler:
+    """
+    class to submit any number of payloads as a series of v4 batches
+
+    instead of one BatchSpec containing every payload, payloads are split
+    into batches of batch_size and at most max_in_flight batches run at the
+    same time, so a very large operation doesn't depend on one monolithic
+    batch and Prism Central always has the next batch queued
+
+    - chunk_size starts at chunk_size and is tuned after every batch from
+      the observed time per chunk: it grows while chunks finish quicker
+      than target_chunk_seconds and shrinks when they take longer or
+      payloads fail
+    - payloads that fail are resubmitted in a batch of their own, up to
+      retries times; payloads that succeeded are never sent again.  Payloads
+      still failing after the last retry are in the failed attribute once
+      run() returns
+    - payloads can be any iterable, including a generator, and are only
+      read as batches are submitted
+    - every payload's outcome is read from the batch's jobs; with
+      results_path, each outcome is written to results_path + ".partial" as
+      its batch finishes, and the file is renamed to results_path once
+      run() has finished (see failed_payloads() to retry from that file,
+      which can also be the new results_path)
+
+    example:
+
+        scheduler = BatchScheduler(
+            config,
+            action=ActionType.CREATE,
+            uri="/api/vmm/v4.2/ahv/config/vms",
+            name="create_vms",
+        )
+        results = scheduler.run(payloads)
+    """
+
+    def __init__(
+        self,
+        config: "Config",
+        action,
+        uri: str,
+        name: str = "batch",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        min_chunk_size: int = MIN_CHUNK_SIZE,
+        max_chunk_size: int = MAX_CHUNK_SIZE,
+        target_chunk_seconds: float = DEFAULT_TARGET_CHUNK_SECONDS,
+        retries: int = 1,
+        stop_on_error: bool = False,
+        tracker: Optional[TaskTracker] = None,
+        results_path: Optional[str] = None,
+        refresh: Optional[Callable[[ItemResult], Any]] = None,
+    ):
+        """
+        class constructor
+        refresh(item_result) is called for each failed payload before it is
+        retried and returns the payload to resubmit, e.g. with a new If-Match
+        ETag when item_result.stale_etag is True
+        """
+        prism_client = ApiClient.get(config, "ntnx_prism_py_client").api_client
+        self.batches_api = ntnx_prism_py_client.api.BatchesApi(api_client=prism_client)
+        self.tasks_api = ntnx_prism_py_client.api.TasksApi(api_client=prism_client)
+        self.tracker = tracker or TaskTracker(config)
+
+        self.action = action
+        self.uri = uri
+        self.name = name
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.chunk_size = max(min_chunk_size, min(chunk_size, max_chunk_size))
+        self.target_chunk_seconds = target_chunk_seconds
+        self.retries = retries
+        self.stop_on_error = stop_on_error
+        self.results_path = results_path
+        self.refresh = refresh
+
+        self.failed: list = []
+        self._batch_count = 0
+
+    def run(
+        self, payloads: Iterable, on_batch: Optional[Callable] = None
+    ) -> List[BatchResult]:
+        """
+        submit every payload and block until all batches, including
+        retries, have finished
+        on_batch(result) is called as each batch finishes
+        returns a BatchResult for every batch, in the order they finished
+        """
+        # each payload is numbered, so its retries can be matched to it
+        numbered = enumerate(payloads)
+        retry_queue = deque()
+        in_flight = {}
+        results = []
+        self.failed = []
+
+        def next_batch():
+            if retry_queue:
+                return retry_queue.popleft()
+            entries = list(islice(numbered, self.batch_size))
+            return (entries, 0) if entries else None
+
+        # results are written to a separate file and only replace
+        # results_path once every batch has finished, since payloads may be
+        # read lazily from results_path itself, e.g. failed_payloads(); if
+        # run() fails, the results so far are left in the .partial file
+        partial_path = f"{self.results_path}.partial" if self.results_path else None
+        results_file = open(partial_path, "w") if partial_path else None
+        finished = False
+        try:
+            while True:
+                while len(in_flight) < self.max_in_flight:
+                    batch = next_batch()
+                    if batch is None:
+                        break
+                    future, submitted = self._submit(*batch)
+                    in_flight[future] = submitted
+                if not in_flight:
+                    finished = True
+                    return results
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = self._finish(future.result(), *in_flight.pop(future))
+                    results.append(result)
+                    if results_file:
+                        write_results(results_file, result)
+                    if on_batch:
+                        on_batch(result)
+                    if result.failed and result.attempt < self.retries:
+                        retry_queue.append(
+                            (self._retry_entries(result), result.attempt + 1)
+                        )
+                    else:
+                        self.failed.extend(result.failed)
+        finally:
+            if results_file:
+                results_file.close()
+                if finished:
+                    os.replace(partial_path, self.results_path)
+
+    def harvest(
+        self,
+        task_ext_id: str,
+        payloads: list,
+        items: Optional[List[int]] = None,
+    ) -> List[ItemResult]:
+        """
+        return an ItemResult for every payload in a finished batch, in
+        payload order
+        the batch's jobs are read a page (100 jobs) at a time with
+        list_task_jobs; jobs are listed in payload order, and payloads with
+        an extId path parameter are matched to their job's affected entity
+        instead, where the job reports one; a job that can't be matched to a
+        payload of its own adds its error to the payload it collided with,
+        and fails that payload unless the job succeeded
+        items are the numbers to record for each payload, by default their
+        position in payloads
+        """
+        items = list(range(len(payloads))) if items is None else items
+        ext_ids = [payload_ext_id(payload) for payload in payloads]
+        by_ext_id = {ext_id: index for index, ext_id in enumerate(ext_ids) if ext_id}
+        outcomes = {}
+        unmatched = []
+
+        jobs = paginate(functools.partial(self.tasks_api.list_task_jobs, task_ext_id))
+        for position, job in enumerate(jobs):
+            entities = [entity.ext_id for entity in job.entities_affected or []]
+            matched = [by_ext_id[ext_id] for ext_id in entities if ext_id in by_ext_id]
+            claimed = matched[0] if matched else None
+            if claimed is not None and claimed not in outcomes:
+                outcomes[claimed] = self._job_result(job, entities, items, ext_ids, claimed)
+            else:
+                unmatched.append((position, claimed, job, entities))
+
+        # jobs without a matching entity take their own position, or the
+        # first payload still without a result; a job left over after that
+        # is recorded against the payload it claimed (or collided with), so
+        # a failure is never dropped
+        free = (index for index in range(len(payloads)) if index not in outcomes)
+        for position, claimed, job, entities in unmatched:
+            if claimed is None and position < len(payloads) and position not in outcomes:
+                index = position
+            else:
+                index = next(free, None)
+            if index is not None:
+                outcomes[index] = self._job_result(job, entities, items, ext_ids, index)
+                continue
+            collided = claimed if claimed is not None else min(position, len(payloads) - 1)
+            result = outcomes[collided]
+            result.errors.append(
+                f"job {job.ext_id} ({job.status}) could not be matched to a single payload"
+            )
+            if str(job.status) != "SUCCEEDED":
+                result.status = str(job.status)
+
+        results = []
+        for index, payload in enumerate(payloads):
+            result = outcomes.get(index) or ItemResult(
+                item=items[index], status=NOT_RUN, ext_id=ext_ids[index]
+            )
+            if not result.succeeded:
+                result.payload = payload
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _job_result(job, entities: list, items: list, ext_ids: list, index: int) -> ItemResult:
+        """
+        build the ItemResult for the payload at index from its job
+        """
+        return ItemResult(
+            item=items[index],
+            status=str(job.status),
+            ext_id=ext_ids[index],
+            job_ext_id=job.ext_id,
+            entities=entities,
+            errors=[
+                f"{error.code}: {error.message}" if error.code else error.message
+                for error in job.error_messages or []
+            ],
+            error_codes=[
+                str(error.code).strip()
+                for error in job.error_messages or []
+                if error.code is not None
+            ],
+        )
+
+    def _submit(self, entries: list, attempt: int):
+        """
+        submit one batch of (item, payload) entries and start watching its
+        task
+        returns the task's Future and the details needed to finish it
+        """
+        self._batch_count += 1
+        name = f"{self.name}_{self._batch_count}"
+        chunk_size = min(self.chunk_size, len(entries))
+        batch_spec = BatchSpec(
+            metadata=BatchSpecMetadata(
+                action=self.action,
+                name=name,
+                uri=self.uri,
+                should_stop_on_error=self.stop_on_error,
+                chunk_size=chunk_size,
+            ),
+            payload=[payload for _, payload in entries],
+        )
+        response = self.batches_api.submit_batch(async_req=False, body=batch_spec)
+        task_ext_id = response.data.ext_id
+        future = self.tracker.watch(task_ext_id)
+        return future, (name, task_ext_id, entries, attempt, chunk_size, time.monotonic())
+
+    def _finish(
+        self,
+        task,
+        name: str,
+        task_ext_id: str,
+        entries: list,
+        attempt: int,
+        chunk_size: int,
+        submitted: float,
+    ) -> BatchResult:
+        """
+        record a finished batch, collect its per-payload results and
+        re-tune chunk_size
+        """
+        if task.started_time and task.completed_time:
+            duration = (task.completed_time - task.started_time).total_seconds()
+        else:
+            duration = time.monotonic() - submitted
+
+        items = [item for item, _ in entries]
+        payloads = [payload for _, payload in entries]
+        summary = getattr(task, "batch_summary", None)
+        if (
+            not self.results_path
+            and str(task.status) == "SUCCEEDED"
+            and not (summary and summary.number_of_jobs_failed)
+        ):
+            # nothing failed and nothing is being recorded, so the jobs
+            # don't need to be listed
+            item_results = [
+                ItemResult(item=item, status="SUCCEEDED", ext_id=payload_ext_id(payload))
+                for item, payload in entries
+            ]
+        else:
+            item_results = self.harvest(task_ext_id, payloads, items)
+        failed = [result.payload for result in item_results if not result.succeeded]
+
+        self._tune(chunk_size, math.ceil(len(entries) / chunk_size), duration, failed)
+        return BatchResult(
+            name=name,
+            task_ext_id=task_ext_id,
+            size=len(entries),
+            chunk_size=chunk_size,
+            duration=duration,
+            status=str(task.status),
+            attempt=attempt,
+            failed=failed,
+            items=item_results,
+        )
+
+    def _retry_entries(self, result: BatchResult) -> list:
+        """
+        return the (item, payload) entries to resubmit for a batch's failed
+        payloads, refreshed first if a refresh function was given
+        """
+        return [
+            (item.item, self.refresh(item) if self.refresh else item.payload)
+            for item in result.items
+            if not item.succeeded
+        ]
+
+    def _tune(self, chunk_size: int, chunks: int, duration: float, failed: list):
+        """
+        adjust chunk_size for the next batch
+        chunk_size moves towards the size that would make each chunk take
+        target_chunk_seconds, by at most a factor of 2 per batch; failures
+        halve it
+        a batch smaller than one full chunk, e.g. a retry, says little about
+        the best chunk size and is ignored
+        """
+        if not failed and chunks == 1 and chunk_size < self.chunk_size:
+            return
+        if failed:
+            scale = 0.5
+        else:
+            seconds_per_chunk = max(duration / max(chunks, 1), 0.001)
+            scale = min(max(self.target_chunk_seconds / seconds_per_chunk, 0.5), 2)
+        self.chunk_size = max(
+            self.min_chunk_size,
+            min(self.max_chunk_size, round(chunk_size * scale)),
+        )
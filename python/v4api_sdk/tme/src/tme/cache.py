@@ -0,0 +1,336 @@
+"""
+Simple module to allow function re-use across Nutanix
+v4 SDK code samples
+
+Requires Prism Central 7.5 or later, AOS 7.5 or later
+"""
+
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Optional
+
+from ntnx_prism_py_client import ApiClient as PrismClient
+
+if TYPE_CHECKING:
+    from .utils import Config
+
+# default location of the on-disk cache, shared by every code sample
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "tme", "entities.db"
+)
+
+# number of seconds a cached entity or list is used without checking
+# Prism Central for changes
+DEFAULT_TTL = 300
+
+# HTTP status returned for If-None-Match when an entity hasn't changed
+NOT_MODIFIED = 304
+
+# only SDK model classes from these packages are rebuilt from the cache
+SDK_PACKAGE_PREFIX = "ntnx_"
+
+# number of entities prefetch() requests at the same time
+# keep this at or below the ApiClient connection pool size
+DEFAULT_PREFETCH_WORKERS = 8
+
+
+_sdk_clients: Dict[str, object] = {}
+_sdk_clients_lock = threading.Lock()
+
+
+def _sdk_client(package: str):
+    """
+    return an SDK ApiClient used only to serialise and deserialise models
+    from the specified SDK package, e.g. ntnx_vmm_py_client
+    """
+    with _sdk_clients_lock:
+        client = _sdk_clients.get(package)
+        if client is None:
+            client = importlib.import_module(package).ApiClient()
+            _sdk_clients[package] = client
+        return client
+
+
+def _is_model(value) -> bool:
+    """
+    return True if value is a v4 SDK model
+    """
+    return hasattr(type(value), "swagger_types") and type(value).__module__.startswith(
+        SDK_PACKAGE_PREFIX
+    )
+
+
+def encode(value):
+    """
+    return a JSON-serialisable copy of a cached value
+    SDK models are serialised by their SDK, with their class name so they
+    can be rebuilt; lists are encoded item by item
+    """
+    if _is_model(value):
+        model = type(value)
+        client = _sdk_client(model.__module__.split(".")[0])
+        # the SDK's serialiser is only public in some SDK versions
+        sanitize = getattr(client, "sanitize_for_serialization", None) or getattr(
+            client, "_ApiClient__sanitize_for_serialization"
+        )
+        return {"model": f"{model.__module__}:{model.__name__}", "value": sanitize(value)}
+    if isinstance(value, (list, tuple)):
+        return {"list": [encode(item) for item in value]}
+    return {"value": value}
+
+
+def decode(value):
+    """
+    rebuild a value stored by encode()
+    only model classes from the installed v4 SDK packages can be named
+    """
+    if "model" in value:
+        module_name, class_name = value["model"].split(":")
+        if not module_name.startswith(SDK_PACKAGE_PREFIX) or ".models." not in module_name:
+            raise ValueError(f"{value['model']} is not a v4 SDK model")
+        model = getattr(importlib.import_module(module_name), class_name)
+        if not hasattr(model, "swagger_types"):
+            raise ValueError(f"{value['model']} is not a v4 SDK model")
+        return _sdk_client(module_name.split(".")[0]).deserialize(value["value"], model)
+    if "list" in value:
+        return [decode(item) for item in value["list"]]
+    return value["value"]
+
+
+class EntityCache:
+    """
+    class to keep a local SQLite copy of v4 API responses
+
+    entities are stored with their ETag, keyed by Prism Central instance,
+    SDK namespace and ext_id
+
+    - within the TTL, get() returns the stored response without any request
+    - after the TTL, get() revalidates with If-None-Match; an unchanged
+      entity costs a 304 response instead of the full model
+    - etag() returns the If-Match value for an update, so bulk updates
+      don't need a GET per entity while the cache is fresh
+
+    list responses (clusters, subnets, images, etc) can be cached with
+    get_list(); lists don't have an ETag so they are only kept for the TTL
+
+    entities should be invalidated after they are updated, since the update
+    changes their ETag
+
+    responses are stored as JSON, in the v4 API's own format, and rebuilt
+    with the SDK's deserialize(); nothing read from the database is ever
+    executed, so a shared or tampered cache file can only affect the data
+    returned, not the code that runs.  Lists from get_list() may contain
+    SDK models or any JSON-serialisable values
+    """
+
+    def __init__(
+        self,
+        config: "Config",
+        path: str = DEFAULT_CACHE_PATH,
+        ttl: float = DEFAULT_TTL,
+    ):
+        """
+        class constructor
+        """
+        self.pc_ip = config.pc_ip
+        self.ttl = ttl
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entities (
+                    pc_ip TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    ext_id TEXT NOT NULL,
+                    etag TEXT,
+                    response TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (pc_ip, namespace, ext_id)
+                )
+                """
+            )
+
+    def get(
+        self,
+        namespace: str,
+        ext_id: str,
+        fetch: Callable,
+        ttl: Optional[float] = None,
+    ):
+        """
+        return the API response for an entity, e.g.
+            cache.get("vmm", vm_ext_id, vmm_instance.get_vm_by_id)
+        fetch is the SDK "get by id" method for the entity; it is only
+        called when the cached copy is missing or older than the TTL
+        """
+        ttl = self.ttl if ttl is None else ttl
+        cached = self._load(namespace, ext_id)
+        if cached is not None:
+            etag, response, fetched_at = cached
+            if time.time() - fetched_at < ttl:
+                return response
+            if etag:
+                try:
+                    response = fetch(ext_id, if_none_match=etag)
+                except Exception as ex:
+                    # the SDK raises its ApiException for a 304 response
+                    if getattr(ex, "status", None) != NOT_MODIFIED:
+                        raise
+                    self._touch(namespace, ext_id)
+                    return response
+                self.put(namespace, ext_id, response)
+                return response
+
+        response = fetch(ext_id)
+        self.put(namespace, ext_id, response)
+        return response
+
+    def prefetch(
+        self,
+        namespace: str,
+        ext_ids: Iterable[str],
+        fetch: Callable,
+        workers: int = DEFAULT_PREFETCH_WORKERS,
+        ttl: Optional[float] = None,
+    ) -> Dict:
+        """
+        return {ext_id: API response} for several entities, e.g. to collect
+        the ETags for a batch of updates
+        entities missing from the cache, or older than the TTL, are
+        requested (or revalidated) up to workers at a time through the
+        shared connection pool instead of one after another
+        """
+        ext_ids = list(dict.fromkeys(ext_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            responses = executor.map(
+                lambda ext_id: self.get(namespace, ext_id, fetch, ttl=ttl), ext_ids
+            )
+            return dict(zip(ext_ids, responses))
+
+    def etag(
+        self,
+        namespace: str,
+        ext_id: str,
+        fetch: Callable,
+        ttl: Optional[float] = None,
+    ) -> Optional[str]:
+        """
+        return the ETag to send as If-Match when updating an entity
+        """
+        return PrismClient.get_etag(self.get(namespace, ext_id, fetch, ttl=ttl))
+
+    def get_list(
+        self,
+        namespace: str,
+        name: str,
+        fetch: Callable,
+        ttl: Optional[float] = None,
+    ):
+        """
+        return a cached list, e.g.
+            cache.get_list("clustermgmt", "clusters", lambda: list(paginate(cluster_instance.list_clusters)))
+        name identifies the list, so different filters need different names
+        fetch takes no arguments and is only called when the cached list is
+        missing or older than the TTL
+        """
+        ttl = self.ttl if ttl is None else ttl
+        key = f"list:{name}"
+        cached = self._load(namespace, key)
+        if cached is not None and time.time() - cached[2] < ttl:
+            return cached[1]
+        result = fetch()
+        self._store(namespace, key, None, result)
+        return result
+
+    def put(self, namespace: str, ext_id: str, response):
+        """
+        store an API response, e.g. one returned by a get or update request
+        """
+        self._store(namespace, ext_id, PrismClient.get_etag(response), response)
+
+    def invalidate(self, namespace: str, ext_ids: Optional[Iterable[str]] = None):
+        """
+        remove the specified entities from the cache, or every entity in
+        the namespace if ext_ids is None
+        """
+        with self._lock, self._db:
+            if ext_ids is None:
+                self._db.execute(
+                    "DELETE FROM entities WHERE pc_ip = ? AND namespace = ?",
+                    (self.pc_ip, namespace),
+                )
+            else:
+                self._db.executemany(
+                    "DELETE FROM entities WHERE pc_ip = ? AND namespace = ? AND ext_id = ?",
+                    [(self.pc_ip, namespace, ext_id) for ext_id in ext_ids],
+                )
+
+    def close(self):
+        """
+        close the cache database
+        """
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _load(self, namespace: str, ext_id: str):
+        """
+        return (etag, response, fetched_at) for a cached entry, or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, response, fetched_at FROM entities "
+                "WHERE pc_ip = ? AND namespace = ? AND ext_id = ?",
+                (self.pc_ip, namespace, ext_id),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, response, fetched_at = row
+        try:
+            return etag, decode(json.loads(response)), fetched_at
+        except (ValueError, TypeError, KeyError, AttributeError, ImportError):
+            # unreadable entries, e.g. from an older version of this module,
+            # are treated as missing and replaced by the next fetch
+            return None
+
+    def _store(self, namespace: str, ext_id: str, etag: Optional[str], response):
+        """
+        insert or replace a cached entry
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.pc_ip,
+                    namespace,
+                    ext_id,
+                    etag,
+                    json.dumps(encode(response), separators=(",", ":")),
+                    time.time(),
+                ),
+            )
+
+    def _touch(self, namespace: str, ext_id: str):
+        """
+        mark a cached entity as fresh after a successful revalidation
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE entities SET fetched_at = ? "
+                "WHERE pc_ip = ? AND namespace = ? AND ext_id = ?",
+                (time.time(), self.pc_ip, namespace, ext_id),
+            )
@@ -0,0 +1,210 @@
+"""
+Simple module to allow function re-use across Nutanix
+v4 SDK code samples
+
+Requires Prism Central 7.5 or later, AOS 7.5 or later
+"""
+
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import ntnx_vmm_py_client
+from ntnx_prism_py_client.models.prism.v4.operations.ActionType import ActionType
+
+from .apiclient import ApiClient
+from .batches import BatchResult, BatchScheduler, ItemResult
+from .cache import DEFAULT_PREFETCH_WORKERS, EntityCache
+from .payloads import PayloadBuilder
+from .utils import paginate
+
+if TYPE_CHECKING:
+    from .utils import Config
+
+# batch URI for associating categories with one VM
+ASSOCIATE_CATEGORIES_URI = (
+    "/api/vmm/v4.2/ahv/config/vms/{extId}/$actions/associate-categories"
+)
+
+# number of ext_ids looked up in each filtered list request when the VMs
+# come from a list of ext_ids rather than a filter
+EXT_IDS_PER_REQUEST = 50
+
+# number of VM ETags prefetched together while payloads are being built
+DEFAULT_PREFETCH_SIZE = 100
+
+
+def read_ext_ids(path: str) -> Iterator[str]:
+    """
+    yield the ext_ids in a text file, one per line
+    blank lines and lines starting with # are ignored
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+class CategoryAssociator:
+    """
+    class to associate categories with any number of VMs using batches
+
+    - VMs are listed with only their extId and categories selected, either
+      from an OData filter or from a list of ext_ids
+    - VMs that already have every category are skipped, so re-running a
+      tagging campaign only costs the list requests
+    - each remaining VM's ETag is fetched, prefetch_size VMs at a time, only
+      as the BatchScheduler asks for the next payloads, so ETag requests for
+      the next batch overlap with the batches already running
+    - payloads that fail with a stale ETag are rebuilt with the current
+      ETag before they are retried
+
+    example:
+
+        associator = CategoryAssociator(config, [category_ext_id])
+        pending = list(associator.pending(associator.vms_matching("startswith(name, 'web')")))
+        associator.run(pending)
+
+    any other keyword arguments, e.g. batch_size or results_path, are passed
+    to the BatchScheduler
+    """
+
+    def __init__(
+        self,
+        config: "Config",
+        category_ext_ids: Sequence[str],
+        cache: Optional[EntityCache] = None,
+        workers: int = DEFAULT_PREFETCH_WORKERS,
+        prefetch_size: int = DEFAULT_PREFETCH_SIZE,
+        **scheduler_options,
+    ):
+        """
+        class constructor
+        """
+        self.vmm_client = ApiClient.get(config, "ntnx_vmm_py_client").api_client
+        self.vm_api = ntnx_vmm_py_client.api.VmApi(api_client=self.vmm_client)
+        self.category_ext_ids = list(category_ext_ids)
+        self.cache = cache or EntityCache(config)
+        self.workers = workers
+        self.prefetch_size = prefetch_size
+        self.skipped = 0
+
+        self.builder = PayloadBuilder(
+            {"categories": "{categories}"},
+            path={"extId": "{ext_id}"},
+            headers={"If-Match": "{etag}"},
+        )
+        scheduler_options.setdefault("name", "associate_categories")
+        self.scheduler = BatchScheduler(
+            config,
+            action=ActionType.ACTION,
+            uri=ASSOCIATE_CATEGORIES_URI,
+            refresh=self._refresh,
+            **scheduler_options,
+        )
+
+    def vms_matching(self, _filter: Optional[str] = None) -> Iterator:
+        """
+        yield every VM matching an OData filter, e.g.
+        "startswith(name, 'web')", with only extId and categories selected
+        """
+        filters = {"_filter": _filter} if _filter else {}
+        return paginate(
+            self.vm_api.list_vms, select=["extId", "categories"], **filters
+        )
+
+    def vms_by_ext_id(self, ext_ids: Iterable[str]) -> Iterator:
+        """
+        yield the specified VMs, with only extId and categories selected
+        VMs are looked up EXT_IDS_PER_REQUEST at a time; ext_ids that don't
+        match a VM are ignored
+        """
+        ext_ids = iter(ext_ids)
+        while True:
+            chunk = list(islice(ext_ids, EXT_IDS_PER_REQUEST))
+            if not chunk:
+                return
+            yield from self.vms_matching(
+                " or ".join(f"extId eq '{ext_id}'" for ext_id in chunk)
+            )
+
+    def pending(self, vms: Iterable) -> Iterator[Tuple[str, List[str]]]:
+        """
+        yield (ext_id, missing category ext_ids) for every VM that doesn't
+        already have all of the categories
+        the number of VMs skipped is counted in self.skipped
+        """
+        self.skipped = 0
+        for vm in vms:
+            current = {category.ext_id for category in vm.categories or []}
+            missing = [
+                ext_id for ext_id in self.category_ext_ids if ext_id not in current
+            ]
+            if missing:
+                yield vm.ext_id, missing
+            else:
+                self.skipped += 1
+
+    def payloads(self, pending: Iterable[Tuple[str, List[str]]]) -> Iterator[dict]:
+        """
+        yield one associate-categories payload per pending VM
+        ETags are prefetched prefetch_size VMs at a time, as payloads are
+        needed
+        """
+        pending = iter(pending)
+        while True:
+            chunk = list(islice(pending, self.prefetch_size))
+            if not chunk:
+                return
+            vms = self.cache.prefetch(
+                "vmm",
+                [ext_id for ext_id, _ in chunk],
+                self.vm_api.get_vm_by_id,
+                workers=self.workers,
+            )
+            for ext_id, missing in chunk:
+                yield self._payload(ext_id, missing, vms[ext_id])
+
+    def run(
+        self,
+        pending: Iterable[Tuple[str, List[str]]],
+        on_batch: Optional[Callable] = None,
+    ) -> List[BatchResult]:
+        """
+        associate the missing categories with every pending VM and block
+        until all batches have finished
+        VMs that were updated are removed from the cache, since their ETags
+        have changed
+        """
+        results = self.scheduler.run(self.payloads(pending), on_batch=on_batch)
+        self.cache.invalidate(
+            "vmm",
+            [item.ext_id for result in results for item in result.items if item.succeeded],
+        )
+        return results
+
+    def _payload(self, ext_id: str, missing: List[str], vm) -> dict:
+        """
+        build the payload for one VM
+        """
+        return self.builder.build(
+            {
+                "ext_id": ext_id,
+                "etag": self.vmm_client.get_etag(vm),
+                "categories": [{"extId": category} for category in missing],
+            }
+        )
+
+    def _refresh(self, item_result: ItemResult):
+        """
+        rebuild a failed payload with the VM's current ETag if the ETag it
+        was sent with is out of date
+        """
+        if not item_result.stale_etag:
+            return item_result.payload
+        self.cache.invalidate("vmm", [item_result.ext_id])
+        vm = self.cache.get("vmm", item_result.ext_id, self.vm_api.get_vm_by_id)
+        missing = [
+            category["extId"] for category in item_result.payload["data"]["categories"]
+        ]
+        return self._payload(item_result.ext_id, missing, vm)
@@ -0,0 +1,146 @@
+"""
+Simple module to allow function re-use across Nutanix
+v4 SDK code samples
+
+Requires Prism Central 7.5 or later, AOS 7.5 or later
+"""
+
+import csv
+import json
+import os
+import re
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+# a template string that is exactly one placeholder, e.g. "{memory_size_bytes}"
+# is replaced by the parameter itself, so numbers, booleans, lists etc keep
+# their type
+PLACEHOLDER = re.compile(r"^\{(\w+)\}$")
+
+
+def read_parameters(path: str) -> Iterator[dict]:
+    """
+    yield one dictionary of parameters per row of a CSV file (.csv, using
+    the header row as the keys) or JSON lines file (any other extension,
+    one JSON object per line)
+    rows are read as they are needed, so the file can be any size
+    CSV values are always strings; use a JSON lines file, or the
+    PayloadBuilder prepare function, for other types
+    """
+    with open(path, newline="") as f:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def render(template, parameters: dict):
+    """
+    return a copy of template with every "{name}" placeholder in its string
+    values replaced from parameters
+    template can be any combination of dictionaries, lists and values, e.g.
+    a VM in the same JSON format the v4 API accepts
+    """
+    if isinstance(template, str):
+        match = PLACEHOLDER.match(template)
+        if match:
+            return parameters[match.group(1)]
+        return template.format_map(parameters)
+    if isinstance(template, dict):
+        return {key: render(value, parameters) for key, value in template.items()}
+    if isinstance(template, list):
+        return [render(value, parameters) for value in template]
+    return template
+
+
+def dumps(payload: dict) -> str:
+    """
+    serialise a payload as compact, single-line JSON
+    """
+    return json.dumps(payload, separators=(",", ":"))
+
+
+class PayloadBuilder:
+    """
+    class to build batch payloads lazily from a template and a source of
+    parameters, e.g. a CSV or JSON lines file
+
+    payloads are plain dictionaries in the v4 API's JSON format rather than
+    SDK models, so no model objects are created or converted, and one
+    payload is built at a time as the BatchScheduler asks for it; only the
+    batches being submitted are ever held in memory
+
+    example:
+
+        builder = PayloadBuilder(
+            {"name": "{name}", "memorySizeBytes": "{memory_size_bytes}",
+             "cluster": {"extId": "{cluster_ext_id}"}},
+            prepare=lambda row: {**row, "memory_size_bytes": int(row["memory_mib"]) * 1024 * 1024},
+        )
+        scheduler.run(builder.payloads(read_parameters("vms.csv"), cluster_ext_id=cluster_ext_id))
+
+    path and headers are templates for the payload metadata, e.g.
+    path={"extId": "{ext_id}"}, headers={"If-Match": "{etag}"}
+    """
+
+    def __init__(
+        self,
+        data: dict,
+        path: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        prepare: Optional[Callable[[dict], dict]] = None,
+    ):
+        """
+        class constructor
+        prepare(parameters) can return changed or additional parameters for
+        each row before the templates are rendered, e.g. to convert types
+        """
+        self.data = data
+        self.path = path or {}
+        self.headers = headers or {}
+        self.prepare = prepare
+
+    def build(self, parameters: dict) -> dict:
+        """
+        return the payload for one set of parameters
+        """
+        if self.prepare:
+            parameters = self.prepare(parameters)
+        payload = {"data": render(self.data, parameters)}
+        metadata = {}
+        if self.headers:
+            metadata["headers"] = [
+                {"name": name, "value": render(value, parameters)}
+                for name, value in self.headers.items()
+            ]
+        if self.path:
+            metadata["path"] = [
+                {"name": name, "value": render(value, parameters)}
+                for name, value in self.path.items()
+            ]
+        if metadata:
+            payload["metadata"] = metadata
+        return payload
+
+    def payloads(self, parameters: Iterable[dict], **common) -> Iterator[dict]:
+        """
+        yield one payload per set of parameters
+        common parameters, e.g. a cluster ext_id, are added to every row;
+        each row also gets its position as "index"
+        """
+        for index, row in enumerate(parameters):
+            yield self.build({**common, "index": index, **row})
+
+    def write(self, path: str, parameters: Iterable[dict], **common) -> int:
+        """
+        write the payloads to a JSON lines file, one compact payload per
+        line, e.g. to review them before submitting
+        returns the number of payloads written
+        """
+        count = 0
+        with open(path, "w") as f:
+            for payload in self.payloads(parameters, **common):
+                f.write(dumps(payload) + "\n")
+                count += 1
+        return count
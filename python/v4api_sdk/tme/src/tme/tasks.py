@@ -0,0 +1,316 @@
+"""
+Simple module to allow function re-use across Nutanix
+v4 SDK code samples
+
+Requires Prism Central 7.5 or later, AOS 7.5 or later
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, InvalidStateError
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+import urllib3
+import ntnx_prism_py_client
+from ntnx_prism_py_client.rest import ApiException as PrismException
+
+from .apiclient import ApiClient
+
+if TYPE_CHECKING:
+    from .utils import Config
+
+# a task in one of these states will not change again, or needs someone to
+# act on it before it does; SUSPENDED ends a wait, as it did when
+# Utils.monitor_task polled until the task was no longer RUNNING
+TERMINAL_STATUSES = {"SUCCEEDED", "FAILED", "CANCELED", "SUSPENDED"}
+
+# default number of seconds wait() blocks before raising TimeoutError
+DEFAULT_WAIT_TIMEOUT = 6 * 60 * 60
+
+# a watched task that list_tasks hasn't returned for this many polls in a row
+# e.g. a mistyped or purged ext_id, fails with TaskNotFoundError
+DEFAULT_MAX_MISSED_POLLS = 10
+
+# the tasks list API returns a maximum of 100 tasks per request
+MAX_TASKS_PER_REQUEST = 100
+
+
+class TaskNotFoundError(LookupError):
+    """
+    raised by a watched task's future when Prism Central doesn't return the
+    task after several polls
+    """
+
+
+class TaskTracker:
+    """
+    class to watch any number of Prism Central tasks at the same time
+
+    instead of polling every task individually with get_task_by_id,
+    all watched tasks are checked together using filtered list_tasks
+    requests (up to 100 tasks per request) from a single background
+    thread, so the number of requests stays roughly the same whether
+    1 or 1000 tasks are being watched
+
+    the polling interval starts at min_interval and backs off towards
+    max_interval while nothing changes; it drops back to min_interval
+    as soon as a task makes progress or a new task is watched
+
+    each watched task gets a concurrent.futures.Future that resolves
+    to the final task once it finishes; callbacks and asyncio
+    awaitables are built on top of these futures
+
+    a future raises instead of resolving if its on_update callback raises,
+    if the task isn't found after max_missed_polls polls, or, for every
+    unfinished task, if polling fails with an unexpected error
+    """
+
+    def __init__(
+        self,
+        config: "Config",
+        min_interval: float = 1,
+        max_interval: float = 30,
+        backoff: float = 2,
+        max_missed_polls: int = DEFAULT_MAX_MISSED_POLLS,
+    ):
+        """
+        class constructor
+        """
+        prism_client = ApiClient.get(config, "ntnx_prism_py_client").api_client
+        self.tasks_api = ntnx_prism_py_client.api.TasksApi(api_client=prism_client)
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max(max_interval, min_interval))
+        self.backoff = backoff
+        self.max_missed_polls = max_missed_polls
+
+        self._futures: Dict[str, Future] = {}
+        self._update_callbacks: Dict[str, List[Callable]] = {}
+        self._last_seen: Dict[str, tuple] = {}
+        self._missed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(
+        self,
+        ext_id: str,
+        callback: Optional[Callable] = None,
+        on_update: Optional[Callable] = None,
+    ) -> Future:
+        """
+        start watching a task and return a Future for it
+        callback(task) is called once the task has finished
+        on_update(task) is called every time the task's status or
+        progress percentage changes, including when it finishes
+        watching a task that is already being watched returns the
+        existing Future
+        """
+        with self._lock:
+            future = self._futures.get(ext_id)
+            if future is None:
+                future = Future()
+                self._futures[ext_id] = future
+                self._update_callbacks[ext_id] = []
+            if on_update and not future.done():
+                self._update_callbacks[ext_id].append(on_update)
+            self._start()
+        if callback:
+            future.add_done_callback(lambda done: callback(done.result()))
+        self._wakeup.set()
+        return future
+
+    def watch_many(
+        self, ext_ids: Iterable[str], callback: Optional[Callable] = None
+    ) -> List[Future]:
+        """
+        start watching several tasks at once
+        """
+        return [self.watch(ext_id, callback=callback) for ext_id in ext_ids]
+
+    def wait(
+        self,
+        ext_ids: Iterable[str],
+        timeout: Optional[float] = DEFAULT_WAIT_TIMEOUT,
+        on_update: Optional[Callable] = None,
+    ) -> list:
+        """
+        block until every specified task has finished, then return the
+        final tasks in the same order as ext_ids
+        raises concurrent.futures.TimeoutError if the tasks haven't
+        finished within timeout seconds (None waits indefinitely),
+        TaskNotFoundError if a task doesn't exist, or the exception raised
+        by on_update
+        """
+        futures = [self.watch(ext_id, on_update=on_update) for ext_id in ext_ids]
+        return [future.result(timeout=timeout) for future in futures]
+
+    async def wait_async(self, ext_id: str):
+        """
+        awaitable version of watch(), for use with asyncio
+        returns the final task once it has finished
+        """
+        return await asyncio.wrap_future(self.watch(ext_id))
+
+    def poll(self) -> bool:
+        """
+        check every unfinished task once, using as few list_tasks
+        requests as possible
+        returns True if any task changed since the last poll
+        """
+        with self._lock:
+            pending = [
+                ext_id for ext_id, future in self._futures.items() if not future.done()
+            ]
+
+        changed = False
+        for start in range(0, len(pending), MAX_TASKS_PER_REQUEST):
+            chunk = pending[start : start + MAX_TASKS_PER_REQUEST]
+            ext_id_list = ", ".join(f"'{ext_id}'" for ext_id in chunk)
+            task_list = self.tasks_api.list_tasks(
+                async_req=False,
+                _filter=f"extId in ({ext_id_list})",
+                _limit=MAX_TASKS_PER_REQUEST,
+            )
+            found = set()
+            for task in task_list.data or []:
+                found.add(task.ext_id)
+                if self._update(task):
+                    changed = True
+            for ext_id in chunk:
+                if ext_id not in found:
+                    self._missing(ext_id)
+        return changed
+
+    def stop(self):
+        """
+        stop the background polling thread
+        unfinished tasks are cancelled i.e. their futures are cancelled
+        """
+        with self._lock:
+            futures = list(self._futures.values())
+            thread = self._thread
+            self._thread = None
+        for future in futures:
+            future.cancel()
+        self._wakeup.set()
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _update(self, task) -> bool:
+        """
+        record the latest state of a task, run its callbacks and
+        resolve its future if it has finished
+        returns True if the task changed since it was last seen
+        """
+        state = (str(task.status), task.progress_percentage)
+        with self._lock:
+            future = self._futures.get(task.ext_id)
+            if future is None or future.done():
+                return False
+            if self._last_seen.get(task.ext_id) == state:
+                return False
+            self._last_seen[task.ext_id] = state
+            self._missed.pop(task.ext_id, None)
+            update_callbacks = list(self._update_callbacks[task.ext_id])
+            finished = state[0] in TERMINAL_STATUSES
+            if finished:
+                self._update_callbacks.pop(task.ext_id)
+
+        for on_update in update_callbacks:
+            try:
+                on_update(task)
+            except Exception as error:
+                # surface the callback's error to whoever is waiting on the
+                # task, instead of ending the polling thread
+                self._fail([future], error)
+                return True
+        if finished:
+            future.set_result(task)
+        return True
+
+    def _missing(self, ext_id: str):
+        """
+        count a poll that didn't return a watched task, and fail the task
+        once it has been missing for max_missed_polls polls in a row
+        tasks that have been seen before aren't counted
+        """
+        with self._lock:
+            future = self._futures.get(ext_id)
+            if future is None or future.done() or ext_id in self._last_seen:
+                return
+            missed = self._missed.get(ext_id, 0) + 1
+            self._missed[ext_id] = missed
+        if missed >= self.max_missed_polls:
+            self._fail(
+                [future],
+                TaskNotFoundError(f"Task {ext_id} not found after {missed} polls"),
+            )
+
+    def _fail(self, futures: Iterable[Future], error: BaseException):
+        """
+        resolve every unfinished future in futures with error
+        """
+        for future in futures:
+            if not future.done():
+                try:
+                    future.set_exception(error)
+                except InvalidStateError:
+                    # finished or cancelled by another thread in the meantime
+                    pass
+
+    def _start(self):
+        """
+        start the background polling thread, if it isn't already running
+        must be called with self._lock held
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="tme-task-tracker", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        """
+        background polling loop
+        exits once every watched task has finished
+        """
+        interval = self.min_interval
+        while True:
+            with self._lock:
+                if self._thread is not threading.current_thread():
+                    return
+                if all(future.done() for future in self._futures.values()):
+                    self._thread = None
+                    return
+            self._wakeup.clear()
+
+            try:
+                changed = self.poll()
+            except (PrismException, urllib3.exceptions.HTTPError):
+                # treat API and connection errors as "no change" and back off
+                # before retrying
+                changed = False
+            except Exception as error:
+                # anything else e.g. a task that can't be deserialised won't
+                # fix itself; fail every unfinished task so nothing waits on
+                # a thread that has stopped
+                with self._lock:
+                    futures = list(self._futures.values())
+                    if self._thread is threading.current_thread():
+                        self._thread = None
+                self._fail(futures, error)
+                return
+
+            interval = (
+                self.min_interval
+                if changed
+                else min(interval * self.backoff, self.max_interval)
+            )
+            if self._wakeup.wait(interval):
+                interval = self.min_interval
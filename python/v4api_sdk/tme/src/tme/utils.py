@@ -5,20 +5,73 @@ v4 SDK code samples
 Requires Prism Central 7.5 or later, AOS 7.5 or later
 """
 
-import time
 import urllib3
 import argparse
 import getpass
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Sequence, Union
 from timeit import default_timer as timer
 from rich import print
 
 import ntnx_prism_py_client
-from ntnx_prism_py_client import ApiClient as PrismClient
 from ntnx_prism_py_client import Configuration as PrismConfiguration
 
 from termcolor import colored,cprint
 
+from .apiclient import ApiClient
+from .tasks import TaskTracker
+
+# v4 list APIs return a maximum of 100 entities per page
+MAX_PAGE_SIZE = 100
+
+
+def paginate(
+    api_method: Callable,
+    page_size: int = MAX_PAGE_SIZE,
+    select: Optional[Union[str, Sequence[str]]] = None,
+    prefetch: bool = True,
+    **filters,
+) -> Iterator:
+    """
+    yield every entity returned by a v4 list API method, one page at a time
+    e.g. paginate(vmm_instance.list_vms, _filter="startswith(name, 'dev')")
+    any other list parameters such as _filter or _orderby are passed through
+    to every request
+    select is a list (or comma-separated string) of the fields to return,
+    e.g. ["extId", "name"]; the response then only includes those fields,
+    which is much smaller than the full entity models
+    paging stops once metadata.total_available_results entities have been
+    returned or a page comes back empty
+    when prefetch is True the next page is requested in the background
+    while the caller processes the current one
+    """
+    if select:
+        filters["_select"] = select if isinstance(select, str) else ",".join(select)
+
+    def get_page(page: int):
+        return api_method(async_req=False, _page=page, _limit=page_size, **filters)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = 0
+        next_page = executor.submit(get_page, page)
+        while next_page is not None:
+            response = next_page.result()
+            data = response.data or []
+            total = getattr(response.metadata, "total_available_results", None)
+            more = len(data) == page_size and (
+                total is None or (page + 1) * page_size < total
+            )
+
+            page += 1
+            next_page = None
+            if more and prefetch:
+                next_page = executor.submit(get_page, page)
+            yield from data
+            if more and not prefetch:
+                next_page = executor.submit(get_page, page)
+
+
 @dataclass
 class Config:
     """
@@ -42,16 +95,15 @@ class Utils:
         """
         class constructor
         create reusable instances of Prism connections (etc)
+        the Prism client comes from the shared ApiClient cache, so every
+        Utils instance for the same Prism Central re-uses one connection pool
         """
-        self.prism_config = PrismConfiguration()
-        self.prism_config.host = pc_ip
-        self.prism_config.username = username
-        self.prism_config.password = password
-        self.prism_config.verify_ssl = False
-        self.prism_client = PrismClient(configuration=self.prism_config)
-        self.prism_client.add_default_header(
-            header_name="Accept-Encoding", header_value="gzip, deflate, br"
+        prism = ApiClient.get(
+            Config(pc_ip=pc_ip, pc_username=username, pc_password=password),
+            "ntnx_prism_py_client",
         )
+        self.prism_config = prism.configuration
+        self.prism_client = prism.api_client
         self.prism_instance = ntnx_prism_py_client.api.TasksApi(
             api_client=self.prism_client
         )
@@ -109,44 +161,48 @@ class Utils:
         return yes_no == "yes"
 
     def monitor_task(
-        self, task_ext_id, task_name, pc_ip, username, password, poll_timeout=1, prefix = ""
+        self, task_ext_id, task_name, pc_ip, username, password, poll_timeout=1, prefix = "",
+        timeout=None
     ):
         """
         method used to monitor Prism Central tasks
         will print a series of period characters and re-check task
         status at the specified interval
         this version uses the Prism SDK
+        stops when the task succeeds, fails, is cancelled or is suspended
+        by default this waits for as long as the task runs, as it always
+        has; pass timeout (seconds) to raise concurrent.futures.TimeoutError
+        instead.  tme.tasks.TaskNotFoundError is raised if the task doesn't
+        exist
         """
         start = timer()
         # print message until specified  task is finished
-        prism_config = PrismConfiguration()
-        prism_config.host = pc_ip
-        prism_config.username = username
-        prism_config.password = password
-        prism_config.verify_ssl = False
-        prism_client = PrismClient(configuration=prism_config)
-        prism_client.add_default_header(
-            header_name="Accept-Encoding", header_value="gzip, deflate, br"
+        # the task is watched by a TaskTracker, which polls using the cached
+        # Prism client; the interval is fixed at poll_timeout rather than
+        # backing off, so completion is seen as promptly as before
+        tracker = TaskTracker(
+            Config(pc_ip=pc_ip, pc_username=username, pc_password=password),
+            min_interval=float(poll_timeout),
+            max_interval=float(poll_timeout),
         )
-        prism_instance = ntnx_prism_py_client.api.TasksApi(api_client=prism_client)
-        task = prism_instance.get_task_by_id(f"{prefix}{task_ext_id}")
         units = "second" if poll_timeout == 1 else "seconds"
         print(
             f"{task_name} running, checking progress every {poll_timeout} {units} (progress will update when percentage complete changes) ...",
             end="",
         )
-        percent_complete = 0
-        print(f" {task.data.progress_percentage}% ... ", end="", flush=True)
-        while True:
-            if task.data.status == "RUNNING":
-                if task.data.progress_percentage > percent_complete:
-                    print(f" {task.data.progress_percentage}% ... ", end="", flush=True)
-                    percent_complete = task.data.progress_percentage
-            else:
-                print("finished.")
-                break
-            time.sleep(int(poll_timeout))
-            task = prism_instance.get_task_by_id(f"{prefix}{task_ext_id}")
+        percent_complete = None
+
+        def show_progress(task):
+            nonlocal percent_complete
+            progress = task.progress_percentage or 0
+            if percent_complete is None or progress > percent_complete:
+                print(f" {progress}% ... ", end="", flush=True)
+                percent_complete = progress
+
+        tracker.wait(
+            [f"{prefix}{task_ext_id}"], timeout=timeout, on_update=show_progress
+        )
+        print("finished.")
         end = timer()
         elapsed_time = end - start
         if elapsed_time <= 60:
@@ -0,0 +1,268 @@
+"""
+tests for tme.batches, using fake batch, task and tracker APIs so no
+Prism Central instance is required
+"""
+
+import datetime
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+from tme.batches import NOT_RUN, BatchScheduler, failed_payloads
+from tme.utils import Config
+
+STARTED = datetime.datetime(2026, 1, 1)
+
+
+def payload(ext_id):
+    """
+    a payload for one entity, identified by its extId path parameter
+    """
+    return {"data": {}, "metadata": {"path": [{"name": "extId", "value": ext_id}]}}
+
+
+def job(ext_id, status="SUCCEEDED", entities=None, errors=None):
+    """
+    a fake TaskJob
+    entities are the ext_ids of the affected entities; errors are
+    (code, message) pairs
+    """
+    return SimpleNamespace(
+        ext_id=ext_id,
+        status=status,
+        entities_affected=(
+            None if entities is None else [SimpleNamespace(ext_id=e) for e in entities]
+        ),
+        error_messages=[
+            SimpleNamespace(code=code, message=message) for code, message in errors or []
+        ],
+    )
+
+
+class FakeTasksApi:
+    """
+    list_task_jobs returns the jobs set for each task, a page at a time
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def list_task_jobs(self, task_ext_id, async_req=False, _page=0, _limit=100):
+        jobs = self.jobs[task_ext_id]
+        return SimpleNamespace(
+            data=jobs[_page * _limit : (_page + 1) * _limit],
+            metadata=SimpleNamespace(total_available_results=len(jobs)),
+        )
+
+
+class FakeBatchesApi:
+    """
+    submit_batch records every batch and names its task t0, t1, ...
+    """
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit_batch(self, async_req, body):
+        self.submitted.append(body)
+        return SimpleNamespace(
+            data=SimpleNamespace(ext_id=f"t{len(self.submitted) - 1}")
+        )
+
+
+class FakeTracker:
+    """
+    every batch task has already finished; each job's outcome decides
+    whether it failed
+    """
+
+    def __init__(self, tasks_api):
+        self.tasks_api = tasks_api
+
+    def watch(self, task_ext_id):
+        jobs = self.tasks_api.jobs[task_ext_id]
+        failed = sum(1 for j in jobs if j.status != "SUCCEEDED")
+        future = Future()
+        future.set_result(
+            SimpleNamespace(
+                status="FAILED" if failed else "SUCCEEDED",
+                started_time=STARTED,
+                completed_time=STARTED,
+                batch_summary=SimpleNamespace(number_of_jobs_failed=failed),
+            )
+        )
+        return future
+
+
+@pytest.fixture
+def scheduler():
+    tasks_api = FakeTasksApi()
+    scheduler = BatchScheduler(
+        Config("10.0.0.1", "admin", "password"),
+        action="ACTION",
+        uri="/api/vmm/v4.2/ahv/config/vms/{extId}/$actions/test",
+        retries=0,
+        tracker=FakeTracker(tasks_api),
+    )
+    scheduler.tasks_api = tasks_api
+    scheduler.batches_api = FakeBatchesApi()
+    return scheduler
+
+
+def harvest(scheduler, jobs, payloads):
+    scheduler.tasks_api.jobs["t"] = jobs
+    return scheduler.harvest("t", payloads)
+
+
+def test_harvest_matches_reordered_jobs_by_entity(scheduler):
+    payloads = [payload("vm0"), payload("vm1"), payload("vm2")]
+    jobs = [
+        job("j2", "FAILED", ["vm2"], [("VMM-1", "bad")]),
+        job("j0", entities=["vm0"]),
+        job("j1", entities=["vm1"]),
+    ]
+    results = harvest(scheduler, jobs, payloads)
+    assert [r.job_ext_id for r in results] == ["j0", "j1", "j2"]
+    assert [r.status for r in results] == ["SUCCEEDED", "SUCCEEDED", "FAILED"]
+    assert results[2].errors == ["VMM-1: bad"]
+    assert results[2].payload == payloads[2]
+    assert results[0].payload is None
+
+
+def test_harvest_matches_jobs_without_entities_by_position(scheduler):
+    payloads = [payload("vm0"), payload("vm1"), {"data": {"name": "new"}}]
+    jobs = [job("j0"), job("j1", "FAILED"), job("j2")]
+    results = harvest(scheduler, jobs, payloads)
+    assert [r.job_ext_id for r in results] == ["j0", "j1", "j2"]
+    assert [r.succeeded for r in results] == [True, False, True]
+
+
+def test_harvest_mixes_entity_and_position_matches(scheduler):
+    # j0 has no entity, so it takes position 0 even though it is listed
+    # after a job that names vm1
+    payloads = [payload("vm0"), payload("vm1")]
+    jobs = [job("j1", entities=["vm1"]), job("j0")]
+    results = harvest(scheduler, jobs, payloads)
+    assert [r.job_ext_id for r in results] == ["j0", "j1"]
+
+
+def test_harvest_records_payloads_without_a_job_as_not_run(scheduler):
+    payloads = [payload("vm0"), payload("vm1")]
+    results = harvest(scheduler, [job("j0", entities=["vm0"])], payloads)
+    assert results[1].status == NOT_RUN
+    assert results[1].payload == payloads[1]
+
+
+def test_harvest_more_jobs_than_payloads(scheduler):
+    payloads = [payload("vm0"), payload("vm1")]
+    jobs = [job("j0"), job("j1"), job("j2"), job("j3", "FAILED")]
+    results = harvest(scheduler, jobs, payloads)
+    assert len(results) == 2
+    # the extra jobs are recorded against the last payload, and the failed
+    # one fails it
+    assert results[0].succeeded
+    assert results[1].status == "FAILED"
+    assert len(results[1].errors) == 2
+    assert all("could not be matched" in error for error in results[1].errors)
+    assert results[1].payload == payloads[1]
+
+
+def test_harvest_extra_succeeded_job_keeps_status(scheduler):
+    payloads = [payload("vm0")]
+    results = harvest(scheduler, [job("j0"), job("j1")], payloads)
+    assert results[0].succeeded
+    assert results[0].errors and "j1" in results[0].errors[0]
+
+
+def test_harvest_failed_job_collides_with_succeeded_job(scheduler):
+    # both jobs name vm0; with no free payload left, the failed job is
+    # recorded against vm0, not dropped
+    payloads = [payload("vm0"), payload("vm1")]
+    jobs = [
+        job("j0", entities=["vm0"]),
+        job("j1", entities=["vm1"]),
+        job("jx", "FAILED", ["vm0"]),
+    ]
+    results = harvest(scheduler, jobs, payloads)
+    assert results[0].job_ext_id == "j0"
+    assert results[0].status == "FAILED"
+    assert "jx" in results[0].errors[0]
+    assert results[0].payload == payloads[0]
+    assert results[1].succeeded
+
+
+def test_harvest_colliding_job_fills_a_free_payload(scheduler):
+    # vm1's job doesn't report its entity, so the second job naming vm0
+    # is given to vm1 rather than discarded
+    payloads = [payload("vm0"), payload("vm1")]
+    jobs = [job("j0", entities=["vm0"]), job("j1", "FAILED", ["vm0"])]
+    results = harvest(scheduler, jobs, payloads)
+    assert [r.job_ext_id for r in results] == ["j0", "j1"]
+    assert results[1].status == "FAILED"
+
+
+def test_stale_etag_uses_exact_error_codes(scheduler):
+    payloads = [payload("vm0"), payload("vm1"), payload("vm2")]
+    jobs = [
+        job("j0", "FAILED", ["vm0"], [("412", "Precondition failed")]),
+        job("j1", "FAILED", ["vm1"], [("VMM-41203", "missing ETag header")]),
+        job("j2", "FAILED", ["vm2"], [(None, "entity 412 has a stale etag")]),
+    ]
+    results = harvest(scheduler, jobs, payloads)
+    assert [r.stale_etag for r in results] == [True, False, False]
+
+
+def write_lines(path, lines):
+    with open(path, "w") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+
+
+def test_run_retries_from_and_writes_to_the_same_results_file(scheduler, tmp_path):
+    results_path = tmp_path / "results.jsonl"
+    write_lines(
+        results_path,
+        [
+            {"item": 0, "attempt": 0, "status": "SUCCEEDED"},
+            {"item": 1, "attempt": 0, "status": "FAILED", "payload": payload("vm1")},
+            {"item": 2, "attempt": 0, "status": "FAILED", "payload": payload("vm2")},
+        ],
+    )
+    scheduler.results_path = str(results_path)
+    scheduler.tasks_api.jobs["t0"] = [
+        job("j1", entities=["vm1"]),
+        job("j2", "FAILED", ["vm2"]),
+    ]
+
+    results = scheduler.run(failed_payloads(str(results_path)))
+
+    # both failed payloads were read before the file was replaced
+    assert [len(batch.payload) for batch in scheduler.batches_api.submitted] == [2]
+    assert results[0].size == 2
+    assert not (tmp_path / "results.jsonl.partial").exists()
+    lines = [json.loads(line) for line in results_path.read_text().splitlines()]
+    assert [line["status"] for line in lines] == ["SUCCEEDED", "FAILED"]
+    assert list(failed_payloads(str(results_path))) == [payload("vm2")]
+
+
+def test_run_keeps_results_file_when_interrupted(scheduler, tmp_path):
+    results_path = tmp_path / "results.jsonl"
+    original = {"item": 0, "attempt": 0, "status": "FAILED", "payload": payload("vm0")}
+    write_lines(results_path, [original])
+    scheduler.results_path = str(results_path)
+
+    def payloads():
+        yield from failed_payloads(str(results_path))
+        raise RuntimeError("interrupted")
+
+    scheduler.batch_size = 1
+    scheduler.max_in_flight = 1
+    scheduler.tasks_api.jobs["t0"] = [job("j0", entities=["vm0"])]
+    with pytest.raises(RuntimeError):
+        scheduler.run(payloads())
+
+    assert json.loads(results_path.read_text()) == original
+    partial = (tmp_path / "results.jsonl.partial").read_text().splitlines()
+    assert json.loads(partial[0])["status"] == "SUCCEEDED"
@@ -12,13 +12,12 @@ import sys
 from rich import print
 
 import ntnx_vmm_py_client
-from ntnx_vmm_py_client import Configuration as VmmConfiguration
-from ntnx_vmm_py_client import ApiClient as VmmClient
 from ntnx_vmm_py_client.rest import ApiException as VMMException
 
 # small library that manages commonly-used tasks across these code samples
 from tme.utils import Utils
 from tme.apiclient import ApiClient
+from tme.cache import EntityCache
 
 
 def main():
@@ -35,26 +34,23 @@ def main():
 
     try:
 
-        # create the configuration instance
-        # this per-namespace class manages all Prism Central connection settings
-        vmm_config = VmmConfiguration()
-
-        for config in [vmm_config]:
-            config.host = script_config.pc_ip
-            config.port = "9440"
-            config.username = script_config.pc_username
-            config.password = script_config.pc_password
-            config.verify_ssl = False
-
-        # create the instance of the ApiClient class
-        vmm_client  = VmmClient(configuration=vmm_config)
+        # get the shared API client for the vmm namespace
+        # tme.apiclient.ApiClient configures the client once, including
+        # connection pool size and gzip, then re-uses it for the whole run
+        vmm_client = ApiClient.get(script_config, "ntnx_vmm_py_client").api_client
 
         # create the API class instances
         vmm_instance = ntnx_vmm_py_client.api.ImagesApi(api_client=vmm_client)
 
+        # the image list and image details are kept in a local cache
+        # repeated runs within the cache TTL don't request them again, and
+        # after the TTL the image is revalidated with If-None-Match, which
+        # only returns the full image if it has changed
+        cache = EntityCache(script_config)
+
         # get a list of existing images
-        images_list = vmm_instance.list_images(
-            async_req=False
+        images_list = cache.get_list(
+            "vmm", "images", lambda: vmm_instance.list_images(async_req=False)
         )
         if images_list.metadata.total_available_results > 0:
             print(f"Images found: {len(images_list.data)}")
@@ -65,7 +61,9 @@ def main():
         # images have been found - update the first image in the list
         # to begin, we must retrieve that image's details
         print("Getting image ...")
-        existing_image = vmm_instance.get_image_by_id(images_list.data[0].ext_id)
+        existing_image = cache.get(
+            "vmm", images_list.data[0].ext_id, vmm_instance.get_image_by_id
+        )
 
         # get the existing image's Etag
         existing_image_etag = vmm_client.get_etag(existing_image)
@@ -79,16 +77,19 @@ def main():
         new_image.name = f"{existing_image.data.name} - Updated"
         new_image.type = existing_image.data.type
 
-        # add the existing image's Etag as a new request header
-        vmm_client.add_default_header(
-            header_name="If-Match",
-            header_value=existing_image_etag
-        )
-
         # update the image using a synchronous request (will wait until completion before returning)
+        # the existing image's Etag is sent as the If-Match header for this
+        # request only, since the API client is shared
         image_update = vmm_instance.update_image_by_id(
-            body=new_image, extId=existing_image.data.ext_id, async_req=False
+            body=new_image,
+            extId=existing_image.data.ext_id,
+            async_req=False,
+            if_match=existing_image_etag,
         )
+        # the update changes the image's name and Etag, so drop the cached
+        # copies
+        cache.invalidate("vmm", [existing_image.data.ext_id, "list:images"])
+
         task_extid = image_update.data.ext_id
         utils.monitor_task(
             task_ext_id=task_extid,